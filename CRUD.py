@@ -1,11 +1,17 @@
-import psycopg2
 import time
 import random
 import math
 import datetime
 from multiprocessing import Pool, Value, Lock
 import os
-from connection import DSN
+from log_sink import get_logger
+import db_pool
+from prepared import statement_registry
+from indexed_set import IndexedSet
+from ledger import to_cents
+from backends import get_backend
+
+backend = get_backend()
 
 class Random:
     def __init__(self, seed):
@@ -44,6 +50,15 @@ class Random:
     def from_list(self, l, length=1):
         return self.rng.choices(l, k=length)
 
+    def choice(self, l):
+        return self.rng.choice(l)
+
+    def choices(self, l, weights=None, k=1):
+        return self.rng.choices(l, weights=weights, k=k)
+
+    def uniform(self, low, high):
+        return self.rng.uniform(low, high)
+
 
 class DBConn:
     def __init__(self, statement_timeout=0):
@@ -53,34 +68,68 @@ class DBConn:
         self.statement_timeout = statement_timeout
 
     def __enter__(self):
-        options = f'-c statement_timeout={self.statement_timeout}'
         try:
-            self.conn = psycopg2.connect(
-                dsn=DSN,
-                options=options
-            )
-            self.conn.autocommit = True
+            self.conn = db_pool.getconn(autocommit=True)
             self.cursor = self.conn.cursor()
-        except psycopg2.Error as e:
-            print(f"数据库连接失败: {e}") 
+            if self.statement_timeout:
+                backend.set_statement_timeout(self.cursor, self.statement_timeout)
+        except backend.Error as e:
+            get_logger().error("数据库连接失败: %s", e)
+            if self.conn:
+                db_pool.putconn(self.conn, discard=True)
+                self.conn = None
             raise
         return self
 
+    def reconnect(self):
+        # 丢弃已断开的连接并从连接池取一个新连接，DBConn 对象本身保持不变
+        if self.conn:
+            statement_registry.forget(self.conn)
+            db_pool.putconn(self.conn, discard=True)
+            self.conn = None
+            self.cursor = None
+        self.conn = db_pool.getconn(autocommit=True)
+        try:
+            self.cursor = self.conn.cursor()
+            if self.statement_timeout:
+                backend.set_statement_timeout(self.cursor, self.statement_timeout)
+        except backend.Error:
+            db_pool.putconn(self.conn, discard=True)
+            self.conn = None
+            raise
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.cursor:
+        if self.cursor and not self.cursor.closed:
             self.cursor.close()
         if self.conn:
-            self.conn.close()
+            discard = bool(self.conn.closed) or exc_val is not None and backend.is_connection_error(exc_val)
+            if self.statement_timeout and not discard and not self.conn.closed:
+                try:
+                    with self.conn.cursor() as cur:
+                        backend.reset_statement_timeout(cur)
+                except backend.Error:
+                    discard = True
+            db_pool.putconn(self.conn, discard=discard)
         if exc_type:
-            print(f"事务中发生异常: {exc_val}") 
+            get_logger().error("事务中发生异常: %s", exc_val)
+
+# 自动提交模式下这些语句执行即提交，连接在返回结果前断开时结果未知
+WRITE_STATEMENTS = ('insert_order', 'update_order', 'delete_order')
 
 class OrderTransactionalWorker:
-    def __init__(self, worker_id, conn, transaction_ratios=None):
+    def __init__(self, worker_id, conn, transaction_ratios=None, order_registry=None):
         self.conn = conn
         self.random = Random(worker_id)
         self.worker_id = worker_id
+        self.log = get_logger()
         self.user_ids = []
-        self.existing_order_codes = set()
+        self.last_error = None
+        self.commit_in_flight = False
+        # 最近一次写事务 (事务类型, 键, 金额分)，供工作器写入提交账本；没有实际写入时为 None
+        self.last_write = None
+        # 提供共享登记表时，订单号由登记表无冲突分配，所有工作器看到同一份存活订单号
+        self.order_registry = order_registry.view(worker_id) if order_registry is not None else None
+        self.existing_order_codes = self.order_registry if self.order_registry is not None else IndexedSet()
         self._load_initial_data()
         self.lock = Lock()
 
@@ -104,50 +153,55 @@ class OrderTransactionalWorker:
                     conn.cursor.execute("INSERT INTO \"User\" (username) VALUES (%s) RETURNING id;", (f"temp_user_{self.worker_id}",))
                     self.user_ids.append(conn.cursor.fetchone()[0])
                     conn.conn.commit()
-                    print(f"为工作器 {self.worker_id} 插入了一个临时用户。")
-                conn.cursor.execute("SELECT order_code FROM \"Order\";")
-                self.existing_order_codes = {row[0] for row in conn.cursor.fetchall()}
-        except psycopg2.Error as e:
-            print(f"加载初始数据失败: {e}")
+                    self.log.info("为工作器 %s 插入了一个临时用户。", self.worker_id)
+                if self.order_registry is None:
+                    conn.cursor.execute("SELECT order_code FROM \"Order\";")
+                    self.existing_order_codes = IndexedSet(row[0] for row in conn.cursor.fetchall())
+        except backend.Error as e:
+            self.log.error("加载初始数据失败: %s", e)
             self.user_ids = [1]
-            self.existing_order_codes = set()
+            if self.order_registry is None:
+                self.existing_order_codes = IndexedSet()
 
 
-    def execute_sql(self, sql, args=None, explain=False, analyze=False):
+    def execute_sql(self, sql, args=None, explain=False, analyze=False, statement=None):
+        self.last_error = None
+        self.commit_in_flight = (not explain or analyze) and statement in WRITE_STATEMENTS
         try:
             if not explain:
-                self.conn.cursor.execute(sql, args)
+                if statement is not None:
+                    statement_registry.execute(self.conn.cursor, statement, sql, args)
+                else:
+                    self.conn.cursor.execute(sql, args)
                 return None
 
-            if analyze:
-                sql_prefix = "EXPLAIN (ANALYZE, FORMAT JSON) "
-            else:
-                sql_prefix = "EXPLAIN (FORMAT JSON) "
-
-            self.conn.cursor.execute(sql_prefix + sql, args)
-            return self.conn.cursor.fetchone()[0][0]
-        except psycopg2.Error as e:
-            print(f"工作器 {self.worker_id} 执行 SQL 失败: {e} SQL: {sql} Args: {args}")
+            return backend.explain(self.conn.cursor, sql, args, analyze)
+        except backend.Error as e:
+            self.last_error = e
+            self.log.error("工作器 %s 执行 SQL 失败: %s SQL: %s Args: %s", self.worker_id, e, sql, args)
             return None
 
     def insert_order(self, explain=False, analyze=False):
         if not self.user_ids:
-            print(f"工作器 {self.worker_id}: 无法插入订单，用户 ID 不可用。")
+            self.log.warning("工作器 %s: 无法插入订单，用户 ID 不可用。", self.worker_id)
             return None
 
         user_id = self.random.choice(self.user_ids)
 
         order_code = None
-        max_attempts = 100
-        for _ in range(max_attempts):
-            potential_order_code = self.random.randint_inclusive(100000000000, 999999999999)
-            with self.lock:
-                if potential_order_code not in self.existing_order_codes:
-                    order_code = potential_order_code
-                    self.existing_order_codes.add(order_code)
-                    break
+        if self.order_registry is not None:
+            order_code = self.order_registry.allocate()
+        else:
+            max_attempts = 100
+            for _ in range(max_attempts):
+                potential_order_code = self.random.randint_inclusive(100000000000, 999999999999)
+                with self.lock:
+                    if potential_order_code not in self.existing_order_codes:
+                        order_code = potential_order_code
+                        self.existing_order_codes.add(order_code)
+                        break
         if order_code is None:
-            print(f"工作器 {self.worker_id}: 生成唯一订单号失败，跳过插入。") 
+            self.log.warning("工作器 %s: 生成唯一订单号失败，跳过插入。", self.worker_id)
             return None
 
         payment = round(self.random.uniform(10.00, 5000.00), 2)
@@ -160,19 +214,25 @@ class OrderTransactionalWorker:
             VALUES (%s, %s, %s, %s, %s) RETURNING id;
         """
         args = (order_code, user_id, payment, create_time, update_time)
-        result = self.execute_sql(sql, args, explain, analyze)
+        self.last_write = ('insert', order_code, to_cents(payment)) if not explain else None
+        result = self.execute_sql(sql, args, explain, analyze, statement='insert_order')
+        if self.order_registry is not None and (not explain or analyze) and self.last_error is None:
+            self.order_registry.add(order_code)
         if not explain and result is not None:
-            print(f"工作器 {self.worker_id}: 订单插入成功，订单 ID: {result[0]}, 订单号: {order_code}") 
+            self.log.debug("工作器 %s: 订单插入成功，订单 ID: %s, 订单号: %s", self.worker_id, result[0], order_code)
         elif explain and result is not None:
-            print(f"工作器 {self.worker_id}: 插入订单的 EXPLAIN 计划: {result}")
+            self.log.info("工作器 %s: 插入订单的 EXPLAIN 计划: %s", self.worker_id, result)
         return result
 
     def select_order(self, explain=False, analyze=False):
         if not self.existing_order_codes:
-            print(f"工作器 {self.worker_id}: 无法查询订单，当前没有订单号。")
+            self.log.warning("工作器 %s: 无法查询订单，当前没有订单号。", self.worker_id)
             return None
 
-        order_code_to_select = self.random.choice(list(self.existing_order_codes))
+        order_code_to_select = self.existing_order_codes.choice(self.random.rng)
+        if order_code_to_select is None:
+            self.log.warning("工作器 %s: 无法查询订单，当前没有订单号。", self.worker_id)
+            return None
 
         sql = """
             SELECT id, order_code, user_id, payment, create_time, update_time
@@ -180,23 +240,26 @@ class OrderTransactionalWorker:
             WHERE order_code = %s;
         """
         args = (order_code_to_select,)
-        result = self.execute_sql(sql, args, explain, analyze)
-        if not explain and result is None:
+        result = self.execute_sql(sql, args, explain, analyze, statement='select_order')
+        if not explain and result is None and self.last_error is None:
             fetched_row = self.conn.cursor.fetchone()
             if fetched_row:
-                print(f"工作器 {self.worker_id}: 订单查询成功，订单号 {order_code_to_select}, 数据: {fetched_row}")
+                self.log.debug("工作器 %s: 订单查询成功，订单号 %s, 数据: %s", self.worker_id, order_code_to_select, fetched_row)
             else:
-                print(f"工作器 {self.worker_id}: 订单号 {order_code_to_select} 未找到。")
+                self.log.info("工作器 %s: 订单号 %s 未找到。", self.worker_id, order_code_to_select)
         elif explain and result is not None:
-            print(f"工作器 {self.worker_id}: 查询订单的 EXPLAIN 计划: {result}")
+            self.log.info("工作器 %s: 查询订单的 EXPLAIN 计划: %s", self.worker_id, result)
         return result
 
     def update_order(self, explain=False, analyze=False):
         if not self.existing_order_codes:
-            print(f"工作器 {self.worker_id}: 无法更新订单，当前没有订单号。") 
+            self.log.warning("工作器 %s: 无法更新订单，当前没有订单号。", self.worker_id)
             return None
 
-        order_code_to_update = self.random.choice(list(self.existing_order_codes))
+        order_code_to_update = self.existing_order_codes.choice(self.random.rng)
+        if order_code_to_update is None:
+            self.log.warning("工作器 %s: 无法更新订单，当前没有订单号。", self.worker_id)
+            return None
         new_payment = round(self.random.uniform(50.00, 10000.00), 2)
         current_update_time = datetime.datetime.now() 
 
@@ -206,32 +269,51 @@ class OrderTransactionalWorker:
             WHERE order_code = %s;
         """
         args = (new_payment, current_update_time, order_code_to_update)
-        result = self.execute_sql(sql, args, explain, analyze)
-        if not explain and result is None:
-            print(f"工作器 {self.worker_id}: 成功将订单 {order_code_to_update} 的付款更新为 {new_payment}。") 
+        self.last_write = ('update', order_code_to_update, to_cents(new_payment)) if not explain else None
+        result = self.execute_sql(sql, args, explain, analyze, statement='update_order')
+        if self.last_error is None and self.conn.cursor.rowcount == 0:
+            self.last_write = None
+        if not explain and result is None and self.last_error is None:
+            self.log.debug("工作器 %s: 成功将订单 %s 的付款更新为 %s。", self.worker_id, order_code_to_update, new_payment)
         elif explain and result is not None:
-            print(f"工作器 {self.worker_id}: 更新订单的 EXPLAIN 计划: {result}")
+            self.log.info("工作器 %s: 更新订单的 EXPLAIN 计划: %s", self.worker_id, result)
         return result
 
     def delete_order(self, explain=False, analyze=False):
         if not self.existing_order_codes:
-            print(f"工作器 {self.worker_id}: 无法删除订单，当前没有订单号。")
+            self.log.warning("工作器 %s: 无法删除订单，当前没有订单号。", self.worker_id)
             return None
 
-        order_code_to_delete = self.random.choice(list(self.existing_order_codes))
+        # 先从登记表中摘除再删除，保证同一订单号不会被多个工作器重复删除；删除失败时放回
+        order_code_to_delete = None
+        for _ in range(3):
+            candidate = self.existing_order_codes.choice(self.random.rng)
+            if candidate is None:
+                break
+            with self.lock:
+                if self.existing_order_codes.discard(candidate):
+                    order_code_to_delete = candidate
+                    break
+        if order_code_to_delete is None:
+            self.log.warning("工作器 %s: 无法删除订单，当前没有订单号。", self.worker_id)
+            return None
 
         sql = """
             DELETE FROM "Order"
             WHERE order_code = %s;
         """
         args = (order_code_to_delete,)
-        result = self.execute_sql(sql, args, explain, analyze)
-        if not explain and result is None:
+        self.last_write = ('delete', order_code_to_delete, 0) if not explain else None
+        result = self.execute_sql(sql, args, explain, analyze, statement='delete_order')
+        if self.last_error is None and self.conn.cursor.rowcount == 0:
+            self.last_write = None
+        if (explain and not analyze) or self.last_error is not None:
             with self.lock:
-                self.existing_order_codes.discard(order_code_to_delete)
-            print(f"工作器 {self.worker_id}: 成功删除订单 {order_code_to_delete}。")
+                self.existing_order_codes.add(order_code_to_delete)
+        if not explain and result is None and self.last_error is None:
+            self.log.debug("工作器 %s: 成功删除订单 %s。", self.worker_id, order_code_to_delete)
         elif explain and result is not None:
-            print(f"工作器 {self.worker_id}: 删除订单的 EXPLAIN 计划: {result}")
+            self.log.info("工作器 %s: 删除订单的 EXPLAIN 计划: %s", self.worker_id, result)
         return result
 
     def next_transaction(self, explain=False, analyze=False):
@@ -0,0 +1,37 @@
+import random
+
+from settings import ARRIVAL_PROCESS
+
+ARRIVAL_PROCESSES = ('constant', 'step', 'poisson')
+
+
+def arrival_schedule(start, rate, process=ARRIVAL_PROCESS, steps=None, rng=None):
+    # 生成开环负载中每个事务的预定开始时间（time.monotonic() 秒），与事务实际何时完成无关。
+    # rate 为目标 TPS；step 模式下 steps 为 [(持续秒数, TPS)]，最后一个阶段结束后保持最后的速率。
+    if process not in ARRIVAL_PROCESSES:
+        raise ValueError(f"不支持的到达过程: {process}")
+    rng = rng or random.Random()
+    t = start
+
+    if process == 'step':
+        if not steps:
+            raise ValueError("step 到达过程需要至少一个阶段。")
+        step_start = start
+        for duration, step_rate in steps:
+            step_end = step_start + duration
+            while step_rate > 0 and t < step_end:
+                yield t
+                t += 1.0 / step_rate
+            step_start = step_end
+            t = max(t, step_start)
+        rate = steps[-1][1]
+
+    if rate <= 0:
+        raise ValueError("开环负载的目标 TPS 必须大于零。")
+    while True:
+        if process == 'poisson':
+            t += rng.expovariate(rate)
+            yield t
+        else:
+            yield t
+            t += 1.0 / rate
@@ -0,0 +1,370 @@
+import asyncio
+import datetime
+import random
+import time
+from decimal import Decimal
+
+import asyncpg
+
+from arrivals import arrival_schedule
+from fault_tolerance import Backoff, CONNECTION_LOST, IN_DOUBT, SERIALIZATION, OTHER
+from connection import DB_CONFIG
+from indexed_set import IndexedSet
+from log_sink import get_logger
+from metrics import WorkloadStats
+from settings import (
+    LOAD_MODE,
+    THINK_TIME,
+    TARGET_TPS,
+    ARRIVAL_STEPS,
+    PAYMENT_RECOMPUTE_MODE,
+    ASYNC_POOL_MAX_SIZE,
+    SERIALIZATION_RETRIES,
+    NESTED_SAVEPOINT_DEPTHS,
+    NESTED_ROLLBACK_RATIO
+)
+
+# asyncio 执行引擎：每个进程一个事件循环，每个事件循环上运行多个协程虚拟客户端。
+# 事务组合、SQL 和统计方式与 OrderTransactionalWorker / MultiTableOperations 一致，
+# 结果同样是 WorkloadStats，可以和进程池引擎直接对比。asyncpg 会在每个连接上自动缓存预编译语句。
+
+CONNECTION_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, ConnectionError, OSError,
+                     asyncpg.CannotConnectNowError, asyncpg.AdminShutdownError, asyncpg.CrashShutdownError)
+SERIALIZATION_ERRORS = (asyncpg.SerializationError, asyncpg.DeadlockDetectedError)
+# 自动提交的单语句写事务和多表事务在连接断开时都可能已经提交
+WRITE_TRANSACTIONS = ('insert', 'update', 'delete', 'delete_product_multi_table', 'modify_product_price_multi_table',
+                      'nested_savepoint_multi_table')
+
+
+def _money(value):
+    return Decimal(str(round(value, 2)))
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class AsyncOrderClient:
+    def __init__(self, client_id, pool, shared, order_codes, recompute_mode=PAYMENT_RECOMPUTE_MODE):
+        self.client_id = client_id
+        self.pool = pool
+        self.shared = shared
+        self.order_codes = order_codes
+        self.random = random.Random(client_id)
+        self.recompute_mode = recompute_mode
+        self.last_nested_depth = None
+        self.log = get_logger()
+
+    async def insert_order(self):
+        user_id = self.random.choice(self.shared['user_ids'])
+        allocate = getattr(self.order_codes, 'allocate', None)
+        if allocate is not None:
+            order_code = allocate()
+        else:
+            order_code = None
+            for _ in range(100):
+                candidate = self.random.randint(100000000000, 999999999999)
+                if candidate not in self.order_codes:
+                    order_code = candidate
+                    break
+            if order_code is None:
+                return None
+        payment = _money(self.random.uniform(10.00, 5000.00))
+        create_time = datetime.datetime(2025, self.random.randint(1, 12), self.random.randint(1, 28),
+                                        self.random.randint(0, 23), self.random.randint(0, 59), self.random.randint(0, 59),
+                                        tzinfo=datetime.timezone.utc)
+        update_time = create_time + datetime.timedelta(minutes=self.random.randint(0, 60))
+        async with self.pool.acquire() as conn:
+            order_id = await conn.fetchval("""
+                INSERT INTO "Order" (order_code, user_id, payment, create_time, update_time)
+                VALUES ($1, $2, $3, $4, $5) RETURNING id;
+            """, order_code, user_id, payment, create_time, update_time)
+        self.order_codes.add(order_code)
+        self.log.debug("客户端 %s: 订单插入成功，订单 ID: %s, 订单号: %s", self.client_id, order_id, order_code)
+        return order_id
+
+    async def select_order(self):
+        order_code = self.order_codes.choice(self.random)
+        if order_code is None:
+            return None
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT id, order_code, user_id, payment, create_time, update_time
+                FROM "Order"
+                WHERE order_code = $1;
+            """, order_code)
+        if row is None:
+            self.log.info("客户端 %s: 订单号 %s 未找到。", self.client_id, order_code)
+        return row
+
+    async def update_order(self):
+        order_code = self.order_codes.choice(self.random)
+        if order_code is None:
+            return None
+        new_payment = _money(self.random.uniform(50.00, 10000.00))
+        async with self.pool.acquire() as conn:
+            return await conn.execute("""
+                UPDATE "Order"
+                SET payment = $1, update_time = $2
+                WHERE order_code = $3;
+            """, new_payment, _now(), order_code)
+
+    async def delete_order(self):
+        order_code = None
+        for _ in range(3):
+            candidate = self.order_codes.choice(self.random)
+            if candidate is None:
+                break
+            if self.order_codes.discard(candidate):
+                order_code = candidate
+                break
+        if order_code is None:
+            return None
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.execute("""
+                    DELETE FROM "Order"
+                    WHERE order_code = $1;
+                """, order_code)
+        except Exception:
+            self.order_codes.add(order_code)
+            raise
+
+    async def _recompute_order_payments(self, conn, order_codes):
+        if not order_codes:
+            return
+        if self.recompute_mode == 'set_based':
+            await conn.execute("""
+                UPDATE "Order" AS o
+                SET payment = s.total_payment, update_time = $1
+                FROM (
+                    SELECT c.order_code, COALESCE(SUM(oi.total_price), 0.00) AS total_payment
+                    FROM unnest($2::bigint[]) AS c(order_code)
+                    LEFT JOIN "OrderItem" AS oi ON oi.order_code = c.order_code
+                    GROUP BY c.order_code
+                ) AS s
+                WHERE o.order_code = s.order_code;
+            """, _now(), order_codes)
+            return
+        for order_code in order_codes:
+            new_total_order_payment = await conn.fetchval("""
+                SELECT COALESCE(SUM(total_price), 0.00)
+                FROM "OrderItem"
+                WHERE order_code = $1;
+            """, order_code)
+            await conn.execute("""
+                UPDATE "Order"
+                SET payment = $1, update_time = $2
+                WHERE order_code = $3;
+            """, new_total_order_payment, _now(), order_code)
+
+    async def delete_product_and_related_order_items(self):
+        product_ids = self.shared['product_ids']
+        if not product_ids:
+            return False
+        product_id = self.random.choice(product_ids)
+        async with self.pool.acquire() as conn:
+            # 不用 async with conn.transaction()：在块内 return 会提交。商品已被并发删除时要回滚已经执行的
+            # 订单项删除（与同步版本一致），否则订单项被删而订单金额没有重算
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                rows = await conn.fetch("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = $1;", product_id)
+                affected_order_codes = [row[0] for row in rows]
+                await conn.execute("DELETE FROM \"OrderItem\" WHERE product_id = $1;", product_id)
+                status = await conn.execute("DELETE FROM \"Product\" WHERE id = $1;", product_id)
+                if status.endswith(" 0"):
+                    self.log.info("未找到 ID 为 %s 的产品。", product_id)
+                    await transaction.rollback()
+                    return False
+                await self._recompute_order_payments(conn, affected_order_codes)
+            except BaseException:
+                await transaction.rollback()
+                raise
+            await transaction.commit()
+        if product_id in product_ids:
+            product_ids.remove(product_id)
+        return True
+
+    async def modify_product_price_and_update_orders(self):
+        product_ids = self.shared['product_ids']
+        if not product_ids:
+            return False
+        product_id = self.random.choice(product_ids)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                current_price = await conn.fetchval("SELECT price FROM \"Product\" WHERE id = $1;", product_id)
+                if current_price is None:
+                    self.log.info(" ID为%s 的产品未找到。", product_id)
+                    return False
+                new_price = max(_money(float(current_price) * self.random.uniform(0.5, 1.5)), Decimal("0.01"))
+                await conn.execute("UPDATE \"Product\" SET price = $1, update_time = $2 WHERE id = $3;",
+                                   new_price, _now(), product_id)
+                rows = await conn.fetch("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = $1;", product_id)
+                affected_order_codes = [row[0] for row in rows]
+                await conn.execute("""
+                    UPDATE "OrderItem"
+                    SET current_unit_price = $1,
+                        total_price = $1 * quantity,
+                        update_time = $2
+                    WHERE product_id = $3;
+                """, new_price, _now(), product_id)
+                await self._recompute_order_payments(conn, affected_order_codes)
+        return True
+
+    async def _change_price_step(self, conn, product_id):
+        current_price = await conn.fetchval("SELECT price FROM \"Product\" WHERE id = $1;", product_id)
+        if current_price is None:
+            return
+        new_price = max(_money(float(current_price) * self.random.uniform(0.95, 1.05)), Decimal("0.01"))
+        await conn.execute("UPDATE \"Product\" SET price = $1, update_time = $2 WHERE id = $3;",
+                           new_price, _now(), product_id)
+        rows = await conn.fetch("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = $1;", product_id)
+        await conn.execute("""
+            UPDATE "OrderItem"
+            SET current_unit_price = $1,
+                total_price = $1 * quantity,
+                update_time = $2
+            WHERE product_id = $3;
+        """, new_price, _now(), product_id)
+        await self._recompute_order_payments(conn, [row[0] for row in rows])
+
+    async def nested_savepoint_price_update(self):
+        # 与 MultiTableOperations.nested_savepoint_price_update 相同：逐层 SAVEPOINT 改价，再由内向外回滚或释放
+        product_ids = self.shared['product_ids']
+        if not product_ids:
+            return False
+        depth = self.random.choice(NESTED_SAVEPOINT_DEPTHS)
+        self.last_nested_depth = depth
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for level in range(1, depth + 1):
+                    await conn.execute(f"SAVEPOINT sp_{level};")
+                    await self._change_price_step(conn, self.random.choice(product_ids))
+                for level in range(depth, 0, -1):
+                    if self.random.random() < NESTED_ROLLBACK_RATIO:
+                        await conn.execute(f"ROLLBACK TO SAVEPOINT sp_{level};")
+                    await conn.execute(f"RELEASE SAVEPOINT sp_{level};")
+        return True
+
+    async def run_transaction(self, trx_type):
+        if trx_type == 'insert':
+            return await self.insert_order()
+        elif trx_type == 'select':
+            return await self.select_order()
+        elif trx_type == 'update':
+            return await self.update_order()
+        elif trx_type == 'delete':
+            return await self.delete_order()
+        elif trx_type == 'delete_product_multi_table':
+            return await self.delete_product_and_related_order_items()
+        elif trx_type == 'modify_product_price_multi_table':
+            return await self.modify_product_price_and_update_orders()
+        elif trx_type == 'nested_savepoint_multi_table':
+            return await self.nested_savepoint_price_update()
+        return None
+
+
+async def _run_client(client, num_transactions, transaction_ratios, stats, transaction_counter, counter_shard,
+                      rate_share):
+    all_transaction_types = list(transaction_ratios.keys())
+    all_transaction_weights = list(transaction_ratios.values())
+    backoff = Backoff(rng=random.Random(client.client_id))
+    schedule = None
+    if LOAD_MODE == 'open':
+        schedule = arrival_schedule(time.monotonic(), TARGET_TPS * rate_share,
+                                    steps=[(duration, tps * rate_share) for duration, tps in ARRIVAL_STEPS],
+                                    rng=random.Random(client.client_id))
+
+    for _ in range(num_transactions):
+        trx_type = client.random.choices(all_transaction_types, weights=all_transaction_weights, k=1)[0]
+        if schedule is not None:
+            intended_start = next(schedule)
+            delay = intended_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        trx_start = time.monotonic_ns()
+        error_kind = None
+        # 序列化失败/死锁立即重试；连接断开时记录（写事务记为结果未知），按退避等待后继续
+        for attempt in range(SERIALIZATION_RETRIES + 1):
+            error_kind = None
+            try:
+                result = await client.run_transaction(trx_type)
+            except SERIALIZATION_ERRORS:
+                result = False
+                error_kind = SERIALIZATION
+            except CONNECTION_ERRORS as e:
+                result = False
+                error_kind = IN_DOUBT if trx_type in WRITE_TRANSACTIONS else CONNECTION_LOST
+                client.log.error("客户端 %s 连接中断: %s", client.client_id, e)
+            except asyncpg.PostgresError as e:
+                result = False
+                error_kind = OTHER
+                client.log.error("客户端 %s 执行 %s 失败: %s", client.client_id, trx_type, e)
+            if error_kind != SERIALIZATION or attempt == SERIALIZATION_RETRIES:
+                break
+            stats.count_error(SERIALIZATION)
+        trx_end = time.monotonic_ns()
+        ok = result is not False and error_kind is None
+        stats_type = trx_type
+        if trx_type == 'nested_savepoint_multi_table':
+            stats_type = f"{trx_type}_d{client.last_nested_depth}"
+        if schedule is not None:
+            stats.record(stats_type, trx_end - int(intended_start * 1e9), ok=ok, service_ns=trx_end - trx_start,
+                         error_kind=error_kind)
+        else:
+            stats.record(stats_type, trx_end - trx_start, ok=ok, error_kind=error_kind)
+        stats.stop()
+
+        # 每个事务计数一次，不论结果；同一事件循环中的协程共用本进程的计数分片，单线程内递增不会交错
+        transaction_counter.add(counter_shard)
+        if error_kind in (CONNECTION_LOST, IN_DOUBT):
+            # asyncpg 连接池在下次 acquire 时自动建立新连接，这里只负责退避
+            delay = backoff.next_delay()
+            if delay is None:
+                client.log.error("客户端 %s 超过最长重连时间，停止。", client.client_id)
+                return
+            await asyncio.sleep(delay)
+            continue
+        backoff.reset()
+        if schedule is None and THINK_TIME > 0:
+            await asyncio.sleep(THINK_TIME)
+
+
+async def run_clients(client_ids, total_clients, num_transactions, transaction_ratios, product_ids,
+                      transaction_counter, counter_shard, order_registry=None):
+    stats = WorkloadStats()
+    pool = await asyncpg.create_pool(
+        host=DB_CONFIG['host'],
+        port=int(DB_CONFIG['port']),
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        database=DB_CONFIG['database'],
+        min_size=1,
+        max_size=max(1, min(len(client_ids), ASYNC_POOL_MAX_SIZE))
+    )
+    try:
+        async with pool.acquire() as conn:
+            user_ids = [row[0] for row in await conn.fetch("SELECT id FROM \"User\";")] or [1]
+            local_order_codes = None
+            if order_registry is None:
+                local_order_codes = IndexedSet(row[0] for row in await conn.fetch("SELECT order_code FROM \"Order\";"))
+        # 同一进程内的协程共享用户和商品列表；订单号使用共享登记表或本进程的 IndexedSet
+        shared = {'user_ids': user_ids, 'product_ids': list(product_ids)}
+        clients = [AsyncOrderClient(client_id, pool, shared,
+                                    order_registry.view(client_id) if order_registry is not None else local_order_codes)
+                   for client_id in client_ids]
+        stats.start()
+        await asyncio.gather(*(_run_client(client, num_transactions, transaction_ratios, stats, transaction_counter,
+                                           counter_shard, 1.0 / total_clients)
+                               for client in clients))
+        stats.stop()
+    finally:
+        pool.terminate()
+    return stats
+
+
+def run_event_loop(client_ids, total_clients, num_transactions, transaction_ratios, product_ids,
+                   transaction_counter, counter_shard, order_registry=None):
+    return asyncio.run(run_clients(client_ids, total_clients, num_transactions, transaction_ratios, product_ids,
+                                   transaction_counter, counter_shard, order_registry))
@@ -0,0 +1,542 @@
+import datetime
+import functools
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import time
+from decimal import Decimal
+
+import ephemeral_pg
+from connection import DB_CONFIG, ADMIN_DB_CONFIG
+from settings import (
+    DB_BACKEND,
+    SQLITE_PATH,
+    SQLITE_BUSY_TIMEOUT
+)
+
+# 数据库后端：连接、四张表的方言、启动/停止/kill 和恢复探测。工作负载、故障模式和报告只通过
+# get_backend() 访问数据库相关的差异，同一套实验可以在不同引擎上运行并输出相同格式的报告。
+# 'postgresql' 使用 psycopg2 和 pg_ctl；'sqlite' 是本机单文件数据库，用于没有 PostgreSQL 服务器时
+# 在本地运行同样的负载。只在 PostgreSQL 上可用的功能（COPY 批量加载、服务端预编译语句、
+# pg_stat 吞吐量统计、快照一致性检查和提交账本对账、asyncio 执行器、检查点触发）由 supports_* 标志关闭。
+
+TABLES = ["User", "Product", "Order", "OrderItem"]
+
+# {serial} 为各后端的自增主键类型
+TABLE_DDL = {
+    "User": """
+        CREATE TABLE "User" (
+            id {serial} PRIMARY KEY, -- 用户表id,自动递增主键
+            username VARCHAR(50) NOT NULL UNIQUE -- 用户名，非空且唯一
+        );
+    """,
+    "Product": """
+        CREATE TABLE "Product" (
+            id {serial} PRIMARY KEY, -- 商品id,自动递增主键
+            name VARCHAR(255) NOT NULL, -- 商品名称
+            description TEXT, -- 商品描述
+            price DECIMAL(20, 2) NOT NULL, -- 商品单价, 单位是元, 保留两位小数
+            stock INTEGER NOT NULL CHECK (stock >= 0), -- 库存数量，非空且不能为负
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 创建时间,默认为当前时间
+            update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP -- 更新时间，默认为当前时间
+        );
+    """,
+    "Order": """
+        CREATE TABLE "Order" (
+            id {serial} PRIMARY KEY, -- 订单id,自动递增主键
+            order_code BIGINT UNIQUE NOT NULL, -- 订单号，唯一且非空
+            user_id INTEGER DEFAULT NULL, -- 用户id,允许为空（例如匿名订单）
+            payment DECIMAL(20, 2) DEFAULT NULL, -- 付款金额,单位是元, 保留两位小数，允许为空
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 订单创建时间，默认为当前时间
+            update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 订单更新时间，默认为当前时间
+            CONSTRAINT fk_order_user FOREIGN KEY (user_id) REFERENCES "User"(id) ON DELETE SET NULL -- 外键约束,如果用户被删除,则用户ID设为NULL
+        );
+    """,
+    "OrderItem": """
+        CREATE TABLE "OrderItem" (
+            id {serial} PRIMARY KEY, -- 订单子表id,自动递增主键
+            user_id INTEGER DEFAULT NULL, -- 用户id,冗余字段,提高查询效率,允许为空
+            order_code BIGINT DEFAULT NULL, -- 订单号,允许为空
+            product_id INTEGER DEFAULT NULL, -- 商品id,允许为空
+            current_unit_price DECIMAL(20, 2) DEFAULT NULL, -- 生成订单时的商品单价,单位是元,保留两位小数,允许为空
+            quantity INTEGER DEFAULT NULL CHECK (quantity >= 0), -- 商品购买数量,允许为空且不能为负
+            total_price DECIMAL(20, 2) DEFAULT NULL, -- 商品总价，单位是元,保留两位小数,允许为空
+            create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 创建时间,默认为当前时间
+            update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 更新时间，默认为当前时间
+            CONSTRAINT fk_orderitem_order FOREIGN KEY (order_code) REFERENCES "Order"(order_code) ON DELETE SET NULL, -- 外键约束,如果订单被删除,则订单号设为NULL
+            CONSTRAINT fk_orderitem_product FOREIGN KEY (product_id) REFERENCES "Product"(id) ON DELETE SET NULL -- 外键约束,如果商品被删除,则商品ID设为NULL
+        );
+    """,
+}
+
+TABLE_INDEXES = {
+    "Order": [
+        "CREATE INDEX IF NOT EXISTS idx_order_user_id ON \"Order\" (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_order_create_time ON \"Order\" (create_time DESC);",
+    ],
+    "OrderItem": [
+        "CREATE INDEX IF NOT EXISTS idx_orderitem_order_code ON \"OrderItem\" (order_code);",
+        "CREATE INDEX IF NOT EXISTS idx_orderitem_product_id ON \"OrderItem\" (product_id);",
+        "CREATE INDEX IF NOT EXISTS idx_orderitem_user_order_code ON \"OrderItem\" (user_id, order_code);",
+    ],
+}
+
+HEARTBEAT_DDL = """
+    CREATE TABLE IF NOT EXISTS "Heartbeat" (
+        id {bigserial} PRIMARY KEY,
+        source VARCHAR(16) NOT NULL,
+        seq BIGINT NOT NULL,
+        writer_time TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+"""
+
+
+class PostgresBackend:
+    name = 'postgresql'
+    supports_copy = True
+    supports_prepared = True
+    supports_arrays = True
+    supports_snapshots = True
+    supports_server_stats = True
+    supports_checkpoint_triggers = True
+
+    # 40001 serialization_failure, 40P01 deadlock_detected
+    SERIALIZATION_CODES = ('40001', '40P01')
+    # 57P01 admin_shutdown, 57P02 crash_shutdown, 57P03 cannot_connect_now
+    CONNECTION_CODES = ('57P01', '57P02', '57P03')
+
+    def __init__(self, db_config=DB_CONFIG):
+        import psycopg2
+        import psycopg2.extensions
+        self.driver = psycopg2
+        self.db_config = db_config
+        self.Error = psycopg2.Error
+        self._checkpoint_progress_view = None  # 服务端是否有 pg_stat_progress_checkpoint，首次判断检查点时查询
+
+    def connect(self, db_config=None, autocommit=False, connect_timeout=None):
+        db_config = db_config or self.db_config
+        kwargs = {}
+        if connect_timeout:
+            kwargs['connect_timeout'] = connect_timeout
+        conn = self.driver.connect(
+            host=db_config['host'],
+            database=db_config['database'],
+            user=db_config['user'],
+            password=db_config['password'],
+            port=db_config['port'],
+            **kwargs
+        )
+        conn.autocommit = autocommit
+        return conn
+
+    def in_transaction(self, conn):
+        return conn.info.transaction_status != self.driver.extensions.TRANSACTION_STATUS_IDLE
+
+    def is_connection_error(self, error):
+        return (isinstance(error, (self.driver.OperationalError, self.driver.InterfaceError))
+                or getattr(error, 'pgcode', None) in self.CONNECTION_CODES)
+
+    def is_serialization_failure(self, error):
+        return getattr(error, 'pgcode', None) in self.SERIALIZATION_CODES
+
+    def set_statement_timeout(self, cur, milliseconds):
+        cur.execute("SET statement_timeout = %s;", (milliseconds,))
+
+    def reset_statement_timeout(self, cur):
+        cur.execute("RESET statement_timeout;")
+
+    def explain(self, cur, sql, args, analyze=False):
+        prefix = "EXPLAIN (ANALYZE, FORMAT JSON) " if analyze else "EXPLAIN (FORMAT JSON) "
+        cur.execute(prefix + sql, args)
+        return cur.fetchone()[0][0]
+
+    def drop_table_sql(self, table):
+        return f'DROP TABLE IF EXISTS "{table}" CASCADE;'
+
+    def create_table_sql(self, table):
+        return TABLE_DDL[table].format(serial='SERIAL')
+
+    def heartbeat_table_sql(self):
+        return HEARTBEAT_DDL.format(bigserial='BIGSERIAL')
+
+    def truncate_sql(self, table):
+        return f'TRUNCATE "{table}";'
+
+    def wal_lsn(self, cur):
+        # 当前 WAL 插入位置（字节），两次采样之差即期间生成的 WAL 量
+        cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), '0/0');")
+        return int(cur.fetchone()[0])
+
+    def wal_status(self, cur):
+        # WAL 插入位置和最近一次检查点的 redo 位置（字节），崩溃恢复从 redo 位置开始重放；
+        # PostgreSQL 14 起另有 pg_stat_wal 的累计记录数、整页写入数（FPI）和字节数，崩溃后清零
+        cur.execute("""
+            SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), '0/0'),
+                   pg_wal_lsn_diff(redo_lsn, '0/0'), EXTRACT(EPOCH FROM checkpoint_time)
+            FROM pg_control_checkpoint();
+        """)
+        lsn, redo_lsn, checkpoint_time = cur.fetchone()
+        status = {'lsn': int(lsn), 'redo_lsn': int(redo_lsn), 'checkpoint_time': float(checkpoint_time),
+                  'wal_records': None, 'wal_fpi': None, 'wal_bytes': None}
+        if cur.connection.server_version >= 140000:
+            cur.execute("SELECT wal_records, wal_fpi, wal_bytes FROM pg_stat_wal;")
+            status['wal_records'], status['wal_fpi'], status['wal_bytes'] = (int(v) for v in cur.fetchone())
+        return status
+
+    def checkpoint(self, cur):
+        # 立即检查点，阻塞到完成；需要超级用户或 pg_checkpoint 角色
+        cur.execute("CHECKPOINT;")
+
+    def checkpoint_in_progress(self, cur):
+        # 有检查点进度视图的服务端直接查询。没有时按检查点进程的等待事件判断：分散写的 CheckpointWriteDelay
+        # 和写入/刷盘数据文件的 IO 等待只出现在检查点中；无等待事件（NULL）也可能是空闲时在吸收 fsync 请求，
+        # 不算进行中。这种判断可能漏掉检查点中不等待的片刻，但不会在检查点之外触发
+        if self._checkpoint_progress_view is None:
+            cur.execute("SELECT to_regclass('pg_catalog.pg_stat_progress_checkpoint') IS NOT NULL;")
+            self._checkpoint_progress_view = cur.fetchone()[0]
+        if self._checkpoint_progress_view:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_stat_progress_checkpoint);")
+            return cur.fetchone()[0]
+        cur.execute("SELECT wait_event = 'CheckpointWriteDelay' OR wait_event_type = 'IO' FROM pg_stat_activity "
+                    "WHERE backend_type = 'checkpointer';")
+        row = cur.fetchone()
+        return bool(row and row[0])
+
+    def probe_read(self, cur):
+        # 恢复探测的首次读；同时返回服务端启动时间（time.time() 秒）
+        cur.execute("SELECT EXTRACT(EPOCH FROM pg_postmaster_start_time()), "
+                    "(SELECT order_code FROM \"Order\" LIMIT 1);")
+        return float(cur.fetchone()[0])
+
+    # 数据集模板（dataset.py）：实验数据库和数据集都是 ADMIN_DB_CONFIG 所在实例上的数据库，
+    # 建库、删库和 CREATE DATABASE ... TEMPLATE 在管理库的自动提交连接上执行
+    def _admin_execute(self, statements):
+        conn = self.connect(ADMIN_DB_CONFIG, autocommit=True)
+        try:
+            with conn.cursor() as cur:
+                for sql, args in statements:
+                    cur.execute(sql, args)
+        finally:
+            conn.close()
+
+    def _terminate_statement(self, name):
+        # 模板库和被删除的库上不能有其他连接，先断开残留会话（例如上一次运行遗留的工作器连接）
+        return ("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid();",
+                (name,))
+
+    def _drop_database_statements(self, name):
+        return [self._terminate_statement(name), (f'DROP DATABASE IF EXISTS "{name}";', None)]
+
+    def _experiment_database(self):
+        name = self.db_config['database']
+        if name == ADMIN_DB_CONFIG['database']:
+            raise ValueError(f"实验数据库 {name} 与管理库相同，无法删除重建，请设置 DATASET_DATABASE")
+        return name
+
+    def dataset_exists(self, name):
+        conn = self.connect(ADMIN_DB_CONFIG, autocommit=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (name,))
+                return cur.fetchone() is not None
+        finally:
+            conn.close()
+
+    def recreate_database(self, template=None):
+        # 删除并重建实验数据库；给出 template 时按文件复制该数据集，不重新插入数据
+        name = self._experiment_database()
+        create = f'CREATE DATABASE "{name}"' + (f' TEMPLATE "{template}"' if template else '') + ';'
+        self._admin_execute(self._drop_database_statements(name) + [(create, None)])
+
+    def save_dataset(self, name):
+        source = self._experiment_database()
+        self._admin_execute(self._drop_database_statements(name) + [self._terminate_statement(source),
+                            (f'CREATE DATABASE "{name}" TEMPLATE "{source}";', None)])
+
+    def drop_dataset(self, name):
+        self._admin_execute(self._drop_database_statements(name))
+
+    # 启动/停止/kill 返回 subprocess.CompletedProcess，失败时抛出 CalledProcessError 或 FileNotFoundError
+    def start(self, data_dir):
+        command = ["su", "-", "postgres", "-c", f"pg_ctl start -D {data_dir}"]
+        return subprocess.run(command, capture_output=True, text=True, check=True)
+
+    def stop(self, data_dir):
+        command = ["su", "-", "postgres", "-c", f"pg_ctl stop -m fast -D {data_dir}"]
+        return subprocess.run(command, capture_output=True, text=True, check=True)
+
+    def kill(self, data_dir):
+        command = ["sudo", "pkill", "-9", "-f", "postgres: .*"]
+        return subprocess.run(command, capture_output=True, text=True, check=True)
+
+
+class EphemeralPostgresBackend(PostgresBackend):
+    # 本机临时集群：连接参数已由 connection.py 换成该集群的，启动/停止/kill 只作用于这个集群，
+    # 忽略调用方传入的 data_dir
+    def start(self, data_dir):
+        return ephemeral_pg.start_cluster()
+
+    def stop(self, data_dir):
+        return ephemeral_pg.stop_cluster()
+
+    def kill(self, data_dir):
+        return ephemeral_pg.kill_cluster()
+
+
+class ServerDownError(sqlite3.OperationalError):
+    pass
+
+
+@functools.lru_cache(maxsize=1024)
+def _qmark_sql(sql):
+    # psycopg2 风格的 %s 占位符改写为 sqlite3 的 ?，%% 还原为 %
+    return re.sub(r'%([s%])', lambda m: '?' if m.group(1) == 's' else '%', sql)
+
+
+class _SQLiteCursor:
+    # 与 psycopg2 的客户端游标一样，execute 时一次取回全部结果。sqlite3 的语句在结果读完之前不会结束，
+    # 未读取的 INSERT ... RETURNING 会一直持有写锁
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+        self._rows = []
+        self._position = 0
+        self.rowcount = -1
+        self.closed = False
+
+    def execute(self, sql, args=None):
+        self.connection._check_running()
+        if args is not None:
+            sql = _qmark_sql(sql)
+        # 与 psycopg2 一致：非自动提交时第一条语句隐式开始事务。显式事务都会写入，
+        # 用 IMMEDIATE 在开始时取得写锁（等待 busy_timeout），避免读锁升级为写锁时直接失败
+        if not self.connection.autocommit and not self.connection._conn.in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE;")
+        self._cursor.execute(sql, args if args is not None else ())
+        self._rows = self._cursor.fetchall() if self._cursor.description is not None else []
+        self._position = 0
+        self.rowcount = self._cursor.rowcount if self._cursor.rowcount >= 0 else len(self._rows)
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def close(self):
+        if not self.closed:
+            self._cursor.close()
+            self.closed = True
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _SQLiteConnection:
+    # 提供工作负载用到的 psycopg2 连接接口子集：cursor/commit/rollback/close/closed/autocommit
+    def __init__(self, backend, conn, autocommit):
+        self._backend = backend
+        self._conn = conn
+        self._pid = os.getpid()
+        self.autocommit = autocommit
+        self.closed = 0
+
+    def _check_running(self):
+        if self.closed:
+            raise ServerDownError("连接已关闭")
+        # fork 后子进程继承的 sqlite 连接与父进程共用文件句柄和锁状态，使用它会损坏数据库文件；
+        # 只标记为关闭，不关闭底层连接，子进程需要重新连接
+        if os.getpid() != self._pid:
+            self.closed = 1
+            raise sqlite3.ProgrammingError(f"sqlite 连接由进程 {self._pid} 创建，不能在进程 {os.getpid()} 中使用")
+        # 模拟的 kill 之后，已有连接在下一条语句时断开，未提交的事务随连接关闭回滚
+        if os.path.exists(self._backend.down_marker):
+            self.close()
+            raise ServerDownError("数据库未运行")
+
+    def cursor(self):
+        return _SQLiteCursor(self)
+
+    def commit(self):
+        self._check_running()
+        if self._conn.in_transaction:
+            self._conn.commit()
+
+    def rollback(self):
+        if not self.closed and os.getpid() == self._pid and self._conn.in_transaction:
+            self._conn.rollback()
+
+    def close(self):
+        if not self.closed:
+            if os.getpid() == self._pid:
+                self._conn.close()
+            self.closed = 1
+
+    def get_backend_pid(self):
+        return os.getpid()
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+    supports_copy = False
+    supports_prepared = False
+    supports_arrays = False
+    supports_snapshots = False
+    supports_server_stats = False
+    supports_checkpoint_triggers = False
+
+    def __init__(self, path=SQLITE_PATH, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        # 存在该文件表示数据库处于"宕机"状态：新连接失败，已有连接在下一条语句时断开
+        self.down_marker = path + '.down'
+        self.started_file = path + '.started'
+        self.Error = sqlite3.Error
+        sqlite3.register_adapter(Decimal, str)
+        sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+
+    def connect(self, db_config=None, autocommit=False, connect_timeout=None):
+        if os.path.exists(self.down_marker):
+            raise ServerDownError("数据库未运行")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None：由 _SQLiteCursor 按 autocommit 自己开始事务
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = FULL;")
+        conn.execute("PRAGMA foreign_keys = ON;")
+        return _SQLiteConnection(self, conn, autocommit)
+
+    def in_transaction(self, conn):
+        return not conn.closed and os.getpid() == conn._pid and conn._conn.in_transaction
+
+    def is_connection_error(self, error):
+        return isinstance(error, ServerDownError)
+
+    def is_serialization_failure(self, error):
+        # 写锁冲突在 busy_timeout 内未解除，事务可以整体重试
+        message = str(error)
+        return (isinstance(error, sqlite3.OperationalError) and not isinstance(error, ServerDownError)
+                and ('locked' in message or 'busy' in message))
+
+    def set_statement_timeout(self, cur, milliseconds):
+        pass
+
+    def reset_statement_timeout(self, cur):
+        pass
+
+    def explain(self, cur, sql, args, analyze=False):
+        # SQLite 没有 EXPLAIN ANALYZE：analyze 时先执行语句，再返回查询计划
+        if analyze:
+            cur.execute(sql, args)
+        cur.execute("EXPLAIN QUERY PLAN " + sql, args)
+        return [row[-1] for row in cur.fetchall()]
+
+    def drop_table_sql(self, table):
+        return f'DROP TABLE IF EXISTS "{table}";'
+
+    def create_table_sql(self, table):
+        return TABLE_DDL[table].format(serial='INTEGER')
+
+    def heartbeat_table_sql(self):
+        return HEARTBEAT_DDL.format(bigserial='INTEGER')
+
+    def truncate_sql(self, table):
+        return f'DELETE FROM "{table}";'
+
+    def wal_lsn(self, cur):
+        return None
+
+    def wal_status(self, cur):
+        return None
+
+    def probe_read(self, cur):
+        cur.execute("SELECT order_code FROM \"Order\" LIMIT 1;")
+        cur.fetchone()
+        try:
+            return os.path.getmtime(self.started_file)
+        except OSError:
+            return None
+
+    # 数据集是数据库文件旁的一个副本，重建即复制文件
+    def _dataset_path(self, name):
+        return f"{self.path}.{name}"
+
+    def dataset_exists(self, name):
+        return os.path.exists(self._dataset_path(name))
+
+    def recreate_database(self, template=None):
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        if template is not None:
+            shutil.copyfile(self._dataset_path(template), self.path)
+
+    def save_dataset(self, name):
+        # 数据库处于 WAL 模式，用 backup 接口复制，包括尚未检查点到主文件的页面
+        target = self._dataset_path(name)
+        if os.path.exists(target):
+            os.remove(target)
+        source = sqlite3.connect(self.path)
+        try:
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+        finally:
+            source.close()
+
+    def drop_dataset(self, name):
+        if os.path.exists(self._dataset_path(name)):
+            os.remove(self._dataset_path(name))
+
+    def start(self, data_dir):
+        if os.path.exists(self.down_marker):
+            os.remove(self.down_marker)
+        with open(self.started_file, 'w') as f:
+            f.write(str(time.time()))
+        return subprocess.CompletedProcess(['sqlite-start', self.path], 0, stdout=f"{self.path} 已可用\n", stderr='')
+
+    def stop(self, data_dir):
+        return self.kill(data_dir)
+
+    def kill(self, data_dir):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.down_marker, 'w') as f:
+            f.write(str(time.time()))
+        return subprocess.CompletedProcess(['sqlite-kill', self.path], 0, stdout=f"{self.path} 已标记为宕机\n", stderr='')
+
+
+BACKENDS = {
+    'postgresql': PostgresBackend,
+    'postgresql_local': EphemeralPostgresBackend,
+    'sqlite': SQLiteBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if DB_BACKEND not in BACKENDS:
+            raise ValueError(f"不支持的数据库后端: {DB_BACKEND}")
+        _backend = BACKENDS[DB_BACKEND]()
+    return _backend
@@ -0,0 +1,52 @@
+import argparse
+import random
+import time
+
+from indexed_set import IndexedSet
+
+# 模拟 select/update/delete 在客户端选取订单号的开销：
+# 旧实现每次 random.choice(list(set))，新实现 IndexedSet.choice()，插入和删除同时进行以保持规模不变。
+
+ORDER_CODE_RANGE = (100000000000, 999999999999)
+
+
+def bench_list_of_set(codes, rng, operations):
+    existing = set(codes)
+    start = time.perf_counter()
+    for _ in range(operations):
+        victim = rng.choice(list(existing))
+        existing.discard(victim)
+        existing.add(rng.randint(*ORDER_CODE_RANGE))
+    return (time.perf_counter() - start) / operations
+
+
+def bench_indexed_set(codes, rng, operations):
+    existing = IndexedSet(codes)
+    start = time.perf_counter()
+    for _ in range(operations):
+        victim = existing.choice(rng)
+        existing.discard(victim)
+        existing.add(rng.randint(*ORDER_CODE_RANGE))
+    return (time.perf_counter() - start) / operations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较订单号随机选取的客户端开销。")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help="订单表规模（订单号数量）")
+    parser.add_argument('--operations', type=int, default=200,
+                        help="每个规模下执行的选取+删除+插入次数")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'订单数':>10}{'list(set) 每次(us)':>22}{'IndexedSet 每次(us)':>22}")
+    for size in args.sizes:
+        codes = rng.sample(range(ORDER_CODE_RANGE[0], ORDER_CODE_RANGE[1] + 1), size)
+        old_cost = bench_list_of_set(codes, rng, args.operations)
+        # IndexedSet 的单次开销很小，多跑一些次数让计时稳定
+        new_cost = bench_indexed_set(codes, rng, args.operations * 100)
+        print(f"{size:>10}{old_cost * 1e6:>22.2f}{new_cost * 1e6:>22.2f}")
+
+
+if __name__ == '__main__':
+    main()
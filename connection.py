@@ -1,3 +1,5 @@
+from settings import DB_BACKEND, DATASET_RESET, DATASET_DATABASE
+
 # Database connection configuration
 DB_CONFIG = {
     "host": "192.168.1.155",
@@ -7,6 +9,17 @@ DB_CONFIG = {
     "port": "5432"
 }
 
+# postgresql_local 后端连接本机临时集群（见 ephemeral_pg.py），第一次导入时创建集群并替换连接参数
+if DB_BACKEND == 'postgresql_local':
+    from ephemeral_pg import ensure_cluster
+    DB_CONFIG = ensure_cluster(DB_CONFIG)
+
+# DATASET_RESET = 'template' 时实验在单独的 DATASET_DATABASE 中进行，每次运行前由数据集模板重建（见 dataset.py）；
+# ADMIN_DB_CONFIG 指向原来配置的数据库，用于建库和删库
+ADMIN_DB_CONFIG = DB_CONFIG
+if DATASET_RESET == 'template':
+    DB_CONFIG = dict(DB_CONFIG, database=DATASET_DATABASE)
+
 # Construct the DSN (Data Source Name) string for psycopg2
 DSN = (
     f"host={DB_CONFIG['host']} "
@@ -1,86 +1,35 @@
-import psycopg2
 import random
+import io
+import time
 from datetime import datetime, timedelta
 from connection import DB_CONFIG
+from backends import get_backend, TABLES, TABLE_INDEXES
 import itertools
 from settings import (
     K_WORKERS, 
     BASE_NUM_USERS,
     BASE_NUM_PRODUCTS,
-    BASE_NUM_ORDERS
+    BASE_NUM_ORDERS,
+    DATA_LOAD_MODE,
+    SCALE_FACTOR,
+    BULK_LOAD_CHUNK_ORDERS
 )
 
 def create_tables():
+    backend = get_backend()
     conn = None
     try:
-        conn = psycopg2.connect(
-            host=DB_CONFIG['host'],
-            database=DB_CONFIG['database'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password']
-        )
+        conn = backend.connect()
         cur = conn.cursor()
 
-        cur.execute("DROP TABLE IF EXISTS \"OrderItem\" CASCADE;")
-        cur.execute("DROP TABLE IF EXISTS \"Order\" CASCADE;")
-        cur.execute("DROP TABLE IF EXISTS \"Product\" CASCADE;")
-        cur.execute("DROP TABLE IF EXISTS \"User\" CASCADE;")
+        for table in reversed(TABLES):
+            cur.execute(backend.drop_table_sql(table))
         print("现有表已成功删除（如果存在）。")
 
-        # create User table
-        cur.execute("""
-            CREATE TABLE "User" (
-                id SERIAL PRIMARY KEY, -- 用户表id,自动递增主键
-                username VARCHAR(50) NOT NULL UNIQUE -- 用户名，非空且唯一
-            );
-        """)
-        print("表 'User' 创建成功。")
-
-        # create Product table
-        cur.execute("""
-            CREATE TABLE "Product" (
-                id SERIAL PRIMARY KEY, -- 商品id,自动递增主键
-                name VARCHAR(255) NOT NULL, -- 商品名称
-                description TEXT, -- 商品描述
-                price DECIMAL(20, 2) NOT NULL, -- 商品单价, 单位是元, 保留两位小数
-                stock INTEGER NOT NULL CHECK (stock >= 0), -- 库存数量，非空且不能为负
-                create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 创建时间,默认为当前时间
-                update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP -- 更新时间，默认为当前时间
-            );
-        """)
-        print("表 'Product' 创建成功。")
-
-        # create Order table
-        cur.execute("""
-            CREATE TABLE "Order" (
-                id SERIAL PRIMARY KEY, -- 订单id,自动递增主键
-                order_code BIGINT UNIQUE NOT NULL, -- 订单号，唯一且非空
-                user_id INTEGER DEFAULT NULL, -- 用户id,允许为空（例如匿名订单）
-                payment DECIMAL(20, 2) DEFAULT NULL, -- 付款金额,单位是元, 保留两位小数，允许为空
-                create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 订单创建时间，默认为当前时间
-                update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 订单更新时间，默认为当前时间
-                CONSTRAINT fk_order_user FOREIGN KEY (user_id) REFERENCES "User"(id) ON DELETE SET NULL -- 外键约束,如果用户被删除,则用户ID设为NULL
-            );
-        """)
-        print("表 'Order' 创建成功。")
-
-        # create orderItem table
-        cur.execute("""
-            CREATE TABLE "OrderItem" (
-                id SERIAL PRIMARY KEY, -- 订单子表id,自动递增主键
-                user_id INTEGER DEFAULT NULL, -- 用户id,冗余字段,提高查询效率,允许为空
-                order_code BIGINT DEFAULT NULL, -- 订单号,允许为空
-                product_id INTEGER DEFAULT NULL, -- 商品id,允许为空
-                current_unit_price DECIMAL(20, 2) DEFAULT NULL, -- 生成订单时的商品单价,单位是元,保留两位小数,允许为空
-                quantity INTEGER DEFAULT NULL CHECK (quantity >= 0), -- 商品购买数量,允许为空且不能为负
-                total_price DECIMAL(20, 2) DEFAULT NULL, -- 商品总价，单位是元,保留两位小数,允许为空
-                create_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 创建时间,默认为当前时间
-                update_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP, -- 更新时间，默认为当前时间
-                CONSTRAINT fk_orderitem_order FOREIGN KEY (order_code) REFERENCES "Order"(order_code) ON DELETE SET NULL, -- 外键约束,如果订单被删除,则订单号设为NULL
-                CONSTRAINT fk_orderitem_product FOREIGN KEY (product_id) REFERENCES "Product"(id) ON DELETE SET NULL -- 外键约束,如果商品被删除,则商品ID设为NULL
-            );
-        """)
-        print("表 'OrderItem' 创建成功。")
+        # 建表语句按后端方言生成，见 backends.TABLE_DDL
+        for table in TABLES:
+            cur.execute(backend.create_table_sql(table))
+            print(f"表 '{table}' 创建成功。")
 
         conn.commit()
         print("所有表创建成功。")
@@ -88,22 +37,16 @@ def create_tables():
         print("表 'User' 的索引：'id' (主键) 和 'username' (唯一) 已隐式索引。")
         print("表 'Product' 的索引：'id' (主键) 已隐式索引。")
 
-        # Order index
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_order_user_id ON \"Order\" (user_id);")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_order_create_time ON \"Order\" (create_time DESC);")
-        print("表 'Order' 的索引已创建。")
-
-        # OrderItem index
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_orderitem_order_code ON \"OrderItem\" (order_code);")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_orderitem_product_id ON \"OrderItem\" (product_id);")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_orderitem_user_order_code ON \"OrderItem\" (user_id, order_code);")
-        print("表 'OrderItem' 的索引已创建。")
+        for table, indexes in TABLE_INDEXES.items():
+            for index_sql in indexes:
+                cur.execute(index_sql)
+            print(f"表 '{table}' 的索引已创建。")
 
         conn.commit()
         print("所有索引创建成功或已存在。")
 
-    except psycopg2.Error as e:
-        print(f"连接PostgreSQL或创建表/索引时出错: {e}")
+    except backend.Error as e:
+        print(f"连接数据库或创建表/索引时出错: {e}")
     finally:
         if conn:
             conn.close()
@@ -112,12 +55,7 @@ def create_tables():
 def insert_test_data(host, database, user, password):
     conn = None
     try:
-        conn = psycopg2.connect(
-            host=DB_CONFIG['host'],
-            database=DB_CONFIG['database'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password']
-        )
+        conn = get_backend().connect()
         cur = conn.cursor()
 
         print("开始插入测试数据...")
@@ -239,8 +177,143 @@ def insert_test_data(host, database, user, password):
         conn.commit()
         print("所有测试数据插入成功。")
 
-    except psycopg2.Error as e:
-        print(f"连接PostgreSQL或插入测试数据时出错: {e}")
+    except get_backend().Error as e:
+        print(f"连接数据库或插入测试数据时出错: {e}")
+        if conn:
+            conn.rollback()
+            print("事务已回滚。")
+    finally:
+        if conn:
+            conn.close()
+            print("数据库连接已关闭。")
+
+
+def _random_timestamps(rng, n):
+    # 一次生成 n 个 2025 年内的随机创建/更新时间（字符串），供 COPY 直接使用
+    months = rng.choices(range(1, 13), k=n)
+    days = rng.choices(range(1, 29), k=n)
+    seconds = rng.choices(range(86400), k=n)
+    deltas = rng.choices(range(0, 61), k=n)
+    created = []
+    updated = []
+    for month, day, sec, delta in zip(months, days, seconds, deltas):
+        create_time = datetime(2025, month, day) + timedelta(seconds=sec)
+        created.append(create_time.strftime('%Y-%m-%d %H:%M:%S'))
+        updated.append((create_time + timedelta(minutes=delta)).strftime('%Y-%m-%d %H:%M:%S'))
+    return created, updated
+
+
+def _cents_to_text(cents):
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+def _copy_rows(cur, table, columns, rows):
+    buf = io.StringIO()
+    buf.writelines(rows)
+    buf.seek(0)
+    cur.copy_expert(f'COPY "{table}" ({", ".join(columns)}) FROM STDIN', buf)
+
+
+def bulk_insert_test_data(scale_factor=SCALE_FACTOR, chunk_orders=BULK_LOAD_CHUNK_ORDERS, seed=None):
+    conn = None
+    rng = random.Random(seed)
+    num_users = BASE_NUM_USERS * scale_factor
+    num_products = BASE_NUM_PRODUCTS * scale_factor
+    num_orders = BASE_NUM_ORDERS * scale_factor
+    try:
+        conn = get_backend().connect()
+        cur = conn.cursor()
+        load_start = time.time()
+        print(f"开始批量加载测试数据（规模因子 {scale_factor}）...")
+
+        # 显式指定 id，加载完成后再同步序列，避免逐行 RETURNING id
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM \"User\";")
+        user_id_offset = cur.fetchone()[0]
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM \"Product\";")
+        product_id_offset = cur.fetchone()[0]
+
+        user_prefixes = ["Alpha", "Beta", "Gamma", "Delta", "Epsilon", "Zeta", "Theta", "Iota", "Kappa", "Lambda"]
+        user_suffixes = ["User", "Knight", "Rider", "Mage", "Guardian", "Wanderer", "Explorer", "Seeker", "Dreamer", "Architect"]
+        user_ids = list(range(user_id_offset + 1, user_id_offset + num_users + 1))
+        name_parts = list(itertools.product(user_prefixes, user_suffixes))
+        _copy_rows(cur, "User", ["id", "username"],
+                   (f"{user_id}\t{name_parts[user_id % len(name_parts)][0]}{name_parts[user_id % len(name_parts)][1]}{user_id}\n"
+                    for user_id in user_ids))
+        print(f"插入了 {len(user_ids)} 条用户数据。")
+
+        product_adjectives = ["Premium", "Ultra", "Dynamic", "Compact", "Ergonomic", "Smart", "Portable", "Sleek", "Durable", "Advanced"]
+        product_midfixes = ["Pro", "Max", "Lite", "Plus", "Core", "Prime", "Elite", "Connect", "Vision", "Master"]
+        product_nouns = ["Mouse", "Keyboard", "Monitor", "SSD", "Headphones", "Webcam", "Chair", "Speaker", "Charger", "Dock"]
+        product_ids = list(range(product_id_offset + 1, product_id_offset + num_products + 1))
+        # 商品价格以分为单位保存在客户端，生成订单项时直接查表，不再回查数据库
+        product_price_cents = rng.choices(range(5000, 500001), k=num_products)
+        stocks = rng.choices(range(10, 501), k=num_products)
+        adjectives = rng.choices(product_adjectives, k=num_products)
+        midfixes = rng.choices(product_midfixes, k=num_products)
+        nouns = rng.choices(product_nouns, k=num_products)
+        created, updated = _random_timestamps(rng, num_products)
+        _copy_rows(cur, "Product", ["id", "name", "description", "price", "stock", "create_time", "update_time"],
+                   (f"{product_ids[i]}\t{adjectives[i]} {midfixes[i]} {nouns[i]} {product_ids[i]}\t"
+                    f"A {adjectives[i].lower()}, {midfixes[i].lower()} and {nouns[i].lower()} with excellent features.\t"
+                    f"{_cents_to_text(product_price_cents[i])}\t{stocks[i]}\t{created[i]}\t{updated[i]}\n"
+                    for i in range(num_products)))
+        print(f"插入了 {len(product_ids)} 条商品数据。")
+
+        cur.execute("SELECT setval(pg_get_serial_sequence('\"User\"', 'id'), %s);", (user_ids[-1],))
+        cur.execute("SELECT setval(pg_get_serial_sequence('\"Product\"', 'id'), %s);", (product_ids[-1],))
+
+        cur.execute("SELECT order_code FROM \"Order\";")
+        used_order_codes = {row[0] for row in cur.fetchall()}
+        order_codes = [code for code in rng.sample(range(100000000000, 1000000000000), num_orders + len(used_order_codes))
+                       if code not in used_order_codes][:num_orders]
+
+        total_order_items = 0
+        for chunk_start in range(0, num_orders, chunk_orders):
+            chunk_codes = order_codes[chunk_start:chunk_start + chunk_orders]
+            n = len(chunk_codes)
+            order_users = rng.choices(user_ids, k=n)
+            order_created, order_updated = _random_timestamps(rng, n)
+            items_per_order = rng.choices(range(1, 11), k=n)
+            num_items = sum(items_per_order)
+            item_products = rng.choices(range(num_products), k=num_items)
+            item_quantities = rng.choices(range(1, 21), k=num_items)
+            item_created, item_updated = _random_timestamps(rng, num_items)
+
+            # 订单的 payment 等于其订单项 total_price 之和，保证一致性检查仍然成立
+            order_rows = []
+            item_rows = []
+            item = 0
+            for i in range(n):
+                order_code = chunk_codes[i]
+                user_id = order_users[i]
+                payment_cents = 0
+                for _ in range(items_per_order[i]):
+                    product_index = item_products[item]
+                    unit_cents = product_price_cents[product_index]
+                    quantity = item_quantities[item]
+                    total_cents = unit_cents * quantity
+                    payment_cents += total_cents
+                    item_rows.append(f"{user_id}\t{order_code}\t{product_ids[product_index]}\t{_cents_to_text(unit_cents)}\t"
+                                     f"{quantity}\t{_cents_to_text(total_cents)}\t{item_created[item]}\t{item_updated[item]}\n")
+                    item += 1
+                order_rows.append(f"{order_code}\t{user_id}\t{_cents_to_text(payment_cents)}\t{order_created[i]}\t{order_updated[i]}\n")
+
+            _copy_rows(cur, "Order", ["order_code", "user_id", "payment", "create_time", "update_time"], order_rows)
+            _copy_rows(cur, "OrderItem", ["user_id", "order_code", "product_id", "current_unit_price", "quantity",
+                                          "total_price", "create_time", "update_time"], item_rows)
+            total_order_items += num_items
+            print(f"已加载 {chunk_start + n}/{num_orders} 条订单，{total_order_items} 条订单项...")
+
+        conn.commit()
+        print(f"插入了 {num_orders} 条订单数据，{total_order_items} 条订单项数据。")
+
+        conn.autocommit = True
+        for table in ("User", "Product", "Order", "OrderItem"):
+            cur.execute(f'ANALYZE "{table}";')
+        print(f"所有测试数据批量加载成功，耗时 {time.time() - load_start:.2f} 秒。")
+
+    except get_backend().Error as e:
+        print(f"连接PostgreSQL或批量加载测试数据时出错: {e}")
         if conn:
             conn.rollback()
             print("事务已回滚。")
@@ -248,3 +321,13 @@ def insert_test_data(host, database, user, password):
         if conn:
             conn.close()
             print("数据库连接已关闭。")
+
+
+def load_test_data(host, database, user, password):
+    if DATA_LOAD_MODE == 'copy' and not get_backend().supports_copy:
+        print(f"{get_backend().name} 后端不支持 COPY，改为逐行插入测试数据。")
+        insert_test_data(host=host, database=database, user=user, password=password)
+    elif DATA_LOAD_MODE == 'copy':
+        bulk_insert_test_data()
+    else:
+        insert_test_data(host=host, database=database, user=user, password=password)
@@ -0,0 +1,86 @@
+import argparse
+import hashlib
+import json
+import time
+
+from backends import get_backend, TABLE_DDL, TABLE_INDEXES
+from connection import DB_CONFIG
+from create_table import create_tables, load_test_data
+from settings import (
+    BASE_NUM_USERS,
+    BASE_NUM_PRODUCTS,
+    BASE_NUM_ORDERS,
+    SCALE_FACTOR,
+    DATA_LOAD_MODE
+)
+
+# 测试数据集模板。数据集名由数据规模、加载方式和表结构决定，同一组设置只生成一次：
+# 在实验数据库中建表并加载数据后复制为数据集（PostgreSQL 为一个数据库，sqlite 为数据库文件的副本）；
+# 之后每次运行删除实验数据库，再以数据集为模板复制出来，耗时与文件复制相当，不再重新生成数据，
+# 每次运行的初始数据也完全相同。表结构或规模设置变化后得到新的数据集名，旧数据集用 --drop 删除。
+
+
+def dataset_name():
+    spec = {
+        'users': BASE_NUM_USERS,
+        'products': BASE_NUM_PRODUCTS,
+        'orders': BASE_NUM_ORDERS,
+        'scale_factor': SCALE_FACTOR,
+        'load_mode': DATA_LOAD_MODE,
+        'schema': [TABLE_DDL, TABLE_INDEXES],
+    }
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:10]
+    return f"bench_seed_sf{SCALE_FACTOR}_{digest}"
+
+
+def build_dataset(name):
+    backend = get_backend()
+    start = time.monotonic()
+    print(f"生成数据集 {name}...")
+    backend.recreate_database()
+    create_tables()
+    load_test_data(host=DB_CONFIG['host'], database=DB_CONFIG['database'], user=DB_CONFIG['user'],
+                   password=DB_CONFIG['password'])
+    # 建表和加载失败时只打印错误，保存前确认确实有数据，避免把空库保存成模板
+    conn = backend.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM \"User\";")
+        user_count = cur.fetchone()[0]
+    finally:
+        conn.close()
+    if user_count == 0:
+        raise RuntimeError(f"数据集 {name} 加载失败，实验数据库中没有用户数据")
+    backend.save_dataset(name)
+    print(f"数据集 {name} 生成完成，用时 {time.monotonic() - start:.1f} 秒。")
+
+
+def reset_dataset(rebuild=False):
+    # 返回数据集名；数据集不存在或 rebuild 时先生成，生成后实验数据库就是刚加载的数据，不需要再复制
+    backend = get_backend()
+    name = dataset_name()
+    if rebuild or not backend.dataset_exists(name):
+        build_dataset(name)
+        return name
+    start = time.monotonic()
+    backend.recreate_database(template=name)
+    print(f"已由数据集 {name} 重建实验数据库，用时 {time.monotonic() - start:.2f} 秒。")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成或删除当前设置对应的测试数据集模板。")
+    parser.add_argument('--rebuild', action='store_true', help="重新生成数据集，即使已经存在")
+    parser.add_argument('--drop', action='store_true', help="删除当前设置对应的数据集")
+    args = parser.parse_args()
+
+    name = dataset_name()
+    if args.drop:
+        get_backend().drop_dataset(name)
+        print(f"已删除数据集 {name}。")
+        return
+    reset_dataset(rebuild=args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+
+from backends import get_backend
+from log_sink import get_logger
+from metrics import WorkloadStats
+from settings import (
+    POOL_ENABLED,
+    POOL_MIN_CONNECTIONS,
+    POOL_MAX_CONNECTIONS,
+    POOL_HEALTH_CHECK_IDLE
+)
+
+# 连接建立耗时单独作为指标记录，便于比较连接池开启/关闭时的吞吐量差异：
+# 'connection_setup' 为建立新物理连接的耗时，'connection_checkout' 为每次取得连接的耗时
+connection_stats = WorkloadStats()
+
+
+def _is_broken(conn):
+    return conn.closed != 0
+
+
+class ConnectionPool:
+    def __init__(self, backend=None, minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS,
+                 health_check_idle=POOL_HEALTH_CHECK_IDLE, enabled=POOL_ENABLED):
+        self.backend = backend or get_backend()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_idle = health_check_idle
+        self.enabled = enabled
+        self._idle = []  # [(conn, 上次归还的时间)]
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            for _ in range(self.minconn):
+                try:
+                    self._idle.append((self._connect(), time.monotonic()))
+                except self.backend.Error as e:
+                    get_logger().warning("连接池预热失败: %s", e)
+                    break
+
+    def _connect(self):
+        start = time.monotonic_ns()
+        conn = self.backend.connect()
+        connection_stats.start()
+        connection_stats.record('connection_setup', time.monotonic_ns() - start, timeline=False)
+        connection_stats.stop()
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        if _is_broken(conn):
+            return False
+        if time.monotonic() - idle_since < self.health_check_idle:
+            return True
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except self.backend.Error:
+            return False
+
+    def getconn(self, autocommit=True):
+        start = time.monotonic_ns()
+        conn = None
+        if self.enabled:
+            with self._lock:
+                while self._idle:
+                    candidate, idle_since = self._idle.pop()
+                    if self._healthy(candidate, idle_since):
+                        conn = candidate
+                        break
+                    self._close_quietly(candidate)
+                if conn is None and self._in_use >= self.maxconn:
+                    raise self.backend.Error(f"连接池已满（最大 {self.maxconn} 个连接）")
+                self._in_use += 1
+        try:
+            if conn is None:
+                conn = self._connect()
+            conn.autocommit = autocommit
+        except Exception:
+            if self.enabled:
+                with self._lock:
+                    self._in_use -= 1
+            raise
+        connection_stats.start()
+        connection_stats.record('connection_checkout', time.monotonic_ns() - start, timeline=False)
+        connection_stats.stop()
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not self.enabled:
+            self._close_quietly(conn)
+            return
+        broken = discard or _is_broken(conn)
+        if not broken and self.backend.in_transaction(conn):
+            try:
+                conn.rollback()
+            except self.backend.Error:
+                broken = True
+        with self._lock:
+            self._in_use -= 1
+            if broken:
+                # 连接断开通常意味着数据库发生了故障，同一批空闲连接也已失效，一并丢弃
+                self._close_quietly(conn)
+                idle, self._idle = self._idle, []
+                for idle_conn, _ in idle:
+                    self._close_quietly(idle_conn)
+            elif len(self._idle) >= self.maxconn:
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_pid = None
+# fork 后子进程继承的连接与父进程共用 socket，子进程不能关闭它们（否则会终止父进程的会话），
+# 只保留引用避免被回收
+_inherited_pools = []
+
+
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        if _pool is not None:
+            _inherited_pools.append(_pool)
+        _pool = ConnectionPool()
+        _pool_pid = pid
+    return _pool
+
+
+def getconn(autocommit=True):
+    return get_pool().getconn(autocommit=autocommit)
+
+
+def putconn(conn, discard=False):
+    get_pool().putconn(conn, discard=discard)
+
+
+def close_pool():
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
+        _pool = None
+
+
+def drain_connection_stats():
+    global connection_stats
+    stats, connection_stats = connection_stats, WorkloadStats()
+    return stats
@@ -0,0 +1,193 @@
+import atexit
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+
+from settings import (
+    EPHEMERAL_PG_BIN,
+    EPHEMERAL_PG_ROOT,
+    EPHEMERAL_PG_KEEP,
+    EPHEMERAL_PG_CONF,
+    EPHEMERAL_PG_START_ATTEMPTS
+)
+
+# 本机临时 PostgreSQL 集群（DB_BACKEND = 'postgresql_local'）。第一次导入 connection.py 的进程在临时目录
+# initdb 一个集群，写入 EPHEMERAL_PG_CONF 调优参数，在空闲端口启动，并把集群位置写入环境变量
+# ENV_VAR；之后 fork 或 spawn 的子进程（工作器、sweep.py 的每次运行）看到环境变量时直接连接同一个集群。
+# kill 只向 postmaster.pid 中记录的 postmaster 及其子进程发送 SIGKILL，不影响本机其他 PostgreSQL，
+# 多个实验可以在同一台机器上各用一个集群并行运行。创建集群的进程退出时停止集群并删除目录。
+#
+# initdb 不能以 root 运行，需要用普通用户启动实验。
+
+ENV_VAR = 'BENCH_EPHEMERAL_PG'
+
+_cluster = None
+
+
+def _bin(name):
+    return os.path.join(EPHEMERAL_PG_BIN, name) if EPHEMERAL_PG_BIN else name
+
+
+def _run(command):
+    return subprocess.run(command, capture_output=True, text=True, check=True)
+
+
+def free_port():
+    # 由内核分配一个当前空闲的端口；启动前被占用时换一个端口重试
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _write_conf(data_dir, base_dir, port):
+    settings = dict(EPHEMERAL_PG_CONF)
+    settings.update({
+        'port': port,
+        'listen_addresses': "'127.0.0.1'",
+        'unix_socket_directories': f"'{base_dir}'",
+    })
+    # postgresql.conf 中后出现的设置生效，追加在 initdb 生成的默认配置之后
+    with open(os.path.join(data_dir, 'postgresql.conf'), 'a') as f:
+        f.write("\n# bench ephemeral cluster\n")
+        for name, value in settings.items():
+            f.write(f"{name} = {value}\n")
+
+
+def _config(base_config, cluster):
+    config = dict(base_config)
+    config.update(host='127.0.0.1', port=str(cluster['port']), user=cluster['user'], database='postgres')
+    return config
+
+
+def ensure_cluster(base_config):
+    # 返回临时集群的连接参数；password 保留原值，集群使用 trust 认证不校验
+    global _cluster
+    if _cluster is None and os.environ.get(ENV_VAR):
+        _cluster = json.loads(os.environ[ENV_VAR])
+    if _cluster is None:
+        _cluster = create_cluster(base_config['user'])
+        os.environ[ENV_VAR] = json.dumps(_cluster)
+        atexit.register(_cleanup, os.getpid())
+    return _config(base_config, _cluster)
+
+
+def create_cluster(user):
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        raise RuntimeError("initdb 不能以 root 运行，请用普通用户运行 postgresql_local 后端")
+    if EPHEMERAL_PG_ROOT:
+        os.makedirs(EPHEMERAL_PG_ROOT, exist_ok=True)
+    base_dir = tempfile.mkdtemp(prefix='bench_pg_', dir=EPHEMERAL_PG_ROOT)
+    data_dir = os.path.join(base_dir, 'data')
+    print(f"在 {data_dir} 初始化临时 PostgreSQL 集群...")
+    _run([_bin('initdb'), '-D', data_dir, '-U', user, '--auth=trust', '-E', 'UTF8', '--no-sync'])
+    cluster = {'base_dir': base_dir, 'data_dir': data_dir, 'user': user, 'port': None}
+    for attempt in range(EPHEMERAL_PG_START_ATTEMPTS):
+        port = free_port()
+        _write_conf(data_dir, base_dir, port)
+        cluster['port'] = port
+        try:
+            start_cluster(cluster)
+        except subprocess.CalledProcessError as e:
+            print(f"临时集群在端口 {port} 启动失败（第 {attempt + 1} 次）: {e.stderr}")
+            continue
+        print(f"临时 PostgreSQL 集群已在 127.0.0.1:{port} 启动。")
+        return cluster
+    shutil.rmtree(base_dir, ignore_errors=True)
+    raise RuntimeError(f"临时集群连续 {EPHEMERAL_PG_START_ATTEMPTS} 次启动失败")
+
+
+def current_cluster():
+    if _cluster is None:
+        raise RuntimeError("临时集群尚未创建，postgresql_local 后端需要先导入 connection")
+    return _cluster
+
+
+def postmaster_pid(cluster=None):
+    # postmaster.pid 第一行是 postmaster 的 PID；文件不存在时集群没有运行
+    cluster = cluster or current_cluster()
+    try:
+        with open(os.path.join(cluster['data_dir'], 'postmaster.pid')) as f:
+            return int(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def start_cluster(cluster=None):
+    cluster = cluster or current_cluster()
+    # -l 把服务器输出写入日志文件，postmaster 不继承 pg_ctl 的输出管道，pg_ctl 返回后 subprocess.run 不会等待
+    return _run([_bin('pg_ctl'), 'start', '-w', '-D', cluster['data_dir'],
+                 '-l', os.path.join(cluster['base_dir'], 'server.log')])
+
+
+def stop_cluster(cluster=None, mode='fast'):
+    cluster = cluster or current_cluster()
+    return _run([_bin('pg_ctl'), 'stop', '-m', mode, '-D', cluster['data_dir']])
+
+
+def _children(pid):
+    return [int(child) for child in
+            subprocess.run(['pgrep', '-P', str(pid)], capture_output=True, text=True).stdout.split()]
+
+
+def _sigkill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def kill_cluster(cluster=None, wait=5.0):
+    # SIGKILL postmaster 及其子进程（后端、checkpointer、walwriter 等），等效于整个实例崩溃；
+    # 只 kill postmaster 时残留的后端仍挂着共享内存，pg_ctl start 会拒绝启动。
+    # 先 SIGSTOP postmaster，使它在列举子进程期间不能再 fork 新的后端；已经 fork 出的子进程在 pgrep
+    # 之后才出现在进程表中时，反复列举直到没有新的子进程
+    cluster = cluster or current_cluster()
+    pid = postmaster_pid(cluster)
+    if pid is None or not _alive(pid):
+        raise subprocess.CalledProcessError(1, ['kill', '-9', str(pid)], stderr=f"{cluster['data_dir']} 没有运行中的 postmaster")
+    os.kill(pid, signal.SIGSTOP)
+    killed = set()
+    while True:
+        children = [child for child in _children(pid) if child not in killed]
+        if not children:
+            break
+        for child in children:
+            _sigkill(child)
+            killed.add(child)
+    _sigkill(pid)
+    pids = [pid] + sorted(killed)
+    deadline = time.monotonic() + wait
+    while any(_alive(target) for target in pids) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return subprocess.CompletedProcess(['kill', '-9'] + [str(p) for p in pids], 0,
+                                       stdout=f"已 kill postmaster {pid} 及 {len(killed)} 个子进程\n", stderr='')
+
+
+def _cleanup(owner_pid):
+    # fork 出的子进程也继承了 atexit 处理函数，只有创建集群的进程负责清理
+    if os.getpid() != owner_pid or _cluster is None:
+        return
+    if postmaster_pid(_cluster) is not None:
+        try:
+            stop_cluster(_cluster, mode='immediate')
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"停止临时集群失败: {e}")
+    if EPHEMERAL_PG_KEEP:
+        print(f"临时集群保留在 {_cluster['base_dir']}。")
+    else:
+        shutil.rmtree(_cluster['base_dir'], ignore_errors=True)
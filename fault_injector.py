@@ -2,11 +2,23 @@ import time
 import subprocess
 import sys
 
-def inject_fault(pg_data_dir):
+from backends import get_backend
+
+# 记录每次 kill 完成的时间（time.time()）和调用方在 kill 前取得的 WAL 采样（没有时为 None），供恢复时间线使用。
+# kill 路径上不再建立连接采样：协调器在预先建立的连接上采样（见 fault_schedule.FaultCoordinator），
+# 工作器在事务中途 kill 时由协调器用等待期间的最近一次采样补上。
+# 在创建工作进程和监控进程之前调用 track_fault_times()，子进程 fork 时继承同一个队列。
+_fault_queue = None
+
+def track_fault_times(fault_queue):
+    global _fault_queue
+    _fault_queue = fault_queue
+
+def inject_fault(pg_data_dir, wal=None):
     try:
-        command = ["sudo", "pkill", "-9", "-f", "postgres: .*"]
-        
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        result = get_backend().kill(pg_data_dir)
+        if _fault_queue is not None:
+            _fault_queue.put((time.time(), wal))
         print(f"数据库关闭成功: {result.stdout}")
         if result.stderr:
             print(f"stderr: {result.stderr}")
@@ -1,154 +1,317 @@
-import psycopg2
 import time
-from multiprocessing import Pool, Process, Event, Value
+from multiprocessing import Pool, Process, Event, Queue
 from CRUD import DBConn, OrderTransactionalWorker
 from functools import partial
 import sys
-import os
 import random
-import datetime
+import itertools
 
-from fault_injector import inject_fault
+from fault_injector import track_fault_times
 from connection import DB_CONFIG
 from multiple import MultiTableOperations
 from long import long_running_price_update
+from metrics import WorkloadStats, merge_stats, print_latency_report
+from order_registry import SharedOrderRegistry
+from arrivals import arrival_schedule
+from throughput_monitor import monitor_throughput
+from recovery import heartbeat_writer
+from verifier import CHECKS as CONSISTENCY_CHECKS, verify_consistency, print_violations
+from ledger import ACKNOWLEDGED, CommitLedger, clear_ledgers, outcome_for, reconcile, print_reconciliation
+from wal_stats import WalPhaseLog, record_recovery, print_recovery_model
+from fault_schedule import FaultCoordinator, TransactionCounter, WorkloadControl, schedule_for_mode, validate_schedule
+from backends import get_backend
+from fault_tolerance import Backoff, classify_error, CONNECTION_LOST, IN_DOUBT, SERIALIZATION
+import log_sink
+import db_pool
 from settings import (
-    K_WORKERS,
-    NUM_TRANSACTIONS_PER_WORKER,
-    FIRST_INJECTION_TRANSACTIONS,
-    SECOND_INJECTION_TRANSACTIONS,
-    FAULT_MODE,
-    TRANSACTION_RATIOS,
-    LONG_TRANSACTION_ITERATIONS,
-    FAULT_INJECTION_ITERATION,
-    FIRST_INJECTION_TIME, 
-    SECOND_INJECTION_TIME
+    SHARED_ORDER_REGISTRY,
+    ORDER_CODE_CAPACITY_UNBOUNDED,
+    LOAD_MODE,
+    THINK_TIME,
+    TARGET_TPS,
+    ARRIVAL_STEPS,
+    EXECUTOR,
+    ASYNC_PROCESSES,
+    HEARTBEAT_ENABLED,
+    SERIALIZATION_RETRIES,
+    LEDGER_ENABLED,
+    LONG_CONCURRENT_TRANSACTIONS,
+    WAL_STATS_ENABLED,
+    FAULT_SCHEDULE,
+    FAULT_SCHEDULE_REPEAT,
+    FAULT_SCHEDULE_UNTIL_DONE
 )
 
-def worker_function(worker_id, num_transactions, transaction_ratios, transaction_counter, multi_ops_instance, pg_data_dir, fault_mode_specific_injection=False, fault_point=None):
+# 进程池工作器共享的对象。共享内存和同步原语只能在创建进程时继承，
+# 不能作为 apply_async 的参数序列化，因此通过 Pool 的 initializer 传入。
+_worker_shared = {}
+
+def init_pool_worker(transaction_counter, order_registry=None, num_workers=1, control=None):
+    _worker_shared['transaction_counter'] = transaction_counter
+    _worker_shared['order_registry'] = order_registry
+    _worker_shared['num_workers'] = num_workers
+    _worker_shared['control'] = control
+
+def create_worker_pool(k_workers, transaction_counter, order_registry=None, control=None):
+    return Pool(k_workers, initializer=init_pool_worker,
+                initargs=(transaction_counter, order_registry, k_workers, control))
+
+def create_arrival_schedule(worker_id):
+    # 开环模式下总目标 TPS 平均分给各工作器，每个工作器按自己的预定时间表发起事务
+    if LOAD_MODE != 'open':
+        return None
+    share = 1.0 / _worker_shared.get('num_workers', 1)
+    return arrival_schedule(time.monotonic(), TARGET_TPS * share,
+                            steps=[(duration, tps * share) for duration, tps in ARRIVAL_STEPS],
+                            rng=random.Random(worker_id))
+
+def async_worker_function(process_id, client_ids, total_clients, num_transactions, transaction_ratios, multi_ops_instance):
+    # asyncpg 只在选择 asyncio 执行引擎时才需要
+    from async_engine import run_event_loop
     try:
-        with DBConn() as conn:
-            worker = OrderTransactionalWorker(worker_id, conn, transaction_ratios=transaction_ratios)
-            results = []
-
-            if fault_mode_specific_injection and worker_id == 0:
-                print(f"工作器 {worker_id}：正在执行带故障注入的特定多表操作")
-                if fault_point == 'delete_product_after_step2':
-                    multi_ops_instance.delete_product_and_related_order_items(
-                        inject_fault_at_point='after_step2',
-                        pg_data_dir=pg_data_dir
-                    )
-                elif fault_point == 'modify_price_after_order_item_update':
-                    multi_ops_instance.modify_product_price_and_update_orders(
-                        inject_fault_at_point='after_order_item_update',
-                        pg_data_dir=pg_data_dir
-                    )
-                elif fault_point == 'long_transaction_fault':
-                    try:
-                        with DBConn() as temp_conn:
-                            temp_conn.cursor.execute("SELECT id FROM \"Product\" ORDER BY RANDOM() LIMIT 1;")
-                            product_id_for_long_trx = temp_conn.cursor.fetchone()
-                            if product_id_for_long_trx:
-                                product_id_for_long_trx = product_id_for_long_trx[0]
-                                print(f"工作器 {worker_id}: 选定产品 ID {product_id_for_long_trx} 进行长事务。")
-                                long_running_price_update(product_id_for_long_trx, pg_data_dir)
-                            else:
-                                print(f"工作器 {worker_id}: 数据库中没有产品可用于长事务。")
-                    except Exception as e:
-                        print(f"工作器 {worker_id}: 获取产品 ID 失败: {e}")
-
-
-                results.append(f"特定多表故障注入在 {fault_point}")
-                return results
-
-            for i in range(num_transactions):
-                all_transaction_types = list(transaction_ratios.keys())
-                all_transaction_weights = list(transaction_ratios.values())
-
-                trx_type = random.choices(all_transaction_types, weights=all_transaction_weights, k=1)[0]
-
-                if trx_type == 'insert':
-                    result = worker.insert_order()
-                elif trx_type == 'select':
-                    result = worker.select_order()
-                elif trx_type == 'update':
-                    result = worker.update_order()
-                elif trx_type == 'delete':
-                    result = worker.delete_order()
-                elif trx_type == 'delete_product_multi_table':
-                    result = multi_ops_instance.delete_product_and_related_order_items()
-                elif trx_type == 'modify_product_price_multi_table':
-                    result = multi_ops_instance.modify_product_price_and_update_orders()
-                else:
-                    result = None
-
-                results.append(result)
-                with transaction_counter.get_lock():
-                    transaction_counter.value += 1
-                time.sleep(0.01)
-            print(f"工作器 {worker_id} 完成.")
-            return results
+        print(f"事件循环进程 {process_id}: 运行 {len(client_ids)} 个虚拟客户端。")
+        return run_event_loop(client_ids, total_clients, num_transactions, transaction_ratios,
+                              multi_ops_instance.existing_product_ids,
+                              _worker_shared['transaction_counter'], process_id, _worker_shared.get('order_registry'))
     except Exception as e:
-        print(f"工作器 {worker_id} 遇到错误: {e}")
-        return []
-
-def log_database_counts(db_config, stop_event):
-    host = db_config['host']
-    database = db_config['database']
-    user = db_config['user']
-    password = db_config['password']
-    port = db_config['port']
+        print(f"事件循环进程 {process_id} 遇到错误: {e}")
+        return WorkloadStats()
+    finally:
+        log_sink.flush()
+
+def start_workers(worker_func_with_args, k_workers, transaction_counter, order_registry, control=None):
+    # EXECUTOR 为 'asyncio' 时，k_workers 个客户端以协程形式分布到 ASYNC_PROCESSES 个事件循环进程上
+    if EXECUTOR == 'asyncio' and get_backend().name != 'postgresql':
+        print(f"asyncio 执行引擎基于 asyncpg，{get_backend().name} 后端改用进程池。")
+    elif EXECUTOR == 'asyncio':
+        num_processes = max(1, min(ASYNC_PROCESSES, k_workers))
+        pool = create_worker_pool(num_processes, transaction_counter, order_registry, control)
+        kwargs = worker_func_with_args.keywords
+        async_results = [pool.apply_async(async_worker_function,
+                                          (p, list(range(p, k_workers, num_processes)), k_workers,
+                                           kwargs['num_transactions'], kwargs['transaction_ratios'],
+                                           kwargs['multi_ops_instance']))
+                         for p in range(num_processes)]
+        return pool, async_results
+    pool = create_worker_pool(k_workers, transaction_counter, order_registry, control)
+    async_results = [pool.apply_async(worker_func_with_args, (i,)) for i in range(k_workers)]
+    return pool, async_results
+
+def create_order_registry(existing_order_codes, k_workers, num_transactions):
+    # num_transactions 为每个工作器（asyncio 执行器下为每个客户端）实际执行的事务数，None 表示不限
+    if not SHARED_ORDER_REGISTRY:
+        return None
+    # 运行期订单号从已有最大订单号之后开始分配，与初始数据和之前运行留下的订单都不冲突
+    code_base = max(max(existing_order_codes, default=0) + 1, 100000000000)
+    if num_transactions is None:
+        capacity = ORDER_CODE_CAPACITY_UNBOUNDED
+    else:
+        capacity = num_transactions * (SERIALIZATION_RETRIES + 1)
+    return SharedOrderRegistry(existing_order_codes, code_base, k_workers, capacity)
 
-    while not stop_event.is_set():
+def collect_worker_stats(async_results):
+    stats_list = []
+    for async_result in async_results:
         try:
-            with DBConn() as conn:
-                cur = conn.cursor
-
-                cur.execute("SELECT COUNT(*) FROM \"User\";")
-                user_count = cur.fetchone()[0]
-
-                cur.execute("SELECT COUNT(*) FROM \"Order\";")
-                order_count = cur.fetchone()[0]
-
-                cur.execute("SELECT COUNT(*) FROM \"OrderItem\";")
-                order_item_count = cur.fetchone()[0]
-
-                print(f"[{time.strftime('%H:%M:%S')}] Users: {user_count}, Orders: {order_count}, OrderItems: {order_item_count}")
-            time.sleep(2)
-        except psycopg2.OperationalError as e:
-            print(f"[{time.strftime('%H:%M:%S')}] 数据库连接丢失或失效 {e}")
-            time.sleep(20)
+            stats_list.append(async_result.get())
         except Exception as e:
-            print(f"[{time.strftime('%H:%M:%S')}] 错误发生: {e}")
-            time.sleep(5)
-    print("实时数据库计数日志记录停止。")
-
-def monitor_and_inject_fault_by_transaction_count(transaction_counter, target_transactions, pg_data_dir):
-    print(f"故障监控已启动，等待 {target_transactions} 个事务...")
+            print(f"获取工作器统计结果失败: {e}")
+    return stats_list
+
+MULTI_TABLE_TRANSACTIONS = ('delete_product_multi_table', 'modify_product_price_multi_table', 'nested_savepoint_multi_table')
+
+def run_transaction(worker, multi_ops_instance, trx_type):
+    if trx_type == 'insert':
+        return worker.insert_order()
+    elif trx_type == 'select':
+        return worker.select_order()
+    elif trx_type == 'update':
+        return worker.update_order()
+    elif trx_type == 'delete':
+        return worker.delete_order()
+    elif trx_type == 'delete_product_multi_table':
+        return multi_ops_instance.delete_product_and_related_order_items()
+    elif trx_type == 'modify_product_price_multi_table':
+        return multi_ops_instance.modify_product_price_and_update_orders()
+    elif trx_type == 'nested_savepoint_multi_table':
+        return multi_ops_instance.nested_savepoint_price_update()
+    return None
+
+def reconnect_worker(conn, backoff, worker_id):
+    # 按退避间隔反复重连，成功后连接池里也只剩新连接；超过 RECONNECT_GIVE_UP_AFTER 返回 False
+    print(f"工作器 {worker_id}: 数据库连接中断，开始重连...")
     while True:
-        with transaction_counter.get_lock():
-            current_transactions = transaction_counter.value
-
-        if current_transactions >= target_transactions:
-            inject_fault(pg_data_dir)
-            break
-        time.sleep(0.5)
-    print("监控结束。")
+        delay = backoff.next_delay()
+        if delay is None:
+            return False
+        time.sleep(delay)
+        try:
+            conn.reconnect()
+        except get_backend().Error:
+            continue
+        print(f"工作器 {worker_id}: 重连成功，累计等待 {backoff.waited:.3f} 秒。")
+        backoff.reset()
+        return True
 
-def monitor_and_inject_fault_by_time(delay_time, pg_data_dir):
-    print(f"故障监控已启动，等待 {delay_time} 秒...")
-    start_time = time.time()
-    while time.time() - start_time < delay_time:
-        time.sleep(0.5)
-    inject_fault(pg_data_dir)
-    print(f"时间到，故障注入完成（{delay_time} 秒后）。")
+def verify_after_recovery(label, transaction_ratios):
+    if not get_backend().supports_snapshots:
+        print(f"{label}: {get_backend().name} 后端不支持快照导出，跳过一致性检查。")
+        return None
+    checks = list(CONSISTENCY_CHECKS)
+    if transaction_ratios.get('update', 0) > 0:
+        # CRUD update 事务直接改写 payment，混合负载下 order_payment 不是不变量
+        checks.remove('order_payment')
+        print(f"{label}: update 事务比例不为 0，跳过 order_payment 检查。")
+    print(f"{label}: 验证恢复后的数据一致性...")
+    try:
+        violations = verify_consistency(checks)
+    except Exception as e:
+        print(f"{label}: 数据一致性验证失败: {e}")
+        return None
+    print_violations(violations, title=f"{label}一致性检查")
+    return violations
+
+def run_fault_point(worker_id, fault_point, slot, multi_ops_instance, pg_data_dir):
+    # 故障计划的事务步骤触发，由认领到请求的工作器执行；slot 0 注入故障
+    if fault_point == 'delete_product_after_step2':
+        multi_ops_instance.delete_product_and_related_order_items(
+            inject_fault_at_point='after_step2',
+            pg_data_dir=pg_data_dir
+        )
+    elif fault_point == 'modify_price_after_order_item_update':
+        multi_ops_instance.modify_product_price_and_update_orders(
+            inject_fault_at_point='after_order_item_update',
+            pg_data_dir=pg_data_dir
+        )
+    elif fault_point == 'long_transaction_fault':
+        # 并发的长事务按 id 对 slot 取模各选一个商品，互不相同；只有 slot 0 注入故障
+        try:
+            with DBConn() as temp_conn:
+                temp_conn.cursor.execute("SELECT id FROM \"Product\" WHERE id %% %s = %s ORDER BY RANDOM() LIMIT 1;",
+                                         (LONG_CONCURRENT_TRANSACTIONS, slot))
+                product_id_for_long_trx = temp_conn.cursor.fetchone()
+                if product_id_for_long_trx:
+                    product_id_for_long_trx = product_id_for_long_trx[0]
+                    multi_ops_instance.unledgered_writes.append(('unledgered_price_write', product_id_for_long_trx))
+                    print(f"工作器 {worker_id}: 选定产品 ID {product_id_for_long_trx} 进行长事务。")
+                    if slot == 0:
+                        long_running_price_update(product_id_for_long_trx, pg_data_dir)
+                    else:
+                        long_running_price_update(product_id_for_long_trx, pg_data_dir,
+                                                  fault_iteration=None, inject_fault_on_budget=False)
+                else:
+                    print(f"工作器 {worker_id}: 数据库中没有产品可用于长事务。")
+        except Exception as e:
+            print(f"工作器 {worker_id}: 获取产品 ID 失败: {e}")
+
+def _record_unledgered_writes(ledger, multi_ops_instance, start_ns, end_ns):
+    # 保存点嵌套事务和长事务（不注入故障的并发长事务、分段提交）改价、删除商品重算订单金额都不写账本，
+    # 只记下改过的键，对账时这些键只确认存在、不比较金额
+    if ledger is not None:
+        for trx_type, key in multi_ops_instance.unledgered_writes:
+            ledger.append(ACKNOWLEDGED, trx_type, key, 0, start_ns, end_ns)
+    multi_ops_instance.unledgered_writes.clear()
+
+def worker_function(worker_id, num_transactions, transaction_ratios, multi_ops_instance, pg_data_dir):
+    # num_transactions 为 None 时一直运行到协调器发出停止
+    transaction_counter = _worker_shared['transaction_counter']
+    control = _worker_shared.get('control')
+    stats = WorkloadStats()
+    ledger = None
+    try:
+        with DBConn() as conn:
+            worker = OrderTransactionalWorker(worker_id, conn, transaction_ratios=transaction_ratios,
+                                              order_registry=_worker_shared.get('order_registry'))
+
+            all_transaction_types = list(transaction_ratios.keys())
+            all_transaction_weights = list(transaction_ratios.values())
+
+            schedule = create_arrival_schedule(worker_id)
+            backoff = Backoff(rng=random.Random(worker_id))
+            if LEDGER_ENABLED:
+                ledger = CommitLedger(worker_id)
+            stats.start()
+            for i in (range(num_transactions) if num_transactions is not None else itertools.count()):
+                if control is not None:
+                    if not control.wait_if_paused():
+                        break
+                    claimed = control.fault_hook.claim()
+                    if claimed is not None:
+                        fault_point, slot = claimed
+                        print(f"工作器 {worker_id}：在 {fault_point} 执行故障注入事务（slot {slot}）")
+                        fault_start = time.monotonic_ns()
+                        reached = False
+                        try:
+                            run_fault_point(worker_id, fault_point, slot, multi_ops_instance, pg_data_dir)
+                        except SystemExit:
+                            # 注入点之后的 sys.exit() 模拟客户端崩溃；工作器本身继续运行，重连后接着执行负载
+                            reached = True
+                        finally:
+                            _record_unledgered_writes(ledger, multi_ops_instance, fault_start, time.monotonic_ns())
+                            # 出现异常时也要报告，否则协调器一直等待这个事务
+                            if slot == 0:
+                                control.fault_hook.release(fault_point, reached)
+                        continue
+                trx_type = random.choices(all_transaction_types, weights=all_transaction_weights, k=1)[0]
 
+                if schedule is not None:
+                    intended_start = next(schedule)
+                    delay = intended_start - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                trx_start = time.monotonic_ns()
+                source = multi_ops_instance if trx_type in MULTI_TABLE_TRANSACTIONS else worker
+                for attempt in range(SERIALIZATION_RETRIES + 1):
+                    source.last_error = None
+                    source.commit_in_flight = False
+                    source.last_write = None
+                    result = run_transaction(worker, multi_ops_instance, trx_type)
+                    error_kind = classify_error(source.last_error, source.commit_in_flight)
+                    if error_kind != SERIALIZATION or attempt == SERIALIZATION_RETRIES:
+                        break
+                    # 序列化失败/死锁的事务已回滚，立即重试；每次失败的尝试单独计数
+                    stats.count_error(SERIALIZATION)
+                trx_end = time.monotonic_ns()
+                ok = result is not False and error_kind is None
+                # 保存点嵌套事务按深度分别统计延迟
+                stats_type = trx_type
+                if trx_type == 'nested_savepoint_multi_table':
+                    stats_type = f"{trx_type}_d{multi_ops_instance.last_nested_depth}"
+                if schedule is not None:
+                    # 延迟从预定开始时间算起：数据库卡顿导致的排队时间也计入，避免协调遗漏
+                    stats.record(stats_type, trx_end - int(intended_start * 1e9), ok=ok,
+                                 service_ns=trx_end - trx_start, error_kind=error_kind)
+                else:
+                    stats.record(stats_type, trx_end - trx_start, ok=ok, error_kind=error_kind)
+                stats.stop()
+                if ledger is not None and source.last_write is not None:
+                    ledger.append(outcome_for(error_kind), *source.last_write, trx_start, trx_end)
+                _record_unledgered_writes(ledger, multi_ops_instance, trx_start, trx_end)
+
+                # 与原来一样每个事务计数一次，不论结果；transactions 触发和客户端 TPS 都按执行的事务数
+                transaction_counter.add(worker_id)
+                if error_kind in (CONNECTION_LOST, IN_DOUBT):
+                    if not reconnect_worker(conn, backoff, worker_id):
+                        print(f"工作器 {worker_id}: 超过最长重连时间，停止。")
+                        break
+                    continue
+                if schedule is None and THINK_TIME > 0:
+                    time.sleep(THINK_TIME)
+            print(f"工作器 {worker_id} 完成.")
+            return stats
+    except Exception as e:
+        print(f"工作器 {worker_id} 遇到错误: {e}")
+        return stats
+    finally:
+        if ledger is not None:
+            ledger.close()
+        stats.merge(db_pool.drain_connection_stats())
+        log_sink.flush()
 
 def start_database(pg_data_dir):
+    import subprocess
     try:
-        import subprocess
-        command = ["su", "-", "postgres", "-c", f"pg_ctl start -D {pg_data_dir}"]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        result = get_backend().start(pg_data_dir)
         print(f"Database started successfully: {result.stdout}")
         if result.stderr:
             print(f"stderr: {result.stderr}")
@@ -162,293 +325,122 @@ def start_database(pg_data_dir):
         print("Error: 'su' or 'pg_ctl' command not found. Please ensure they are in the system's PATH.")
         return False
 
-def check_database_connection(host, database, user, password, port, timeout=60):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            conn = psycopg2.connect(
-                host=host,
-                database=database,
-                user=user,
-                password=password,
-                port=port,
-                connect_timeout=20
-            )
-            conn.close()
-            print("数据库连接成功！")
-            return True
-        except psycopg2.OperationalError:
-            print("等待数据库启动...", end='\r')
-            time.sleep(1)
-        except Exception as e:
-            print(f"检查数据库连接时发生意外错误: {e}")
-            time.sleep(1)
-    print("数据库连接超时。")
-    return False
-
 def run_fault_mode(db_config, pg_data_dir, fault_mode, k_workers, num_transactions_per_worker,
                    first_injection_transactions, second_injection_transactions, transaction_ratios):
 
-    DB_HOST = db_config['host']
-    DB_NAME = db_config['database']
-    DB_USER = db_config['user']
-    DB_PASSWORD = db_config['password']
-    DB_PORT = db_config['port']
-
     total_experiment_start_time = time.time() # 记录整个实验的开始时间
 
-    transaction_counter = Value('i', 0)
+    transaction_counter = TransactionCounter(k_workers)
     stop_logging_event = Event()
 
-    log_process = Process(target=log_database_counts, args=(DB_CONFIG, stop_logging_event))
-    log_process.start()
-
     multi_ops_instance = MultiTableOperations()
+    # 父进程不持有连接再 fork 监控、心跳和工作进程（调用方可能刚用过连接池），恢复后的验证查询也会重新建立连接。
+    # sqlite 连接被子进程继承后与父进程共用文件锁状态，会损坏数据库文件
+    db_pool.close_pool()
 
-    # Initialize recovery_time to None, will be updated in each fault mode branch
-    recovery_time = None
-    recovery_time_1 = None
-    recovery_time_2 = None
-
-    if fault_mode == 'single_injection':
-        print(f"当前运行在单次故障注入模式。将在执行 {first_injection_transactions} 个事务后注入故障。")
-
-        monitor_process = Process(target=monitor_and_inject_fault_by_transaction_count,
-                                  args=(transaction_counter, first_injection_transactions, pg_data_dir))
-        monitor_process.start()
-
-        worker_func_with_args = partial(worker_function,
-                                        num_transactions=num_transactions_per_worker,
-                                        transaction_ratios=transaction_ratios,
-                                        transaction_counter=transaction_counter,
-                                        multi_ops_instance=multi_ops_instance,
-                                        pg_data_dir=pg_data_dir)
-
-        pool = Pool(k_workers)
-        async_results = [pool.apply_async(worker_func_with_args, (i,)) for i in range(k_workers)]
-
-        monitor_process.join()
-        print("故障注入完成。")
-
-        stop_logging_event.set()
-        log_process.join()
-
-        recovery_start_time = time.time()
-        print("数据库已关闭，等待数据库恢复...")
-        if not start_database(pg_data_dir):
-            print("未能自动启动数据库，请手动启动并重试。")
-            sys.exit(1)
-        if check_database_connection(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT):
-            recovery_end_time = time.time()
-            recovery_time = recovery_end_time - recovery_start_time
-            print(f"数据库已恢复并可连接，恢复时间: {recovery_time:.2f} 秒。")
-            print("验证第一次恢复后的数据一致性...")
-            try:
-                with DBConn() as conn:
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"User\";")
-                    post_recovery_user_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的User数量: {post_recovery_user_count}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"Order\";")
-                    post_recovery_order_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的Order数量: {post_recovery_order_count}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"OrderItem\";")
-                    post_recovery_order_item_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的OrderItem数量: {post_recovery_order_item_count}.")
-            except Exception as e:
-                print(f"数据一致性验证失败: {e}")
-        else:
-            print("数据库在第一次注入后未能恢复并连接。")
-
-        pool.close()
-        pool.join()
-        print("\n所有并发事务已完成,单次注入模式。")
-
-    elif fault_mode == 'two_phase_injection':
-        print(f"当前运行在双阶段故障注入模式。")
-        print(f"阶段 1: 故障将在执行 {FIRST_INJECTION_TIME} 秒后注入。")
-
-        # First phase workers
-        worker_func_with_args_1 = partial(worker_function,
-                                        num_transactions=num_transactions_per_worker, # Workers will run for a set number of transactions
-                                        transaction_ratios=transaction_ratios,
-                                        transaction_counter=transaction_counter,
-                                        multi_ops_instance=multi_ops_instance,
-                                        pg_data_dir=pg_data_dir)
-
-        pool_1 = Pool(k_workers)
-        async_results_1 = [pool_1.apply_async(worker_func_with_args_1, (i,)) for i in range(k_workers)]
-
-        # Monitor for first fault injection based on time
-        monitor_process_1 = Process(target=monitor_and_inject_fault_by_time,
-                                    args=(FIRST_INJECTION_TIME, pg_data_dir))
-        monitor_process_1.start()
-        monitor_process_1.join()
-        print("阶段1:故障注入完成。")
-
-        # Stop workers after first injection (optional, depends on desired behavior)
-        pool_1.close()
-        pool_1.join()
-
-
-        recovery_start_time_1 = time.time()
-        if not start_database(pg_data_dir):
-            print("阶段 1: 未能自动启动数据库，请手动启动并重试。")
-            sys.exit(1)
-        if check_database_connection(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT):
-            recovery_end_time_1 = time.time()
-            recovery_time_1 = recovery_end_time_1 - recovery_start_time_1
-            print(f"阶段 1: 数据库已恢复并可连接，恢复时间: {recovery_time_1:.2f} 秒。")
-        else:
-            print("阶段 1: 数据库在第一次注入后未能恢复并连接。")
-            sys.exit(1)
-
-
-        print(f"\n阶段 2: 开始新的事务。故障将在执行 {SECOND_INJECTION_TIME} 秒后注入。")
-
-        # Second phase workers (reset transaction_counter for logging, though injection is time-based)
-        transaction_counter.value = 0 # Reset counter for the second phase's transaction logging
-        num_transactions_per_worker_phase2 = num_transactions_per_worker # Or adjust if needed for phase 2
-        worker_func_with_args_2 = partial(worker_function,
-                                        num_transactions=num_transactions_per_worker_phase2,
-                                        transaction_ratios=transaction_ratios,
-                                        transaction_counter=transaction_counter,
-                                        multi_ops_instance=multi_ops_instance,
-                                        pg_data_dir=pg_data_dir)
-
-        pool_2 = Pool(k_workers)
-        async_results_2 = [pool_2.apply_async(worker_func_with_args_2, (i,)) for i in range(k_workers)]
-
-        # Monitor for second fault injection based on time
-        monitor_process_2 = Process(target=monitor_and_inject_fault_by_time,
-                                    args=(SECOND_INJECTION_TIME, pg_data_dir))
-        monitor_process_2.start()
-        monitor_process_2.join()
-        print("阶段 2: 第二次故障注入完成。")
-
-        # Stop workers after second injection
-        pool_2.close()
-        pool_2.join()
-
-        recovery_start_time_2 = time.time()
-        if not start_database(pg_data_dir):
-            print("阶段 2: 未能自动启动数据库，请手动启动并重试。")
-            sys.exit(1)
-        if check_database_connection(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT):
-            recovery_end_time_2 = time.time()
-            recovery_time_2 = recovery_end_time_2 - recovery_start_time_2
-            print(f"阶段 2: 数据库已恢复并可连接，恢复时间: {recovery_time_2:.2f} 秒。")
-            print("阶段 2: 验证第二次恢复后的数据一致性...")
-            try:
-                with DBConn() as conn:
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"User\";")
-                    post_recovery_user_count_2 = conn.cursor.fetchone()[0]
-                    print(f"阶段 2: 恢复后的 User计数: {post_recovery_user_count_2}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"Order\";")
-                    post_recovery_order_count_2 = conn.cursor.fetchone()[0]
-                    print(f"阶段 2: 恢复后的 Order 计数: {post_recovery_order_count_2}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"OrderItem\";")
-                    post_recovery_order_item_count_2 = conn.cursor.fetchone()[0]
-                    print(f"阶段 2: 恢复后的 OrderItem 计数: {post_recovery_order_item_count_2}.")
-            except Exception as e:
-                print(f"阶段 2: 数据一致性验证失败: {e}")
-        else:
-            print("阶段 2: 数据库未能恢复并连接。")
-            sys.exit(1)
-
-        print("\n所有并发事务已完成,适用于两阶段注入模式。")
-
-    elif fault_mode == 'none':
-        print(f"当前运行在无故障注入模式。所有事务将正常执行，不进行故障注入或数据库恢复。")
-
-        worker_func_with_args = partial(worker_function,
-                                        num_transactions=num_transactions_per_worker,
-                                        transaction_ratios=transaction_ratios,
-                                        transaction_counter=transaction_counter,
-                                        multi_ops_instance=multi_ops_instance,
-                                        pg_data_dir=pg_data_dir)
-
-        pool = Pool(k_workers)
-        async_results = [pool.apply_async(worker_func_with_args, (i,)) for i in range(k_workers)]
-
-        pool.close()
-        pool.join()
-        print("所有工作器进程已完成。")
-        recovery_time = 0.0 
-
-    elif fault_mode == 'long_fault':
-        print(f"运行在长事务故障注入模式。")
-
-        worker_func_with_args = partial(worker_function,
-                                        num_transactions=1,
-                                        transaction_ratios={},
-                                        transaction_counter=transaction_counter,
-                                        multi_ops_instance=multi_ops_instance,
-                                        pg_data_dir=pg_data_dir,
-                                        fault_mode_specific_injection=True,
-                                        fault_point='long_transaction_fault')
-
-        pool = Pool(k_workers)
-        async_results = [pool.apply_async(worker_func_with_args, (i,)) if i == 0 else
-                         pool.apply_async(worker_function, (i, num_transactions_per_worker, transaction_ratios, transaction_counter, multi_ops_instance, pg_data_dir, False, None))
-                         for i in range(k_workers)]
-
-        pool.close()
-        pool.join()
-        print("所有工作器进程已完成或退出。")
-
-        print("尝试在长事务故障注入后重新启动数据库...")
-        recovery_start_time = time.time()
-        if not start_database(pg_data_dir):
-            print("未能自动启动数据库，请手动启动并重试。")
-            sys.exit(1)
-        if check_database_connection(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT):
-            recovery_end_time = time.time()
-            recovery_time = recovery_end_time - recovery_start_time
-            print(f"数据库已恢复并可连接，恢复时间: {recovery_time:.2f} 秒。")
-            print("验证长事务故障注入后的数据一致性...")
-            try:
-                with DBConn() as conn:
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"User\";")
-                    post_recovery_user_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的 User 计数: {post_recovery_user_count}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"Order\";")
-                    post_recovery_order_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的 Order 计数: {post_recovery_order_count}.")
-                    conn.cursor.execute("SELECT COUNT(*) FROM \"OrderItem\";")
-                    post_recovery_order_item_count = conn.cursor.fetchone()[0]
-                    print(f"恢复后的 OrderItem 计数: {post_recovery_order_item_count}.")
-
-                    conn.cursor.execute("SELECT id, price FROM \"Product\" ORDER BY id LIMIT 1;")
-                    affected_product = conn.cursor.fetchone()
-                    if affected_product:
-                        product_id = affected_product[0]
-                        price_after_recovery = affected_product[1]
-                        print(f"恢复后产品 ID {product_id} 的价格: {price_after_recovery}.")
-                    else:
-                        print("未能获取任何产品价格进行验证。")
+    log_process = Process(target=monitor_throughput, args=(DB_CONFIG, stop_logging_event, transaction_counter))
+    log_process.start()
 
-            except Exception as e:
-                print(f"数据一致性验证失败: {e}")
-        else:
-            print("数据库未能恢复并连接。")
+    # kill 时间和心跳中断区间通过队列交给父进程，组成每次注入的恢复时间线
+    fault_queue = Queue()
+    track_fault_times(fault_queue)
+    if LEDGER_ENABLED:
+        clear_ledgers()
+    outage_queue = Queue()
+    heartbeat_process = None
+    if HEARTBEAT_ENABLED:
+        heartbeat_process = Process(target=heartbeat_writer, args=(DB_CONFIG, stop_logging_event, outage_queue),
+                                    daemon=True)
+        heartbeat_process.start()
+
+    # 阶段边界的 WAL 采样：运行开始、每次 kill 前（随时间线返回）、恢复后、运行结束
+    wal_phases = WalPhaseLog()
+    if WAL_STATS_ENABLED:
+        wal_phases.mark("运行开始", db_config)
+
+    # 故障注入由故障计划描述，协调器在父进程中按步骤执行，工作器在整个运行期间持续执行负载
+    schedule = FAULT_SCHEDULE if FAULT_SCHEDULE is not None else schedule_for_mode(fault_mode, first_injection_transactions)
+    validate_schedule(schedule)
+    if FAULT_SCHEDULE is not None:
+        print(f"按 FAULT_SCHEDULE 执行 {len(schedule)} 步故障计划，重复 {FAULT_SCHEDULE_REPEAT} 次。")
+    else:
+        print(f"当前运行在 {fault_mode} 模式，{len(schedule)} 步故障计划，重复 {FAULT_SCHEDULE_REPEAT} 次。")
+        if fault_mode == 'two_phase_injection':
+            # 原来两个阶段各启动一轮工作器，现在负载不间断，事务数合并
+            num_transactions_per_worker *= 2
+    if any(step.get('trigger', (None, None))[1] == 'long_transaction_fault' for step in schedule):
+        if not 1 <= LONG_CONCURRENT_TRANSACTIONS <= k_workers:
+            print(f"LONG_CONCURRENT_TRANSACTIONS 必须在 1 到 {k_workers} 之间。")
             sys.exit(1)
+        if LONG_CONCURRENT_TRANSACTIONS > 1:
+            print(f"同时运行 {LONG_CONCURRENT_TRANSACTIONS} 个长事务，其中一个注入故障。")
+    until_done = FAULT_SCHEDULE_UNTIL_DONE and bool(schedule)
+    if until_done and EXECUTOR == 'asyncio' and get_backend().name == 'postgresql':
+        print("asyncio 执行引擎不支持运行到故障计划结束，按 NUM_TRANSACTIONS_PER_WORKER 执行。")
+        until_done = False
+
+    worker_num_transactions = None if until_done else num_transactions_per_worker
+    order_registry = create_order_registry(multi_ops_instance.existing_order_codes, k_workers, worker_num_transactions)
+
+    control = WorkloadControl()
+    worker_func_with_args = partial(worker_function,
+                                    num_transactions=worker_num_transactions,
+                                    transaction_ratios=transaction_ratios,
+                                    multi_ops_instance=multi_ops_instance,
+                                    pg_data_dir=pg_data_dir)
+
+    pool, async_results = start_workers(worker_func_with_args, k_workers, transaction_counter, order_registry, control)
+
+    coordinator = FaultCoordinator(db_config, pg_data_dir, transaction_counter, fault_queue, outage_queue, control,
+                                   start_database, lambda label: verify_after_recovery(label, transaction_ratios),
+                                   lambda: all(r.ready() for r in async_results))
+    recovery_timelines = coordinator.run(schedule, FAULT_SCHEDULE_REPEAT)
+    if until_done:
+        control.stop()
+
+    pool.close()
+    pool.join()
+    worker_stats = collect_worker_stats(async_results)
+    print("所有工作器进程已完成。")
 
     stop_logging_event.set()
     log_process.join()
+    if heartbeat_process is not None:
+        heartbeat_process.join()
 
     total_experiment_end_time = time.time() # 记录整个实验的结束时间
     total_task_time = total_experiment_end_time - total_experiment_start_time
 
-    # Print recovery times based on fault mode
-    if fault_mode == 'two_phase_injection':
-        if recovery_time_1 is not None:
-            print(f"\n数据库第一次恢复服务时间: {recovery_time_1:.2f} 秒。")
-        if recovery_time_2 is not None:
-            print(f"数据库第二次恢复服务时间: {recovery_time_2:.2f} 秒。")
-    elif recovery_time is not None:
-        print(f"\n数据库恢复服务时间: {recovery_time:.2f} 秒。")
-    else:
-        print("\n未记录到数据库恢复服务时间（可能没有发生故障注入或恢复）。")
+    for timeline in recovery_timelines:
+        if timeline.recovery_time is not None:
+            print(f"\n数据库恢复服务时间 [{timeline.label}]: {timeline.recovery_time:.3f} 秒。")
+    if not recovery_timelines:
+        print("\n未记录到数据库恢复服务时间（没有发生故障注入或恢复）。")
+
+    all_stats = merge_stats(worker_stats)
+    if LEDGER_ENABLED and not get_backend().supports_snapshots:
+        print(f"{get_backend().name} 后端不支持提交账本对账，账本保留在磁盘上。")
+    elif LEDGER_ENABLED:
+        try:
+            print_reconciliation(reconcile())
+        except Exception as e:
+            print(f"提交账本对账失败: {e}")
+    for timeline in recovery_timelines:
+        timeline.measure_throughput_recovery(all_stats)
+        timeline.print_report()
+
+    if WAL_STATS_ENABLED:
+        for timeline in recovery_timelines:
+            wal_phases.add(f"{timeline.label} kill 前", timeline.wal_at_kill)
+            wal_phases.add(f"{timeline.label} 恢复后", timeline.wal_after_recovery)
+        wal_phases.mark("运行结束", db_config)
+        wal_phases.print_report()
+        recorded = [record_recovery(timeline) for timeline in recovery_timelines]
+        if any(recorded):
+            print_recovery_model()
+
+    print_latency_report(all_stats)
 
     print(f"数据库完成所有任务的总时间: {total_task_time:.2f} 秒。")
-    print("实验结束。")
\ No newline at end of file
+    print("实验结束。")
+    return {'stats': all_stats, 'timelines': recovery_timelines, 'total_time': total_task_time}
\ No newline at end of file
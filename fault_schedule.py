@@ -0,0 +1,468 @@
+import queue
+import threading
+import time
+from multiprocessing import Value, Lock, Event, RawArray, RawValue
+
+from backends import get_backend
+from fault_injector import inject_fault
+from recovery import measure_recovery
+from wal_stats import MB, WalSampler
+from settings import (
+    FIRST_INJECTION_TIME,
+    SECOND_INJECTION_TIME,
+    FAULT_TRIGGER,
+    LONG_CONCURRENT_TRANSACTIONS,
+    CHECKPOINT_TRIGGER_WAL_MB,
+    CHECKPOINT_FORCE,
+    CHECKPOINT_FORCE_DELAY,
+    CHECKPOINT_POLL_INTERVAL,
+    CHECKPOINT_TRIGGER_TIMEOUT,
+    FAULT_SCHEDULE_POLL_INTERVAL,
+    FAULT_STEP_TIMEOUT,
+    EXECUTOR,
+    WAL_STATS_ENABLED
+)
+
+# 故障计划：一次运行描述为按顺序执行的步骤列表，由父进程中的一个协调器在持续运行的负载上执行。
+# 每个步骤是一个字典：
+#   'trigger'  (类型, 参数)，省略时为 ('immediately', None)，从上一步完成时开始计：
+#       ('transactions', N)            工作器再执行 N 个事务（不论提交还是失败）
+#       ('time', 秒)                   再经过若干秒
+#       ('wal_since_checkpoint', MB)   距上次检查点的 WAL 达到 MB（以及 'after_checkpoint'/'before_checkpoint'，见 FAULT_TRIGGER）
+#       ('step', 注入点)               由一个工作器执行 FAULT_POINTS 中的事务，在事务的该步骤 kill；动作必须是 'kill'
+#   'action'   'kill' 注入故障；'restart' 启动数据库、记录恢复时间线并检查一致性；'pause' 暂停负载 'seconds' 秒
+#   'label'    可选，恢复时间线的名称
+# 例如每 3000 个事务崩溃一次、重复 10 次：
+#   FAULT_SCHEDULE = [{'trigger': ('transactions', 3000), 'action': 'kill'}, {'action': 'restart'}]
+#   FAULT_SCHEDULE_REPEAT = 10
+
+TRIGGERS = ('immediately', 'transactions', 'time', 'wal_since_checkpoint', 'after_checkpoint', 'before_checkpoint', 'step')
+CHECKPOINT_TRIGGERS = ('wal_since_checkpoint', 'after_checkpoint', 'before_checkpoint')
+ACTIONS = ('kill', 'restart', 'pause')
+
+# 事务步骤注入点，编号用于在共享内存中传递
+FAULT_POINTS = ('delete_product_after_step2', 'modify_price_after_order_item_update', 'long_transaction_fault')
+
+
+def validate_schedule(schedule):
+    # asyncio 执行器（只在 PostgreSQL 上启用）的客户端不检查故障钩子和暂停，无法执行事务步骤触发和 pause
+    asyncio_executor = EXECUTOR == 'asyncio' and get_backend().name == 'postgresql'
+    for i, step in enumerate(schedule):
+        kind = step.get('trigger', ('immediately', None))[0]
+        if kind not in TRIGGERS:
+            raise ValueError(f"故障计划第 {i + 1} 步: 未知的触发条件 {kind}")
+        if step.get('action') not in ACTIONS:
+            raise ValueError(f"故障计划第 {i + 1} 步: 未知的动作 {step.get('action')}")
+        if kind == 'step':
+            if step['action'] != 'kill':
+                raise ValueError(f"故障计划第 {i + 1} 步: 事务步骤触发只能用于 kill")
+            if step['trigger'][1] not in FAULT_POINTS:
+                raise ValueError(f"故障计划第 {i + 1} 步: 未知的注入点 {step['trigger'][1]}")
+        if asyncio_executor and (kind == 'step' or step['action'] == 'pause'):
+            raise ValueError(f"故障计划第 {i + 1} 步: asyncio 执行器不支持事务步骤触发和 pause，请改用 EXECUTOR = 'process_pool'")
+        if kind in CHECKPOINT_TRIGGERS and not get_backend().supports_checkpoint_triggers:
+            raise ValueError(f"故障计划第 {i + 1} 步: {get_backend().name} 后端不支持检查点触发 {kind}")
+
+
+def _kill_trigger(default):
+    # FAULT_TRIGGER 为检查点触发时替代原有的事务数/时间触发
+    if FAULT_TRIGGER == 'default':
+        return default
+    if FAULT_TRIGGER not in CHECKPOINT_TRIGGERS:
+        print(f"未知的故障触发方式 {FAULT_TRIGGER}，使用原有触发方式。")
+        return default
+    if not get_backend().supports_checkpoint_triggers:
+        print(f"{get_backend().name} 后端不支持检查点触发，使用原有触发方式。")
+        return default
+    return (FAULT_TRIGGER, CHECKPOINT_TRIGGER_WAL_MB)
+
+
+def schedule_for_mode(fault_mode, first_injection_transactions):
+    # 由 FAULT_MODE 生成与原来各模式相同的计划
+    if fault_mode == 'single_injection':
+        return [{'trigger': _kill_trigger(('transactions', first_injection_transactions)), 'action': 'kill'},
+                {'action': 'restart', 'label': "单次注入"}]
+    if fault_mode == 'two_phase_injection':
+        return [{'trigger': _kill_trigger(('time', FIRST_INJECTION_TIME)), 'action': 'kill'},
+                {'action': 'restart', 'label': "阶段 1"},
+                {'trigger': _kill_trigger(('time', SECOND_INJECTION_TIME)), 'action': 'kill'},
+                {'action': 'restart', 'label': "阶段 2"}]
+    if fault_mode == 'multi_table_delete_fault_injection':
+        return [{'trigger': ('step', 'delete_product_after_step2'), 'action': 'kill'},
+                {'action': 'restart', 'label': "多表删除故障"}]
+    if fault_mode == 'multi_table_price_fault_injection':
+        return [{'trigger': ('step', 'modify_price_after_order_item_update'), 'action': 'kill'},
+                {'action': 'restart', 'label': "多表改价故障"}]
+    if fault_mode == 'long_fault':
+        return [{'trigger': ('step', 'long_transaction_fault'), 'action': 'kill'},
+                {'action': 'restart', 'label': "长事务故障"}]
+    if fault_mode == 'none':
+        return []
+    raise ValueError(f"未知的故障模式: {fault_mode}")
+
+
+class TransactionCounter:
+    # 按工作器分片的事务计数（每个执行完的事务计一次，不论结果）。每个分片只有一个写入者（进程池工作器或事件循环进程），递增不需要加锁；
+    # 读总数时把各分片相加，读到的是某一时刻附近的近似值，供吞吐量时间线使用。
+    # 协调器用 arm() 设定目标总数后，工作器每次递增时检查总数，越过目标的工作器直接 set 事件唤醒协调器，
+    # 未设定目标时工作器只做一次不加锁的读。
+    def __init__(self, shards):
+        self.counts = RawArray('q', max(1, shards))
+        self.target = RawValue('q', 0)
+        self.reached = Event()
+
+    @property
+    def value(self):
+        return sum(self.counts)
+
+    def add(self, shard):
+        self.counts[shard] += 1
+        target = self.target.value
+        if target and sum(self.counts) >= target:
+            self.target.value = 0
+            self.reached.set()
+
+    def arm(self, count):
+        self.reached.clear()
+        target = self.value + count
+        self.target.value = target
+        # 设定目标前已经越过的情况由协调器自己检查
+        if self.value >= target:
+            self.target.value = 0
+            self.reached.set()
+        return target
+
+    def disarm(self):
+        self.target.value = 0
+
+
+class FaultHook:
+    # 协调器通过共享内存请求工作器在事务步骤注入故障。工作器每个事务前不加锁读一次 code，
+    # 只有请求存在时才加锁认领；slots 个工作器各认领一次，slot 0 负责注入（并发长事务用到多个 slot）。
+    # injector 记录 slot 0 事务的进展：认领后为 CLAIMED，到达注入点为 REACHED，在注入点之前结束时回到 IDLE
+    IDLE, CLAIMED, REACHED = 0, 1, 2
+
+    def __init__(self):
+        self.code = Value('i', 0, lock=False)
+        self.slots = Value('i', 0, lock=False)
+        self.taken = Value('i', 0, lock=False)
+        self.active = Value('i', 0, lock=False)
+        self.injector = Value('i', self.IDLE, lock=False)
+        self.lock = Lock()
+
+    def request(self, fault_point, slots=1):
+        with self.lock:
+            self.active.value = 1
+            self.slots.value = slots
+            self.taken.value = 0
+            self.injector.value = self.IDLE
+            self.code.value = FAULT_POINTS.index(fault_point) + 1
+
+    def claim(self):
+        # 返回 (注入点, slot) 或 None
+        if not self.code.value:
+            return None
+        with self.lock:
+            code = self.code.value
+            if not code:
+                return None
+            slot = self.taken.value
+            self.taken.value += 1
+            if slot == 0:
+                self.injector.value = self.CLAIMED
+            if self.taken.value >= self.slots.value:
+                self.code.value = 0
+            return FAULT_POINTS[code - 1], slot
+
+    def release(self, fault_point, reached):
+        # slot 0 的事务结束时调用。在到达注入点之前结束（例如没有可用商品或事务失败）时重新发出请求，
+        # 由下一个工作器重试
+        with self.lock:
+            if reached:
+                self.injector.value = self.REACHED
+                return
+            self.injector.value = self.IDLE
+            if self.active.value:
+                self.slots.value = 1
+                self.taken.value = 0
+                self.code.value = FAULT_POINTS.index(fault_point) + 1
+
+    def cancel(self):
+        with self.lock:
+            self.active.value = 0
+            self.code.value = 0
+
+
+class WorkloadControl:
+    # 协调器与工作器共享的控制对象：事务步骤注入请求、暂停和停止。工作器每个事务前不加锁读一次 state
+    RUNNING, PAUSED, STOPPED = 0, 1, 2
+
+    def __init__(self):
+        self.fault_hook = FaultHook()
+        self.state = Value('i', self.RUNNING, lock=False)
+        self.resumed = Event()
+        self.resumed.set()
+
+    def pause(self):
+        self.resumed.clear()
+        self.state.value = self.PAUSED
+
+    def resume(self):
+        self.state.value = self.RUNNING
+        self.resumed.set()
+
+    def stop(self):
+        self.state.value = self.STOPPED
+        self.resumed.set()
+
+    def wait_if_paused(self):
+        # 暂停时阻塞到恢复；返回 False 表示工作器应停止
+        if self.state.value == self.PAUSED:
+            self.resumed.wait()
+        return self.state.value != self.STOPPED
+
+
+def _run_checkpoint():
+    # CHECKPOINT 阻塞到检查点完成，before_checkpoint 在单独的连接上执行，监控连接观察它完成之前的状态
+    backend = get_backend()
+    try:
+        conn = backend.connect(autocommit=True)
+        try:
+            backend.checkpoint(conn.cursor())
+        finally:
+            conn.close()
+    except backend.Error as e:
+        print(f"CHECKPOINT 未完成: {e}")
+
+
+def wait_for_checkpoint_trigger(trigger, wal_mb=CHECKPOINT_TRIGGER_WAL_MB, force=CHECKPOINT_FORCE,
+                                force_delay=CHECKPOINT_FORCE_DELAY, poll_interval=CHECKPOINT_POLL_INTERVAL,
+                                timeout=CHECKPOINT_TRIGGER_TIMEOUT, workload_done=None):
+    # 按 pg_control_checkpoint() 的 redo 位置和 WAL 插入位置等待 kill 时机，使每次故障需要重放的 WAL 量可控。
+    # 条件满足返回 True；超时、负载结束或监控失败返回 False
+    backend = get_backend()
+    if not backend.supports_checkpoint_triggers:
+        print(f"{backend.name} 后端不支持检查点触发。")
+        return False
+    conn = None
+    fired = False
+    try:
+        conn = backend.connect(autocommit=True)
+        cur = conn.cursor()
+        if force:
+            time.sleep(force_delay)
+        start = backend.wal_status(cur)
+        if force:
+            if trigger == 'before_checkpoint':
+                print("在另一个连接上执行 CHECKPOINT...")
+                threading.Thread(target=_run_checkpoint, daemon=True).start()
+            else:
+                print("执行 CHECKPOINT...")
+                backend.checkpoint(cur)
+        fired = force and trigger == 'after_checkpoint'
+        deadline = time.monotonic() + timeout
+        while not fired and time.monotonic() < deadline:
+            status = backend.wal_status(cur)
+            if trigger == 'wal_since_checkpoint':
+                fired = status['lsn'] - status['redo_lsn'] >= wal_mb * MB
+            elif trigger == 'after_checkpoint':
+                fired = status['redo_lsn'] != start['redo_lsn']
+            elif status['redo_lsn'] != start['redo_lsn']:
+                # 轮询间隔内检查点已经完成，此次 kill 实际发生在检查点之后
+                print("检查点在检测到之前已经完成。")
+                fired = True
+            else:
+                fired = backend.checkpoint_in_progress(cur)
+            if not fired:
+                if workload_done is not None and workload_done():
+                    break
+                time.sleep(poll_interval)
+    except backend.Error as e:
+        print(f"检查点监控失败: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+    return fired
+
+
+class FaultCoordinator:
+    # start_database(pg_data_dir) 启动数据库，verify(label) 在恢复后检查一致性，workload_done() 表示工作器已全部结束
+    def __init__(self, db_config, pg_data_dir, transaction_counter, fault_queue, outage_queue, control,
+                 start_database, verify, workload_done, poll_interval=FAULT_SCHEDULE_POLL_INTERVAL):
+        self.db_config = db_config
+        self.pg_data_dir = pg_data_dir
+        self.transaction_counter = transaction_counter
+        self.fault_queue = fault_queue
+        self.outage_queue = outage_queue
+        self.control = control
+        self.start_database = start_database
+        self.verify = verify
+        self.workload_done = workload_done
+        self.poll_interval = poll_interval
+        self.timelines = []
+        self.pending_fault = None  # 最近一次 kill 的 (时间, WAL 采样)，等待 restart
+        self.kills = 0
+        # kill 前的 WAL 采样在预先建立的连接上进行；工作器在事务步骤 kill 时没有采样，
+        # 用等待期间每个轮询间隔刷新的 last_wal 代替（早于 kill 不超过一个轮询间隔）
+        self.wal_sampler = WalSampler(db_config) if WAL_STATS_ENABLED else None
+        self.last_wal = None
+
+    def _sample_wal(self):
+        if self.wal_sampler is not None:
+            self.last_wal = self.wal_sampler.sample()
+        return self.last_wal
+
+    def _wait_transactions(self, count):
+        # 越过目标的工作器 set 事件，协调器被唤醒后立即执行动作；超时只用来检查负载是否已经结束
+        self.transaction_counter.arm(count)
+        try:
+            while not self.transaction_counter.reached.wait(self.poll_interval):
+                if self.workload_done():
+                    return False
+            return True
+        finally:
+            self.transaction_counter.disarm()
+
+    def _wait_time(self, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if self.workload_done():
+                return False
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+        return True
+
+    def _wait_trigger(self, trigger):
+        kind, value = trigger
+        if kind in ('immediately', 'step'):
+            # 事务步骤触发由执行 kill 的工作器决定时机
+            return True
+        if kind == 'transactions':
+            print(f"等待 {value} 个事务...")
+            return self._wait_transactions(value)
+        if kind == 'time':
+            print(f"等待 {value} 秒...")
+            return self._wait_time(value)
+        print(f"等待检查点触发条件 {kind}" + (f" {value} MB" if kind == 'wal_since_checkpoint' else "") + "...")
+        fired = wait_for_checkpoint_trigger(kind, value if value is not None else CHECKPOINT_TRIGGER_WAL_MB,
+                                            workload_done=self.workload_done)
+        if not fired and not self.workload_done():
+            print(f"未满足触发条件 {kind}（超时或监控失败），直接执行下一步。")
+            return True
+        return fired
+
+    def _await_fault(self, timeout, sample_wal=False):
+        # 等待注入方报告 kill；返回 (kill 时间, WAL 采样) 或 None。sample_wal 时每个轮询间隔刷新一次 WAL 采样，
+        # 注入方没有附带采样时用最近一次采样
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                kill_time, wal = self.fault_queue.get(timeout=self.poll_interval)
+                return kill_time, wal if wal is not None else self.last_wal
+            except queue.Empty:
+                if self.workload_done():
+                    return None
+                if sample_wal:
+                    self._sample_wal()
+        return None
+
+    def _await_claimed_fault(self):
+        # 取消请求之前已被认领的事务仍可能到达注入点并 kill；不等它结束的话，计划停止后没有人重启数据库
+        hook = self.control.fault_hook
+        if hook.injector.value == hook.CLAIMED:
+            print("等待已认领的故障注入事务结束...")
+        while hook.injector.value == hook.CLAIMED and not self.workload_done():
+            self._sample_wal()
+            time.sleep(self.poll_interval)
+        if hook.injector.value == hook.IDLE:
+            return None
+        return self._await_fault(FAULT_STEP_TIMEOUT)
+
+    def _kill(self, step):
+        kind, value = step.get('trigger', ('immediately', None))
+        if kind == 'step':
+            slots = LONG_CONCURRENT_TRANSACTIONS if value == 'long_transaction_fault' else 1
+            print(f"请求工作器在 {value} 注入故障...")
+            self._sample_wal()
+            self.control.fault_hook.request(value, slots)
+            fault = self._await_fault(FAULT_STEP_TIMEOUT, sample_wal=True)
+            self.control.fault_hook.cancel()
+            if fault is None:
+                fault = self._await_claimed_fault()
+            if fault is None:
+                print(f"{FAULT_STEP_TIMEOUT} 秒内没有工作器在 {value} 注入故障。")
+                return False
+        else:
+            inject_fault(self.pg_data_dir, wal=self._sample_wal())
+            fault = self._await_fault(FAULT_STEP_TIMEOUT) or (time.time(), self.last_wal)
+        self.pending_fault = fault
+        self.kills += 1
+        print(f"第 {self.kills} 次故障注入完成。")
+        return True
+
+    def _restart(self, step):
+        label = step.get('label') or f"故障 {self.kills}"
+        if self.pending_fault is None:
+            print(f"{label}: 没有待恢复的故障，跳过重启。")
+            return True
+        print(f"{label}: 数据库已关闭，等待数据库恢复...")
+        timeline = measure_recovery(label, self.db_config, self.pg_data_dir, self.start_database,
+                                    outage_queue=self.outage_queue, fault=self.pending_fault)
+        self.pending_fault = None
+        self.timelines.append(timeline)
+        if not timeline.started:
+            print(f"{label}: 未能自动启动数据库，请手动启动并重试。")
+            return False
+        if not timeline.recovered:
+            print(f"{label}: 数据库未能恢复并连接。")
+            return False
+        print(f"{label}: 数据库已恢复并可连接，恢复时间: {timeline.recovery_time:.3f} 秒。")
+        timeline.violations = self.verify(label)
+        # 重启后采样连接已经失效，在 kill 路径之外重新建立
+        self._sample_wal()
+        return True
+
+    def _pause(self, step):
+        seconds = step.get('seconds', 0)
+        print(f"暂停负载 {seconds} 秒...")
+        self.control.pause()
+        try:
+            time.sleep(seconds)
+        finally:
+            self.control.resume()
+        return True
+
+    def run(self, schedule, repeat=1):
+        # 依次执行计划中的步骤，整个计划重复 repeat 次；负载提前结束或重启失败时停止。返回恢复时间线列表
+        validate_schedule(schedule)
+        actions = {'kill': self._kill, 'restart': self._restart, 'pause': self._pause}
+        stopped = False
+        # 预先建立 WAL 采样连接，第一次 kill 前不必再连接
+        self._sample_wal()
+        for round_index in range(repeat):
+            if repeat > 1:
+                print(f"\n--- 故障计划第 {round_index + 1}/{repeat} 轮 ---")
+            for step in schedule:
+                if not self._wait_trigger(step.get('trigger', ('immediately', None))):
+                    print("负载已结束或触发条件未满足，故障计划停止。")
+                    stopped = True
+                    break
+                if not actions[step['action']](step):
+                    print("故障计划停止。")
+                    stopped = True
+                    break
+            if stopped:
+                break
+        if self.pending_fault is None:
+            # 负载结束时协调器不再等待注入方，事务步骤触发的 kill 可能在计划停止后才报告
+            try:
+                self.pending_fault = self.fault_queue.get(timeout=self.poll_interval)
+                self.kills += 1
+                print(f"计划停止后收到第 {self.kills} 次故障注入。")
+            except queue.Empty:
+                pass
+        if self.pending_fault is not None:
+            # 计划以 kill 结束时仍然启动数据库，工作器才能完成并返回统计
+            self._restart({'label': f"故障 {self.kills}"})
+        if self.wal_sampler is not None:
+            self.wal_sampler.close()
+        return self.timelines
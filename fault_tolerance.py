@@ -0,0 +1,54 @@
+import random
+
+from backends import get_backend
+from settings import (
+    RECONNECT_BASE_DELAY,
+    RECONNECT_MAX_DELAY,
+    RECONNECT_GIVE_UP_AFTER
+)
+
+# 工作器在故障期间的错误分类和重连退避。
+# connection_lost: 连接断开或服务端正在关闭/启动，事务一定没有提交，重连后继续
+# in_doubt: 提交（或自动提交的写语句）已发出但连接在返回结果前断开，无法确定是否已提交，单独统计
+# serialization: 序列化失败或死锁，事务已回滚，可以立即重试
+# other: 其他错误（约束冲突等），只计入失败
+CONNECTION_LOST = 'connection_lost'
+IN_DOUBT = 'in_doubt'
+SERIALIZATION = 'serialization'
+OTHER = 'other'
+
+
+def classify_error(error, commit_in_flight=False):
+    # 各后端的错误码不同，由 backends 判断属于哪一类
+    if error is None:
+        return None
+    backend = get_backend()
+    if backend.is_serialization_failure(error):
+        return SERIALIZATION
+    if backend.is_connection_error(error):
+        return IN_DOUBT if commit_in_flight else CONNECTION_LOST
+    return OTHER
+
+
+class Backoff:
+    # 有上限的指数退避 + 完全抖动：第 n 次等待 uniform(0, min(max_delay, base * 2^n)) 秒，
+    # 避免所有工作器在数据库刚恢复时同时重连。累计等待超过 give_up_after 后返回 None。
+    def __init__(self, base=RECONNECT_BASE_DELAY, max_delay=RECONNECT_MAX_DELAY,
+                 give_up_after=RECONNECT_GIVE_UP_AFTER, rng=None):
+        self.base = base
+        self.max_delay = max_delay
+        self.give_up_after = give_up_after
+        self.rng = rng or random.Random()
+        self.reset()
+
+    def reset(self):
+        self.attempt = 0
+        self.waited = 0.0
+
+    def next_delay(self):
+        if self.waited >= self.give_up_after:
+            return None
+        delay = self.rng.uniform(0, min(self.max_delay, self.base * (2 ** self.attempt)))
+        self.attempt = min(self.attempt + 1, 32)
+        self.waited += delay
+        return delay
@@ -0,0 +1,39 @@
+class IndexedSet:
+    # 稠密数组 + 位置映射：add、discard 和均匀随机选取都是 O(1)。
+    # 删除时把数组最后一个元素换到被删元素的位置（swap-remove），数组保持无空洞。
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self._positions:
+            return False
+        self._positions[item] = len(self._items)
+        self._items.append(item)
+        return True
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return False
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+        return True
+
+    def choice(self, rng):
+        if not self._items:
+            return None
+        return self._items[rng.randrange(len(self._items))]
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
@@ -0,0 +1,280 @@
+import argparse
+import glob
+import mmap
+import os
+import struct
+from decimal import Decimal
+
+import psycopg2
+
+from connection import DSN
+from settings import (
+    LEDGER_DIR,
+    LEDGER_INITIAL_RECORDS,
+    LEDGER_FLUSH_EVERY
+)
+
+# 客户端提交账本：每个工作器把收到结果的写事务追加到自己的二进制文件，崩溃恢复后与数据库对账。
+#
+# 文件格式：16 字节文件头（MAGIC + 工作器编号 + 记录长度），之后是定长 32 字节记录：
+#   outcome(B) trx(B) pad(2) seq(I) key(q) value(q) start_ns(q) ack_ns(q)
+# 其中 value 为金额（分），start_ns/ack_ns 为 time.monotonic_ns()（同一台机器上跨进程可比）。
+# outcome 从 1 开始，全零记录表示文件末尾，因此不需要单独维护记录数。
+# 写入只是一次 struct.pack_into 到 mmap 的内存拷贝，每 LEDGER_FLUSH_EVERY 条才 msync 一次。
+
+MAGIC = b'CLEDGER1'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<BBxxIqqqq')
+
+ACKNOWLEDGED = 1  # 客户端收到提交成功
+FAILED = 2        # 客户端收到明确的失败，事务一定未提交
+IN_DOUBT = 3      # 提交已发出但连接断开，结果未知
+OUTCOMES = {ACKNOWLEDGED: 'acknowledged', FAILED: 'failed', IN_DOUBT: 'in_doubt'}
+
+# 事务类型 -> (编号, 表, 写入后该键的状态是否存在)
+LEDGER_TRANSACTIONS = {
+    'insert': (1, 'Order', True),
+    'update': (2, 'Order', True),
+    'delete': (3, 'Order', False),
+    'modify_product_price_multi_table': (4, 'Product', True),
+    'delete_product_multi_table': (5, 'Product', False),
+    # 不写账本的事务改过该商品的价格 / 该订单的金额：结果和金额都不记录，对账时该键只确认存在
+    'unledgered_price_write': (6, 'Product', True),
+    'unledgered_payment_write': (7, 'Order', True),
+}
+UNLEDGERED_WRITES = ('unledgered_price_write', 'unledgered_payment_write')
+TRANSACTION_CODES = {code: (name, table, exists) for name, (code, table, exists) in LEDGER_TRANSACTIONS.items()}
+
+
+# 数据库状态为 ANY 表示只确认存在、不比较金额
+class _AnyValue:
+    def __repr__(self):
+        return 'ANY'
+
+ANY = _AnyValue()
+
+
+def outcome_for(error_kind):
+    # fault_tolerance.classify_error() 的结果 -> 账本记录的结果
+    if error_kind is None:
+        return ACKNOWLEDGED
+    return IN_DOUBT if error_kind == 'in_doubt' else FAILED
+
+
+def ledger_path(worker_id, ledger_dir=LEDGER_DIR):
+    return os.path.join(ledger_dir, f"ledger_{worker_id}.bin")
+
+
+def clear_ledgers(ledger_dir=LEDGER_DIR):
+    for path in glob.glob(os.path.join(ledger_dir, "ledger_*.bin")):
+        os.remove(path)
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+
+class CommitLedger:
+    def __init__(self, worker_id, ledger_dir=LEDGER_DIR, initial_records=LEDGER_INITIAL_RECORDS,
+                 flush_every=LEDGER_FLUSH_EVERY):
+        os.makedirs(ledger_dir, exist_ok=True)
+        self.path = ledger_path(worker_id, ledger_dir)
+        self.worker_id = worker_id
+        self.flush_every = flush_every
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) > HEADER.size
+        self._file = open(self.path, 'r+b' if exists else 'w+b')
+        if not exists:
+            self._file.truncate(HEADER.size + initial_records * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        if not exists:
+            HEADER.pack_into(self._map, 0, MAGIC, worker_id, RECORD.size)
+        self.capacity = (len(self._map) - HEADER.size) // RECORD.size
+        # 同一工作器的多个阶段追加到同一个文件
+        self.count = self._find_end()
+        self.seq = self.count
+        self._unflushed = 0
+
+    def _find_end(self):
+        lo, hi = 0, self.capacity
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._map[HEADER.size + mid * RECORD.size]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _grow(self):
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(HEADER.size + self.capacity * 2 * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity *= 2
+
+    def append(self, outcome, trx_type, key, value, start_ns, ack_ns):
+        if self.count >= self.capacity:
+            self._grow()
+        self.seq += 1
+        RECORD.pack_into(self._map, HEADER.size + self.count * RECORD.size,
+                         outcome, LEDGER_TRANSACTIONS[trx_type][0], self.seq, key, value, start_ns, ack_ns)
+        self.count += 1
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._unflushed:
+            self._map.flush()
+            self._unflushed = 0
+
+    def close(self):
+        if self._map is not None:
+            self.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+
+def read_ledger(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, worker_id, record_size = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError(f"不是有效的提交账本文件: {path}")
+    records = []
+    for offset in range(HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+        outcome, trx_code, seq, key, value, start_ns, ack_ns = RECORD.unpack_from(data, offset)
+        if outcome == 0:
+            break
+        trx_type, table, exists = TRANSACTION_CODES[trx_code]
+        records.append({'worker_id': worker_id, 'seq': seq, 'outcome': outcome, 'trx_type': trx_type,
+                        'table': table, 'key': key, 'state': value if exists else None,
+                        'start_ns': start_ns, 'ack_ns': ack_ns})
+    return records
+
+
+def _fetch_states(cur, table, keys, batch_size=10000):
+    # 返回 {键: 状态}，状态为金额（分）或 None（不存在）。有订单项的订单 payment 会被多表事务重算，
+    # 这些订单只比较是否存在，状态记为 ANY
+    states = dict.fromkeys(keys)
+    keys = list(keys)
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        if table == 'Order':
+            cur.execute("""
+                SELECT o.order_code, o.payment,
+                       EXISTS (SELECT 1 FROM "OrderItem" AS oi WHERE oi.order_code = o.order_code)
+                FROM "Order" AS o
+                WHERE o.order_code = ANY(%s);
+            """, (batch,))
+            for key, payment, has_items in cur.fetchall():
+                states[key] = ANY if has_items else (None if payment is None else to_cents(payment))
+        else:
+            cur.execute("SELECT id, price FROM \"Product\" WHERE id = ANY(%s);", (batch,))
+            for key, price in cur.fetchall():
+                states[key] = to_cents(price)
+    return states
+
+
+def _matches(actual, expected):
+    if actual is ANY:
+        return expected is not None
+    return actual == expected
+
+
+def reconcile_key(records, actual):
+    # 同一键上的写按客户端观察到的时间区间排序：若 w2.start_ns > w.ack_ns，w 一定先于 w2 提交，被覆盖。
+    # 未被任何已确认写覆盖的写才可能决定最终状态。
+    acknowledged = [r for r in records if r['outcome'] == ACKNOWLEDGED]
+    latest_start = max((r['start_ns'] for r in acknowledged), default=None)
+
+    def candidates(outcome):
+        return [r for r in records if r['outcome'] == outcome
+                and (latest_start is None or r['ack_ns'] >= latest_start)]
+
+    in_doubt = candidates(IN_DOUBT)
+    resolved = {'committed': [], 'aborted': []}
+    for r in in_doubt:
+        resolved['committed' if _matches(actual, r['state']) else 'aborted'].append(r)
+
+    if any(_matches(actual, r['state']) for r in candidates(ACKNOWLEDGED)):
+        return 'ok', resolved
+    if resolved['committed']:
+        return 'ok', resolved
+    if any(_matches(actual, r['state']) for r in candidates(FAILED)):
+        return 'phantom', resolved
+    if not acknowledged:
+        # 没有已确认的写，数据库状态可能是运行前的初始数据
+        return 'ok', resolved
+    return 'lost', resolved
+
+
+def reconcile(ledger_dir=LEDGER_DIR, dsn=DSN):
+    records_by_key = {}
+    unledgered = set()
+    for path in sorted(glob.glob(os.path.join(ledger_dir, "ledger_*.bin"))):
+        for record in read_ledger(path):
+            if record['trx_type'] in UNLEDGERED_WRITES:
+                unledgered.add((record['table'], record['key']))
+                continue
+            records_by_key.setdefault((record['table'], record['key']), []).append(record)
+
+    report = {'checked_keys': len(records_by_key), 'records': sum(len(r) for r in records_by_key.values()),
+              'lost': [], 'phantom': [], 'in_doubt_committed': 0, 'in_doubt_aborted': 0,
+              'in_doubt_undetermined': 0, 'unledgered_keys': len(unledgered & records_by_key.keys())}
+    conn = psycopg2.connect(dsn=dsn)
+    try:
+        with conn.cursor() as cur:
+            # 同一快照下读取所有状态
+            cur.execute("BEGIN TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            for table in ('Order', 'Product'):
+                keys = [key for (t, key) in records_by_key if t == table]
+                if not keys:
+                    continue
+                states = _fetch_states(cur, table, keys)
+                for key in keys:
+                    if (table, key) in unledgered and states[key] is not None:
+                        states[key] = ANY
+                for key in keys:
+                    records = records_by_key[(table, key)]
+                    actual = states[key]
+                    verdict, resolved = reconcile_key(records, actual)
+                    report['in_doubt_committed'] += len(resolved['committed'])
+                    report['in_doubt_aborted'] += len(resolved['aborted'])
+                    report['in_doubt_undetermined'] += (sum(1 for r in records if r['outcome'] == IN_DOUBT)
+                                                        - len(resolved['committed']) - len(resolved['aborted']))
+                    if verdict != 'ok':
+                        report[verdict].append({
+                            'table': table, 'key': key,
+                            'actual': actual if actual is not ANY else 'exists',
+                            'records': [{'worker_id': r['worker_id'], 'seq': r['seq'], 'trx_type': r['trx_type'],
+                                         'outcome': OUTCOMES[r['outcome']], 'state': r['state']}
+                                        for r in records]
+                        })
+        conn.rollback()
+    finally:
+        conn.close()
+    return report
+
+
+def print_reconciliation(report, limit=10):
+    print(f"\n--- 提交账本对账 (键 {report['checked_keys']} 个, 记录 {report['records']} 条) ---")
+    print(f"丢失的已确认提交: {len(report['lost'])}")
+    print(f"幻影提交（客户端收到失败但数据库中存在）: {len(report['phantom'])}")
+    print(f"结果未知的事务: 已提交 {report['in_doubt_committed']}, 未提交 {report['in_doubt_aborted']}, "
+          f"无法判断 {report['in_doubt_undetermined']}")
+    print(f"被不写账本的事务改过、只确认存在的键: {report['unledgered_keys']}")
+    for verdict in ('lost', 'phantom'):
+        for item in report[verdict][:limit]:
+            print(f"  [{verdict}] {item}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将工作器的提交账本与恢复后的数据库对账。")
+    parser.add_argument('--dir', default=LEDGER_DIR, help="账本文件目录")
+    args = parser.parse_args()
+    print_reconciliation(reconcile(args.dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import collections
+import os
+import threading
+import time
+from multiprocessing import util
+
+from settings import (
+    LOG_LEVEL,
+    LOG_OUTPUT,
+    LOG_BENCHMARK_MODE,
+    LOG_DIR,
+    LOG_BUFFER_SIZE,
+    LOG_FLUSH_INTERVAL
+)
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVELS_BY_NAME = {name: level for level, name in LEVEL_NAMES.items()}
+
+
+class BufferedLogSink:
+    # 热路径只做级别比较和一次 deque.append，消息使用 % 风格的延迟格式化，
+    # 由后台线程在刷盘时统一格式化并批量写入文件。
+    def __init__(self, name, level=INFO, output='file', log_dir=LOG_DIR,
+                 buffer_size=LOG_BUFFER_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        self.name = name
+        self.level = level
+        self.output = output
+        self.flush_interval = flush_interval
+        self.path = None
+        self.written = 0
+        self.dropped = 0
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._file = None
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        if self.output == 'file':
+            os.makedirs(log_dir, exist_ok=True)
+            self.path = os.path.join(log_dir, f"{name}.log")
+            self._file = open(self.path, 'a', encoding='utf-8', buffering=1024 * 1024)
+            self._thread = threading.Thread(target=self._flush_loop, name=f"log-sink-{name}", daemon=True)
+            self._thread.start()
+
+    def is_enabled_for(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args):
+        if level < self.level:
+            return
+        if self.output != 'file':
+            print(msg % args if args else msg)
+            return
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append((time.time(), level, msg, args))
+
+    def debug(self, msg, *args):
+        self.log(DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(ERROR, msg, *args)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            return
+        with self._write_lock:
+            buffer = self._buffer
+            lines = []
+            while buffer:
+                try:
+                    created, level, msg, args = buffer.popleft()
+                except IndexError:
+                    break
+                try:
+                    text = msg % args if args else msg
+                except Exception as e:
+                    text = f"{msg} {args} (格式化失败: {e})"
+                stamp = time.strftime('%H:%M:%S', time.localtime(created))
+                lines.append(f"{stamp}.{int(created * 1000) % 1000:03d} {LEVEL_NAMES[level]} [{self.name}] {text}\n")
+            if lines:
+                self._file.writelines(lines)
+                self._file.flush()
+                self.written += len(lines)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            if self.dropped:
+                self._file.write(f"日志缓冲区溢出，丢弃了 {self.dropped} 条记录。\n")
+            self._file.close()
+            self._file = None
+
+
+def _configured_level():
+    if LOG_BENCHMARK_MODE:
+        return ERROR
+    return LEVELS_BY_NAME.get(LOG_LEVEL.upper(), INFO)
+
+
+_sink = None
+_sink_pid = None
+
+
+def get_logger():
+    # 每个进程一个 sink：fork 出来的工作进程不会继承父进程的刷盘线程，按 pid 重新创建
+    global _sink, _sink_pid
+    pid = os.getpid()
+    if _sink is None or _sink_pid != pid:
+        _sink = BufferedLogSink(f"process_{pid}", level=_configured_level(), output=LOG_OUTPUT)
+        _sink_pid = pid
+        # 进程池工作进程退出时不会执行 atexit，multiprocessing 的 Finalize 会在进程退出前执行
+        util.Finalize(None, _sink.close, exitpriority=10)
+    return _sink
+
+
+def flush():
+    if _sink is not None and _sink_pid == os.getpid():
+        _sink.flush()
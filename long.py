@@ -1,20 +1,54 @@
-import psycopg2
 import random
 import sys
 import time
 import datetime 
 from connection import DSN
+import db_pool
 from fault_injector import inject_fault
-from settings import LONG_TRANSACTION_ITERATIONS, FAULT_INJECTION_ITERATION
-
-def long_running_price_update(product_id, pg_data_dir):
+from multiple import recompute_order_payments
+from backends import get_backend
+from settings import (
+    LONG_TRANSACTION_ITERATIONS,
+    FAULT_INJECTION_ITERATION,
+    LONG_COMMIT_EVERY,
+    LONG_RECOMPUTE_MODE,
+    LONG_WAL_BUDGET_MB,
+    LONG_DURATION_BUDGET,
+    LONG_FAULT_ON_BUDGET
+)
+
+# 长事务的形状：
+#   iterations       最多循环次数，None 表示只受预算限制
+#   commit_every     每 N 次循环提交一次，0 表示全部循环在同一个事务中
+#   recompute_mode   每次循环中订单金额的重算方式（'per_order' / 'set_based'）
+#   wal_budget_mb    长事务开始以来生成的 WAL 达到该值时停止，None 表示不限
+#   duration_budget  运行达到该秒数时停止，None 表示不限
+# 达到 fault_iteration 或（inject_fault_on_budget 时）达到预算时注入故障，否则提交剩余的循环。
+# 注入故障前打印未提交的循环数和 WAL 量，对应恢复时需要回滚/重放的工作量。
+
+def long_running_price_update(product_id, pg_data_dir, recompute_mode=LONG_RECOMPUTE_MODE,
+                              iterations=LONG_TRANSACTION_ITERATIONS, commit_every=LONG_COMMIT_EVERY,
+                              wal_budget_mb=LONG_WAL_BUDGET_MB, duration_budget=LONG_DURATION_BUDGET,
+                              fault_iteration=FAULT_INJECTION_ITERATION, inject_fault_on_budget=LONG_FAULT_ON_BUDGET):
+    if iterations is None and wal_budget_mb is None and duration_budget is None:
+        print("长事务没有循环次数上限，也没有 WAL 或时间预算，拒绝执行。")
+        return False
+    backend = get_backend()
     conn = None
     try:
-        conn = psycopg2.connect(dsn=DSN)
-        conn.autocommit = False 
+        conn = db_pool.getconn(autocommit=False)
 
         cur = conn.cursor()
 
+        # 开始时记录 WAL 插入位置，预算检查、分段提交、注入故障和结束时再读取，得到长事务生成的 WAL 量
+        wal_start = backend.wal_lsn(cur)
+        if wal_budget_mb is not None and wal_start is None:
+            print(f"{backend.name} 后端无法读取 WAL 位置，忽略 WAL 预算。")
+            wal_budget_mb = None
+        # 按预算注入时由预算决定未提交的工作量，不再在 fault_iteration 注入；没有可用预算时仍按循环次数
+        if inject_fault_on_budget and (wal_budget_mb is not None or duration_budget is not None):
+            fault_iteration = None
+
         cur.execute("SELECT price FROM \"Product\" WHERE id = %s;", (product_id,))
         initial_price_row = cur.fetchone()
         if not initial_price_row:
@@ -23,10 +57,17 @@ def long_running_price_update(product_id, pg_data_dir):
         initial_price = float(initial_price_row[0])
         print(f"产品 ID {product_id} 的初始价格: {initial_price}")
 
-        print(f"初始价格 + 1000: {initial_price + 1000:.2f}")
+        if iterations is not None:
+            print(f"初始价格 + {iterations}: {initial_price + iterations:.2f}")
 
         current_price = initial_price
-        for i in range(1, LONG_TRANSACTION_ITERATIONS + 1):
+        started = time.monotonic()
+        wal_at_commit = 0
+        committed_iterations = 0
+        wal_bytes = None
+        i = 0
+        while iterations is None or i < iterations:
+            i += 1
             current_price += 1.00  
             update_time = datetime.datetime.now()  
 
@@ -47,46 +88,55 @@ def long_running_price_update(product_id, pg_data_dir):
             cur.execute("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = %s;", (product_id,))
             affected_order_codes = [row[0] for row in cur.fetchall()]
 
-            for order_code in affected_order_codes:
-                cur.execute("""
-                    SELECT COALESCE(SUM(total_price), 0.00)
-                    FROM "OrderItem"
-                    WHERE order_code = %s;
-                """, (order_code,))
-                new_total_order_payment = cur.fetchone()[0]
-
-                cur.execute("""
-                    UPDATE "Order"
-                    SET payment = %s, update_time = %s
-                    WHERE order_code = %s;
-                """, (new_total_order_payment, datetime.datetime.now(), order_code))
+            recompute_order_payments(cur, affected_order_codes, recompute_mode)
 
+            if wal_budget_mb is not None:
+                wal_bytes = backend.wal_lsn(cur) - wal_start
+            budget_reached = ((wal_budget_mb is not None and wal_bytes >= wal_budget_mb * 1024 * 1024)
+                              or (duration_budget is not None and time.monotonic() - started >= duration_budget))
 
-            if i == FAULT_INJECTION_ITERATION:
-                print(f"在第 {i} 次循环时注入故障...")
+            if i == fault_iteration or (budget_reached and inject_fault_on_budget):
+                if wal_start is not None:
+                    wal_bytes = backend.wal_lsn(cur) - wal_start
+                print(f"在第 {i} 次循环时注入故障，未提交 {i - committed_iterations} 次循环"
+                      + (f"，未提交 WAL {(wal_bytes - wal_at_commit) / 1024 / 1024:.1f} MB" if wal_bytes is not None else "")
+                      + f"，已运行 {time.monotonic() - started:.1f} 秒...")
                 inject_fault(pg_data_dir)
                 sys.exit(1) 
 
+            if commit_every and i % commit_every == 0:
+                conn.commit()
+                committed_iterations = i
+                if wal_start is not None:
+                    wal_at_commit = backend.wal_lsn(cur) - wal_start
+
             if i % 100 == 0:
                 print(f"产品 ID {product_id}：第 {i} 次循环，当前价格: {current_price:.2f}") 
 
+            if budget_reached:
+                break
+
+        if wal_start is not None:
+            wal_bytes = backend.wal_lsn(cur) - wal_start
         conn.commit()
-        print(f"产品 ID {product_id} 的长事务完成，最终价格: {current_price:.2f}")
+        print(f"产品 ID {product_id} 的长事务完成，共 {i} 次循环，用时 {time.monotonic() - started:.1f} 秒"
+              + (f"，生成 WAL {wal_bytes / 1024 / 1024:.1f} MB" if wal_bytes is not None else "")
+              + f"，最终价格: {current_price:.2f}")
         return True
 
-    except psycopg2.Error as e:
+    except get_backend().Error as e:
         print(f"长事务执行失败: {e}")
-        if conn:
+        if conn and not conn.closed:
             conn.rollback()
             print("事务已回滚。") 
         return False
     finally:
         if conn:
-            conn.close()
+            db_pool.putconn(conn)
 
         print("\n--- 验证数据一致性 ---") 
         try:
-            temp_conn = psycopg2.connect(dsn=DSN)
+            temp_conn = db_pool.getconn(autocommit=True)
             temp_cur = temp_conn.cursor()
 
             temp_cur.execute("SELECT price FROM \"Product\" WHERE id = %s;", (product_id,))
@@ -115,19 +165,22 @@ def long_running_price_update(product_id, pg_data_dir):
             affected_order_codes_final = [row[0] for row in temp_cur.fetchall()]
 
             if affected_order_codes_final:
-                total_orders_payment = 0.00
-                for order_code in affected_order_codes_final:
-                    temp_cur.execute("SELECT payment FROM \"Order\" WHERE order_code = %s;", (order_code,))
-                    order_payment_row = temp_cur.fetchone()
-                    if order_payment_row:
-                        total_orders_payment += float(order_payment_row[0])
+                # 一条语句取回所有受影响订单的金额总和；没有数组参数的后端用 IN 列表
+                if get_backend().supports_arrays:
+                    temp_cur.execute("SELECT COALESCE(SUM(payment), 0.00) FROM \"Order\" WHERE order_code = ANY(%s);",
+                                     (affected_order_codes_final,))
+                else:
+                    placeholders = ', '.join(['%s'] * len(affected_order_codes_final))
+                    temp_cur.execute(f"SELECT COALESCE(SUM(payment), 0.00) FROM \"Order\" WHERE order_code IN ({placeholders});",
+                                     affected_order_codes_final)
+                total_orders_payment = float(temp_cur.fetchone()[0])
                 print(f"程序运行后 Order.payment (总和 for affected orders): {total_orders_payment:.2f}")
             else:
                 print(f"未找到受影响的订单数据。")
 
-            temp_conn.close()
+            db_pool.putconn(temp_conn)
 
-        except psycopg2.OperationalError as e:
+        except get_backend().Error as e:
             print(f"无法连接到数据库以验证最终数据一致性: {e}") 
             print("请确保数据库已运行。") 
         except Exception as e:
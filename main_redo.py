@@ -3,7 +3,8 @@ import psycopg2
 import time
 from multiprocessing import Pool, Process, Event, Value
 from CRUD import DBConn, OrderTransactionalWorker
-from create_table import create_tables, insert_test_data
+from create_table import create_tables, load_test_data
+from dataset import reset_dataset
 from functools import partial
 import sys
 import os
@@ -24,29 +25,35 @@ from settings import (
     LONG_TRANSACTION_ITERATIONS,
     FAULT_INJECTION_ITERATION,
     FIRST_INJECTION_TIME,
-    SECOND_INJECTION_TIME
+    SECOND_INJECTION_TIME,
+    DATASET_RESET
 )
 
 # Import the new function from fault_mode.py
 from fault_mode import run_fault_mode
 
+PG_DATA_DIR = "/data/pgsql"
+
 def run_redo_test():
     DB_HOST = DB_CONFIG['host']
     DB_NAME = DB_CONFIG['database']
     DB_USER = DB_CONFIG['user']
     DB_PASSWORD = DB_CONFIG['password']
     DB_PORT = DB_CONFIG['port']
-    PG_DATA_DIR = "/data/pgsql"
 
     try:
-        create_tables()
+        if DATASET_RESET == 'template':
+            # 由数据集模板重建实验数据库，不再删表并重新生成数据
+            reset_dataset()
+        else:
+            create_tables()
 
         with DBConn() as conn:
             conn.cursor.execute("SELECT COUNT(*) FROM \"User\";")
             user_count = conn.cursor.fetchone()[0]
             if user_count == 0:
                 try:
-                    insert_test_data(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+                    load_test_data(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
                     print("初始测试数据插入完成。")
                 except Exception as e:
                     print(f"自动测试数据插入失败: {e}")
@@ -77,8 +84,8 @@ def run_redo_test():
     print(f"事务比例配置: {transaction_ratios}")
     print(f"启动 {k} 个并发工作器，每个执行 {num_transactions_per_worker} 个事务，总计 {total_transactions_to_execute} 个事务。")
 
-    run_fault_mode(DB_CONFIG, PG_DATA_DIR, fault_mode, k, num_transactions_per_worker,
-                   first_injection_transactions, second_injection_transactions, transaction_ratios)
+    return run_fault_mode(DB_CONFIG, PG_DATA_DIR, fault_mode, k, num_transactions_per_worker,
+                          first_injection_transactions, second_injection_transactions, transaction_ratios)
 
 if __name__ == '__main__':
     print("正在执行 Redo 测试...")
@@ -0,0 +1,239 @@
+import math
+import time
+
+# HDR 风格的对数分桶直方图：每个 2 的幂区间再线性切分为 2^SUB_BUCKET_BITS 个子桶，
+# 相对误差约为 1/2^SUB_BUCKET_BITS。桶数固定，与记录的样本数量无关。
+SUB_BUCKET_BITS = 6
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+MAX_TRACKABLE_US = 1 << 40  # 约 12.7 天，超出部分截断到最后一个桶
+BUCKET_COUNT = SUB_BUCKET_COUNT + (MAX_TRACKABLE_US.bit_length() - SUB_BUCKET_BITS) * SUB_BUCKET_COUNT
+
+REPORT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# 成功事务按完成时间（time.monotonic()）计入 THROUGHPUT_BUCKET 秒宽的桶，用于计算故障后吞吐恢复时间
+THROUGHPUT_BUCKET = 0.1
+
+
+def _bucket_index(value_us):
+    if value_us < SUB_BUCKET_COUNT:
+        return value_us
+    shift = value_us.bit_length() - SUB_BUCKET_BITS - 1
+    index = SUB_BUCKET_COUNT + shift * SUB_BUCKET_COUNT + ((value_us >> shift) - SUB_BUCKET_COUNT)
+    return min(index, BUCKET_COUNT - 1)
+
+
+def _bucket_upper_bound(index):
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift, offset = divmod(index - SUB_BUCKET_COUNT, SUB_BUCKET_COUNT)
+    return ((SUB_BUCKET_COUNT + offset + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total_count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def record(self, value_us):
+        value_us = max(int(value_us), 0)
+        self.counts[_bucket_index(value_us)] += 1
+        self.total_count += 1
+        self.total_us += value_us
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.total_count += other.total_count
+        self.total_us += other.total_us
+        if other.min_us is not None and (self.min_us is None or other.min_us < self.min_us):
+            self.min_us = other.min_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, pct):
+        if self.total_count == 0:
+            return 0
+        target = max(1, math.ceil(self.total_count * pct / 100.0))
+        running = 0
+        for i, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return min(_bucket_upper_bound(i), self.max_us)
+        return self.max_us
+
+    def mean(self):
+        return self.total_us / self.total_count if self.total_count else 0.0
+
+    # 只序列化非零桶，避免向父进程回传整张桶表
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['counts'] = {i: c for i, c in enumerate(self.counts) if c}
+        return state
+
+    def __setstate__(self, state):
+        sparse = state.pop('counts')
+        self.__dict__.update(state)
+        self.counts = [0] * BUCKET_COUNT
+        for i, c in sparse.items():
+            self.counts[i] = c
+
+
+class WorkloadStats:
+    def __init__(self):
+        self.histograms = {}
+        # 开环负载下 histograms 记录从预定开始时间起算的响应时间（修正协调遗漏），
+        # service_histograms 记录事务实际执行的服务时间
+        self.service_histograms = {}
+        self.errors = {}
+        self.in_doubt = {}
+        self.error_kinds = {}
+        self.completions = {}
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+
+    def stop(self):
+        self.end_time = time.monotonic()
+
+    def record(self, trx_type, latency_ns, ok=True, service_ns=None, error_kind=None, timeline=True):
+        hist = self.histograms.get(trx_type)
+        if hist is None:
+            hist = self.histograms[trx_type] = LatencyHistogram()
+        hist.record(latency_ns // 1000)
+        if service_ns is not None:
+            service_hist = self.service_histograms.get(trx_type)
+            if service_hist is None:
+                service_hist = self.service_histograms[trx_type] = LatencyHistogram()
+            service_hist.record(service_ns // 1000)
+        if not ok:
+            self.errors[trx_type] = self.errors.get(trx_type, 0) + 1
+            if error_kind == 'in_doubt':
+                self.in_doubt[trx_type] = self.in_doubt.get(trx_type, 0) + 1
+        elif timeline:
+            bucket = int(time.monotonic() / THROUGHPUT_BUCKET)
+            self.completions[bucket] = self.completions.get(bucket, 0) + 1
+        if error_kind is not None:
+            self.count_error(error_kind)
+
+    def count_error(self, error_kind):
+        self.error_kinds[error_kind] = self.error_kinds.get(error_kind, 0) + 1
+
+    def merge(self, other):
+        if other is None:
+            return self
+        for mine, theirs in ((self.histograms, other.histograms),
+                             (self.service_histograms, other.service_histograms)):
+            for trx_type, hist in theirs.items():
+                if trx_type in mine:
+                    mine[trx_type].merge(hist)
+                else:
+                    mine[trx_type] = LatencyHistogram().merge(hist)
+        for mine, theirs in ((self.errors, other.errors), (self.in_doubt, other.in_doubt),
+                             (self.error_kinds, other.error_kinds), (self.completions, other.completions)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        # time.monotonic() 在同一台机器的不同进程间可比，取最早开始和最晚结束
+        if other.start_time is not None and (self.start_time is None or other.start_time < self.start_time):
+            self.start_time = other.start_time
+        if other.end_time is not None and (self.end_time is None or other.end_time > self.end_time):
+            self.end_time = other.end_time
+        return self
+
+    def elapsed(self):
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+    def summary(self):
+        elapsed = self.elapsed()
+        rows = {}
+        for trx_type, hist in sorted(self.histograms.items()):
+            row = {
+                'count': hist.total_count,
+                'errors': self.errors.get(trx_type, 0),
+                'in_doubt': self.in_doubt.get(trx_type, 0),
+                'tps': hist.total_count / elapsed if elapsed > 0 else 0.0,
+                'mean_ms': hist.mean() / 1000.0,
+                'max_ms': hist.max_us / 1000.0,
+            }
+            for pct in REPORT_PERCENTILES:
+                row[f'p{pct:g}_ms'] = hist.percentile(pct) / 1000.0
+            service_hist = self.service_histograms.get(trx_type)
+            if service_hist is not None:
+                row['service_p50_ms'] = service_hist.percentile(50.0) / 1000.0
+                row['service_p99_ms'] = service_hist.percentile(99.0) / 1000.0
+            rows[trx_type] = row
+        return rows
+
+
+def throughput_recovery(stats, fault_time, percent, baseline_window, smoothing_window=1.0):
+    # fault_time 为 time.monotonic() 秒。基线为故障前 baseline_window 秒的平均成功 TPS；
+    # 返回 (基线 TPS, 从故障到 smoothing_window 秒滑动平均 TPS 首次回到基线 percent% 的秒数)，未恢复时秒数为 None
+    buckets = stats.completions
+    if not buckets:
+        return 0.0, None
+    fault_bucket = int(fault_time / THROUGHPUT_BUCKET)
+    baseline_start = max(min(buckets), fault_bucket - int(round(baseline_window / THROUGHPUT_BUCKET)))
+    if baseline_start >= fault_bucket:
+        return 0.0, None
+    baseline = (sum(buckets.get(b, 0) for b in range(baseline_start, fault_bucket))
+                / ((fault_bucket - baseline_start) * THROUGHPUT_BUCKET))
+    if baseline <= 0:
+        return 0.0, None
+    width = max(1, int(round(smoothing_window / THROUGHPUT_BUCKET)))
+    target = baseline * percent / 100.0 * width * THROUGHPUT_BUCKET
+    # 滑动窗口完全位于故障之后，避免把故障前完成的事务算进恢复
+    window = 0
+    for b in range(fault_bucket + 1, max(buckets) + 1):
+        window += buckets.get(b, 0)
+        if b - width > fault_bucket:
+            window -= buckets.get(b - width, 0)
+        if b - fault_bucket >= width and window >= target:
+            return baseline, (b + 1) * THROUGHPUT_BUCKET - fault_time
+    return baseline, None
+
+
+def merge_stats(stats_list):
+    merged = WorkloadStats()
+    for stats in stats_list:
+        merged.merge(stats)
+    return merged
+
+
+def print_latency_report(stats, title="事务延迟统计"):
+    summary = stats.summary()
+    print(f"\n--- {title} (统计时长 {stats.elapsed():.2f} 秒) ---")
+    if not summary:
+        print("没有记录到任何事务。")
+        return
+    show_service = bool(stats.service_histograms)
+    header = f"{'事务类型':<36}{'次数':>10}{'失败':>8}{'未决':>8}{'TPS':>10}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'p99.9(ms)':>11}{'max(ms)':>10}"
+    if show_service:
+        header += f"{'服务p50(ms)':>13}{'服务p99(ms)':>13}"
+    print(header)
+    total_count = 0
+    for trx_type, row in summary.items():
+        # 连接池记录的 connection_* 是取得/建立连接的耗时，不是事务，不计入总数（与 sweep.summarize_run 一致）
+        if not trx_type.startswith('connection_'):
+            total_count += row['count']
+        line = (f"{trx_type:<36}{row['count']:>10}{row['errors']:>8}{row['in_doubt']:>8}{row['tps']:>10.1f}"
+                f"{row['p50_ms']:>10.2f}{row['p90_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['p99.9_ms']:>11.2f}{row['max_ms']:>10.2f}")
+        if show_service and 'service_p50_ms' in row:
+            line += f"{row['service_p50_ms']:>13.2f}{row['service_p99_ms']:>13.2f}"
+        print(line)
+    elapsed = stats.elapsed()
+    if elapsed > 0:
+        print(f"总事务数: {total_count}, 总吞吐量: {total_count / elapsed:.1f} TPS")
+    if stats.error_kinds:
+        print("错误分类: " + ", ".join(f"{kind}={count}" for kind, count in sorted(stats.error_kinds.items())))
@@ -1,17 +1,22 @@
-import psycopg2
 import time
-from multiprocessing import Process, Event, Value
+from multiprocessing import Process, Event, Value, Queue
 from CRUD import DBConn
-from create_table import create_tables, insert_test_data
+import db_pool
+from create_table import create_tables, load_test_data
+from dataset import reset_dataset
 from functools import partial
 import sys
 import os
 import random
 import datetime
 
-from fault_injector import inject_fault
+from fault_injector import inject_fault, track_fault_times
 from connection import DB_CONFIG
 from multiple import MultiTableOperations
+from recovery import heartbeat_writer, measure_recovery
+from wal_stats import sample_wal
+from backends import get_backend
+from settings import DATASET_RESET, WAL_STATS_ENABLED
 
 def log_database_counts(db_config, stop_event):
     host = db_config['host']
@@ -36,7 +41,7 @@ def log_database_counts(db_config, stop_event):
 
                 print(f"[{time.strftime('%H:%M:%S')}] Users: {user_count}, Orders: {order_count}, OrderItems: {order_item_count}")
             time.sleep(2)
-        except psycopg2.OperationalError as e:
+        except get_backend().Error as e:
             print(f"[{time.strftime('%H:%M:%S')}] 数据库连接丢失或失效 {e}")
             time.sleep(20)
         except Exception as e:
@@ -45,10 +50,9 @@ def log_database_counts(db_config, stop_event):
     print("实时数据库计数日志记录停止。")
 
 def start_database(pg_data_dir):
+    import subprocess
     try:
-        import subprocess
-        command = ["su", "-", "postgres", "-c", f"pg_ctl start -D {pg_data_dir}"]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        result = get_backend().start(pg_data_dir)
         print(f"Database started successfully: {result.stdout}")
         if result.stderr:
             print(f"stderr: {result.stderr}")
@@ -62,37 +66,13 @@ def start_database(pg_data_dir):
         print("Error: 'su' or 'pg_ctl' command not found. Please ensure they are in the system's PATH.")
         return False
 
-def check_database_connection(host, database, user, password, port, timeout=60):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            conn = psycopg2.connect(
-                host=host,
-                database=database,
-                user=user,
-                password=password,
-                port=port,
-                connect_timeout=20
-            )
-            conn.close()
-            print("数据库连接成功！")
-            return True
-        except psycopg2.OperationalError:
-            print("等待数据库启动...", end='\r')
-            time.sleep(1)
-        except Exception as e:
-            print(f"检查数据库连接时发生意外错误: {e}")
-            time.sleep(1)
-    print("数据库连接超时。")
-    return False
-
 def get_product_price(product_id):
     try:
         with DBConn() as conn:
             conn.cursor.execute("SELECT price FROM \"Product\" WHERE id = %s;", (product_id,))
             price = conn.cursor.fetchone()
             return float(price[0]) if price else None
-    except psycopg2.Error as e:
+    except get_backend().Error as e:
         print(f"获取产品价格失败: {e}")
         return None
 
@@ -102,7 +82,7 @@ def find_an_existing_product_id():
             conn.cursor.execute("SELECT id FROM \"Product\" ORDER BY RANDOM() LIMIT 1;")
             product_id = conn.cursor.fetchone()
             return product_id[0] if product_id else None
-    except psycopg2.Error as e:
+    except get_backend().Error as e:
         print(f"查找现有产品ID失败: {e}")
         return None
 
@@ -136,14 +116,18 @@ def run_two_worker_dependent_transaction_fault_test():
     PG_DATA_DIR = "/data/pgsql" 
 
     try:
-        create_tables() 
+        if DATASET_RESET == 'template':
+            # 由数据集模板重建实验数据库，不再删表并重新生成数据
+            reset_dataset()
+        else:
+            create_tables()
 
         with DBConn() as conn:
             conn.cursor.execute("SELECT COUNT(*) FROM \"User\";")
             user_count = conn.cursor.fetchone()[0]
             if user_count == 0:
                 try:
-                    insert_test_data(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+                    load_test_data(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
                     print("初始测试数据插入完成。")
                 except Exception as e:
                     print(f"自动测试数据插入失败: {e}")
@@ -151,10 +135,20 @@ def run_two_worker_dependent_transaction_fault_test():
             else:
                 print(f"数据库中现有用户数据计数: {user_count}.")
 
+        # 每次 fork 前关闭父进程的连接池，子进程不继承连接（sqlite 连接被继承会损坏数据库文件）
+        db_pool.close_pool()
         stop_logging_event = Event()
         log_process = Process(target=log_database_counts, args=(DB_CONFIG, stop_logging_event))
         log_process.start()
 
+        fault_queue = Queue()
+        track_fault_times(fault_queue)
+        outage_queue = Queue()
+        heartbeat_stop_event = Event()
+        heartbeat_process = Process(target=heartbeat_writer, args=(DB_CONFIG, heartbeat_stop_event, outage_queue),
+                                    daemon=True)
+        heartbeat_process.start()
+
         product_id_to_test = find_an_existing_product_id()
         if not product_id_to_test:
             print("没有可用的产品ID进行测试,请确保有测试数据。")
@@ -168,6 +162,7 @@ def run_two_worker_dependent_transaction_fault_test():
         multi_ops_instance = MultiTableOperations() 
 
         print(f"\n2. 工作器 0 (事务 A): 修改产品 {product_id_to_test} 价格 (+10)")
+        db_pool.close_pool()
         worker0_process = Process(target=custom_price_update_worker,
                                   args=(0, product_id_to_test, 10.00, multi_ops_instance))
         worker0_process.start()
@@ -177,20 +172,21 @@ def run_two_worker_dependent_transaction_fault_test():
         print(f"3. 工作器 0 执行后产品 {product_id_to_test} 的价格: {price_after_worker0:.2f}")
 
         print("\n4. 注入故障 (关闭数据库)")
-        inject_fault(PG_DATA_DIR)
+        inject_fault(PG_DATA_DIR, wal=sample_wal() if WAL_STATS_ENABLED else None)
 
         stop_logging_event.set()
         log_process.join()
 
         print("\n5. 恢复数据库")
-        recovery_start_time = time.time()
-        if not start_database(PG_DATA_DIR):
+        timeline = measure_recovery("故障注入", DB_CONFIG, PG_DATA_DIR, start_database, fault_queue, outage_queue)
+        heartbeat_stop_event.set()
+        heartbeat_process.join()
+        if not timeline.started:
             print("未能自动启动数据库,请手动启动并重试。")
             sys.exit(1)
-        if check_database_connection(DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT):
-            recovery_end_time = time.time()
-            recovery_time = recovery_end_time - recovery_start_time
-            print(f"数据库已恢复并可连接,恢复时间: {recovery_time:.2f} 秒。")
+        if timeline.recovered:
+            print(f"数据库已恢复并可连接,恢复时间: {timeline.recovery_time:.3f} 秒。")
+            timeline.print_report()
         else:
             print("数据库在故障注入后未能恢复并连接.")
             sys.exit(1)
@@ -198,6 +194,7 @@ def run_two_worker_dependent_transaction_fault_test():
         multi_ops_instance = MultiTableOperations()
 
         print(f"\n6. 工作器 1 (事务 B): 依赖事务 A,修改产品 {product_id_to_test} 价格 (+5)")
+        db_pool.close_pool()
         worker1_process = Process(target=custom_price_update_worker,
                                   args=(1, product_id_to_test, 5.00, multi_ops_instance))
         worker1_process.start()
@@ -1,64 +1,154 @@
-import psycopg2
 import random
 from connection import DSN, DB_CONFIG
 from CRUD import DBConn
 from fault_injector import inject_fault
+from ledger import to_cents
+from backends import get_backend
+from log_sink import get_logger
+import db_pool
+from prepared import statement_registry
 import sys
 import datetime # Import datetime for update_time
+from settings import PAYMENT_RECOMPUTE_MODE, NESTED_SAVEPOINT_DEPTHS, NESTED_ROLLBACK_RATIO
 
-class MultiTableOperations:
-    def __init__(self):
-        self.existing_product_ids = self._load_product_ids()
-        self.existing_order_codes = self._load_order_codes()
-        self.existing_user_ids = self._load_user_ids()
+RECOMPUTE_MODES = ('per_order', 'set_based')
+
+backend = get_backend()
+
+def recompute_order_payments(cur, order_codes, mode=PAYMENT_RECOMPUTE_MODE):
+    if mode not in RECOMPUTE_MODES:
+        raise ValueError(f"不支持的订单金额重算模式: {mode}")
+    if not order_codes:
+        return 0
+
+    if mode == 'set_based' and not backend.supports_arrays:
+        # 没有数组参数的后端用 IN 列表和相关子查询，同样一条语句完成
+        placeholders = ', '.join(['%s'] * len(order_codes))
+        cur.execute(f"""
+            UPDATE "Order"
+            SET payment = (SELECT COALESCE(SUM(oi.total_price), 0.00)
+                           FROM "OrderItem" AS oi
+                           WHERE oi.order_code = "Order".order_code),
+                update_time = %s
+            WHERE order_code IN ({placeholders});
+        """, (datetime.datetime.now(), *order_codes))
+        get_logger().debug("以集合方式重新计算并更新了 %s 个订单的总支付金额。", cur.rowcount)
+        return cur.rowcount
 
-    def _load_product_ids(self):
+    if mode == 'set_based':
+        # 一条语句重算所有受影响订单；LEFT JOIN 保证订单项已全部删除的订单金额归零
+        statement_registry.execute(cur, 'recompute_order_payments', """
+            UPDATE "Order" AS o
+            SET payment = s.total_payment, update_time = %s
+            FROM (
+                SELECT c.order_code, COALESCE(SUM(oi.total_price), 0.00) AS total_payment
+                FROM unnest(%s::bigint[]) AS c(order_code)
+                LEFT JOIN "OrderItem" AS oi ON oi.order_code = c.order_code
+                GROUP BY c.order_code
+            ) AS s
+            WHERE o.order_code = s.order_code;
+        """, (datetime.datetime.now(), list(order_codes)))
+        get_logger().debug("以集合方式重新计算并更新了 %s 个订单的总支付金额。", cur.rowcount)
+        return cur.rowcount
+
+    log = get_logger()
+    updated = 0
+    for order_code in order_codes:
+        statement_registry.execute(cur, 'order_payment_sum', """
+            SELECT COALESCE(SUM(total_price), 0.00)
+            FROM "OrderItem"
+            WHERE order_code = %s;
+        """, (order_code,))
+        new_total_order_payment = cur.fetchone()[0]
+
+        statement_registry.execute(cur, 'update_order_payment', """
+            UPDATE "Order"
+            SET payment = %s, update_time = %s
+            WHERE order_code = %s;
+        """, (new_total_order_payment, datetime.datetime.now(), order_code)) # Update update_time
+        updated += cur.rowcount
+        log.debug("重新计算并更新订单 %s 的总支付金额为 %s。", order_code, new_total_order_payment) # Recalculated and updated total payment for order.
+    return updated
+
+class MultiTableOperations:
+    def __init__(self, recompute_mode=PAYMENT_RECOMPUTE_MODE):
+        if recompute_mode not in RECOMPUTE_MODES:
+            raise ValueError(f"不支持的订单金额重算模式: {recompute_mode}")
+        self.recompute_mode = recompute_mode
+        self.last_error = None
+        self.commit_in_flight = False
+        self.last_write = None
+        # 不写账本的写入 [(账本事务类型, 键)]：保存点嵌套事务和长事务改过的商品、删除商品时重算了金额的订单，
+        # 由工作器记入账本后清空
+        self.unledgered_writes = []
+        # 最近一次保存点嵌套事务的深度、实际写入（分配了子事务 ID）的层数和回滚的层数
+        self.last_nested_depth = None
+        self.last_nested_written = 0
+        self.last_nested_rollbacks = 0
+        # 三类 ID 共用一个连接加载
         try:
             with DBConn() as conn:
-                conn.cursor.execute("SELECT id FROM \"Product\";")
-                return [row[0] for row in conn.cursor.fetchall()]
-        except psycopg2.Error as e:
-            print(f"加载产品ID失败 {e}") # Failed to load product IDs
+                self.existing_product_ids = self._load_product_ids(conn)
+                self.existing_order_codes = self._load_order_codes(conn)
+                self.existing_user_ids = self._load_user_ids(conn)
+        except backend.Error as e:
+            get_logger().error("加载初始数据失败 %s", e)
+            self.existing_product_ids = []
+            self.existing_order_codes = []
+            self.existing_user_ids = []
+
+    def _load_product_ids(self, conn):
+        try:
+            conn.cursor.execute("SELECT id FROM \"Product\";")
+            return [row[0] for row in conn.cursor.fetchall()]
+        except backend.Error as e:
+            get_logger().error("加载产品ID失败 %s", e) # Failed to load product IDs
             return []
 
-    def _load_order_codes(self):
+    def _load_order_codes(self, conn):
         try:
-            with DBConn() as conn:
-                conn.cursor.execute("SELECT order_code FROM \"Order\";")
-                return [row[0] for row in conn.cursor.fetchall()]
-        except psycopg2.Error as e:
-            print(f"加载订单号失败 {e}") # Failed to load order codes
+            conn.cursor.execute("SELECT order_code FROM \"Order\";")
+            return [row[0] for row in conn.cursor.fetchall()]
+        except backend.Error as e:
+            get_logger().error("加载订单号失败 %s", e) # Failed to load order codes
             return []
 
-    def _load_user_ids(self):
+    def _load_user_ids(self, conn):
         try:
-            with DBConn() as conn:
-                conn.cursor.execute("SELECT id FROM \"User\";")
-                return [row[0] for row in conn.cursor.fetchall()]
-        except psycopg2.Error as e:
-            print(f"加载用户ID失败 {e}") # Failed to load user IDs
+            conn.cursor.execute("SELECT id FROM \"User\";")
+            return [row[0] for row in conn.cursor.fetchall()]
+        except backend.Error as e:
+            get_logger().error("加载用户ID失败 %s", e) # Failed to load user IDs
             return []
 
     def delete_product_and_related_order_items(self, product_id=None, inject_fault_at_point=None, pg_data_dir=None):
+        log = get_logger()
         if not self.existing_product_ids:
-            print("没有可删除的产品。") # No products to delete.
+            log.warning("没有可删除的产品。") # No products to delete.
             return False
 
         if product_id is None:
             product_id = random.choice(self.existing_product_ids)
 
+        self.last_error = None
+        self.commit_in_flight = False
+        self.last_write = None
         conn = None
         try:
-            conn = psycopg2.connect(dsn=DSN)
-            conn.autocommit = False # Set autocommit to False
+            conn = db_pool.getconn(autocommit=False) # Set autocommit to False
             cur = conn.cursor()
 
             cur.execute("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = %s;", (product_id,))
             affected_order_codes = [row[0] for row in cur.fetchall()]
+            # 账本只记录商品的删除；订单项全部删除的订单金额重算为 0，对账时按金额比较会误报。
+            # 所属订单已删除的订单项 order_code 为 NULL
+            self.unledgered_writes.extend(('unledgered_payment_write', code) for code in affected_order_codes
+                                          if code is not None)
 
+            self.last_write = ('delete_product_multi_table', product_id, 0)
             cur.execute("DELETE FROM \"OrderItem\" WHERE product_id = %s;", (product_id,))
             deleted_order_items_count = cur.rowcount
-            print(f"删除了 {deleted_order_items_count} 个与产品 ID {product_id} 相关的订单项。") # Deleted related order items for product ID.
+            log.debug("删除了 %s 个与产品 ID %s 相关的订单项。", deleted_order_items_count, product_id) # Deleted related order items for product ID.
 
             if inject_fault_at_point == 'after_step2' and pg_data_dir:
                 print(f" 在删除产品 ID {product_id} 的订单项后注入故障 ") # Injecting fault after deleting order items for product ID.
@@ -69,62 +159,55 @@ class MultiTableOperations:
             deleted_product_count = cur.rowcount
 
             if deleted_product_count == 0:
-                print(f"未找到 ID 为 {product_id} 的产品。") # Product with ID not found.
+                log.info("未找到 ID 为 %s 的产品。", product_id) # Product with ID not found.
+                self.last_write = None
                 conn.rollback()
                 return False
 
-            print(f"已删除 ID 为 {product_id} 的产品。") # Product with ID deleted.
+            log.debug("已删除 ID 为 %s 的产品。", product_id) # Product with ID deleted.
 
-            for order_code in affected_order_codes:
-                cur.execute("""
-                    SELECT COALESCE(SUM(total_price), 0.00)
-                    FROM "OrderItem"
-                    WHERE order_code = %s;
-                """, (order_code,))
-                new_total_order_payment = cur.fetchone()[0]
-
-                cur.execute("""
-                    UPDATE "Order"
-                    SET payment = %s, update_time = %s
-                    WHERE order_code = %s;
-                """, (new_total_order_payment, datetime.datetime.now(), order_code)) # Update update_time
-                print(f"重新计算并更新订单 {order_code} 的总支付金额为 {new_total_order_payment}。") # Recalculated and updated total payment for order.
+            recompute_order_payments(cur, affected_order_codes, self.recompute_mode)
 
+            self.commit_in_flight = True
             conn.commit()
-            print(f"成功删除产品 ID {product_id}，其 {deleted_order_items_count} 个相关订单项，并更新受影响的订单。") # Successfully deleted product ID, its related order items, and updated affected orders.
+            log.info("成功删除产品 ID %s，其 %s 个相关订单项，并更新受影响的订单。", product_id, deleted_order_items_count) # Successfully deleted product ID, its related order items, and updated affected orders.
 
             if product_id in self.existing_product_ids:
                 self.existing_product_ids.remove(product_id)
             return True
 
-        except psycopg2.Error as e:
-            print(f"删除产品及相关订单项时出错: {e}") # Error deleting product and related order items
-            if conn:
+        except backend.Error as e:
+            self.last_error = e
+            log.error("删除产品及相关订单项时出错: %s", e) # Error deleting product and related order items
+            if conn and not conn.closed:
                 conn.rollback()
-                print("事务已回滚。") # Transaction rolled back.
+                log.error("事务已回滚。") # Transaction rolled back.
             return False
         finally:
             if conn:
-                conn.close()
+                db_pool.putconn(conn)
 
     def modify_product_price_and_update_orders(self, product_id=None, new_price=None, inject_fault_at_point=None, pg_data_dir=None):
+        log = get_logger()
         if not self.existing_product_ids:
-            print("没有产品可以修改价格。") # No products to modify price.
+            log.warning("没有产品可以修改价格。") # No products to modify price.
             return False
 
         if product_id is None:
             product_id = random.choice(self.existing_product_ids)
 
+        self.last_error = None
+        self.commit_in_flight = False
+        self.last_write = None
         conn = None
         try:
-            conn = psycopg2.connect(dsn=DSN)
-            conn.autocommit = False   # Set to not autocommit, treated as one transaction
+            conn = db_pool.getconn(autocommit=False)   # Set to not autocommit, treated as one transaction
             cur = conn.cursor()
 
             cur.execute("SELECT price FROM \"Product\" WHERE id = %s;", (product_id,))
             current_product_data = cur.fetchone()
             if not current_product_data:
-                print(f" ID为{product_id} 的产品未找到。") # Product with ID not found.
+                log.info(" ID为%s 的产品未找到。", product_id) # Product with ID not found.
                 conn.rollback()
                 return False
 
@@ -134,13 +217,15 @@ class MultiTableOperations:
                 new_price = round(float(current_price) * price_change_factor, 2)
                 if new_price <= 0: new_price = 0.01
 
+            self.last_write = ('modify_product_price_multi_table', product_id, to_cents(new_price))
             cur.execute("UPDATE \"Product\" SET price = %s, update_time = %s WHERE id = %s;", (new_price, datetime.datetime.now(), product_id)) # Update update_time
             updated_product_count = cur.rowcount
             if updated_product_count == 0:
-                print(f"未能更新 ID 为 {product_id} 的产品价格。") # Failed to update product price for ID.
+                log.warning("未能更新 ID 为 %s 的产品价格。", product_id) # Failed to update product price for ID.
+                self.last_write = None
                 conn.rollback()
                 return False
-            print(f"已将产品 ID {product_id} 的价格更新为 {new_price}。") # Product ID price updated.
+            log.debug("已将产品 ID %s 的价格更新为 %s。", product_id, new_price) # Product ID price updated.
 
             cur.execute("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = %s;", (product_id,))
             affected_order_codes = [row[0] for row in cur.fetchall()]
@@ -153,38 +238,98 @@ class MultiTableOperations:
                 WHERE product_id = %s;
             """, (new_price, new_price, datetime.datetime.now(), product_id)) # Update update_time
             updated_order_items_count = cur.rowcount
-            print(f"已更新 {updated_order_items_count} 个订单项，产品 ID 为 {product_id}。") # Updated order items for product ID.
+            log.debug("已更新 %s 个订单项，产品 ID 为 %s。", updated_order_items_count, product_id) # Updated order items for product ID.
 
             if inject_fault_at_point == 'after_order_item_update' and pg_data_dir:
                 print(f"在更新ID为 {product_id} 的产品价格后注入故障。") # Injecting fault after updating product price for ID.
                 inject_fault(pg_data_dir)
                 sys.exit(1)
 
-            for order_code in affected_order_codes:
-                cur.execute("""
-                    SELECT COALESCE(SUM(total_price), 0.00)
-                    FROM "OrderItem"
-                    WHERE order_code = %s;
-                """, (order_code,))
-                new_total_order_payment = cur.fetchone()[0]
-
-                cur.execute("""
-                    UPDATE "Order"
-                    SET payment = %s, update_time = %s
-                    WHERE order_code = %s;
-                """, (new_total_order_payment, datetime.datetime.now(), order_code)) # Update update_time
-                print(f"已重新计算并更新订单 {order_code} 的总支付金额为 {new_total_order_payment}。") # Recalculated and updated total payment for order.
+            recompute_order_payments(cur, affected_order_codes, self.recompute_mode)
 
+            self.commit_in_flight = True
             conn.commit()
-            print(f"成功修改产品 ID {product_id} 的价格，并更新了 {updated_order_items_count} 个相关订单项和 {len(affected_order_codes)} 个受影响的订单。") # Successfully modified product ID price, and updated related order items and affected orders.
+            log.info("成功修改产品 ID %s 的价格，并更新了 %s 个相关订单项和 %s 个受影响的订单。", product_id, updated_order_items_count, len(affected_order_codes)) # Successfully modified product ID price, and updated related order items and affected orders.
             return True
 
-        except psycopg2.Error as e:
-            print(f"修改产品价格和更新订单时出错: {e}") # Error modifying product price and updating orders
+        except backend.Error as e:
+            self.last_error = e
+            log.error("修改产品价格和更新订单时出错: %s", e) # Error modifying product price and updating orders
+            if conn and not conn.closed:
+                conn.rollback()
+                log.error("事务已回滚。") # Transaction rolled back.
+            return False
+        finally:
             if conn:
+                db_pool.putconn(conn)
+
+    def _change_price_step(self, cur, product_id):
+        # 保存点嵌套事务中每一层执行的改价步骤，返回受影响的订单数；商品已被删除时本层不做修改，
+        # 也不分配子事务 ID，返回 None
+        cur.execute("SELECT price FROM \"Product\" WHERE id = %s;", (product_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        new_price = max(round(float(row[0]) * random.uniform(0.95, 1.05), 2), 0.01)
+        update_time = datetime.datetime.now()
+        cur.execute("UPDATE \"Product\" SET price = %s, update_time = %s WHERE id = %s;", (new_price, update_time, product_id))
+        cur.execute("SELECT DISTINCT order_code FROM \"OrderItem\" WHERE product_id = %s;", (product_id,))
+        affected_order_codes = [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            UPDATE "OrderItem"
+            SET current_unit_price = %s,
+                total_price = %s * quantity,
+                update_time = %s
+            WHERE product_id = %s;
+        """, (new_price, new_price, update_time, product_id))
+        recompute_order_payments(cur, affected_order_codes, self.recompute_mode)
+        return len(affected_order_codes)
+
+    def nested_savepoint_price_update(self, depth=None, rollback_ratio=NESTED_ROLLBACK_RATIO):
+        # 第 1..depth 层各开一个 SAVEPOINT 并执行一次改价，然后由内向外逐层结束：按 rollback_ratio
+        # ROLLBACK TO 该层保存点，再 RELEASE。每个写入的保存点占用一个子事务 ID，PostgreSQL 每个后端
+        # 只缓存 64 个，超过后其他会话判断可见性需要查 pg_subtrans（子事务溢出）
+        log = get_logger()
+        if not self.existing_product_ids:
+            log.warning("没有产品可以修改价格。")
+            return False
+        if depth is None:
+            depth = random.choice(NESTED_SAVEPOINT_DEPTHS)
+
+        self.last_error = None
+        self.commit_in_flight = False
+        self.last_write = None
+        self.last_nested_depth = depth
+        self.last_nested_written = 0
+        self.last_nested_rollbacks = 0
+        conn = None
+        try:
+            conn = db_pool.getconn(autocommit=False)
+            cur = conn.cursor()
+            for level in range(1, depth + 1):
+                cur.execute(f"SAVEPOINT sp_{level};")
+                product_id = random.choice(self.existing_product_ids)
+                self.unledgered_writes.append(('unledgered_price_write', product_id))
+                if self._change_price_step(cur, product_id) is not None:
+                    self.last_nested_written += 1
+            for level in range(depth, 0, -1):
+                if random.random() < rollback_ratio:
+                    cur.execute(f"ROLLBACK TO SAVEPOINT sp_{level};")
+                    self.last_nested_rollbacks += 1
+                cur.execute(f"RELEASE SAVEPOINT sp_{level};")
+
+            self.commit_in_flight = True
+            conn.commit()
+            log.debug("保存点嵌套改价完成，深度 %s，回滚 %s 层。", depth, self.last_nested_rollbacks)
+            return True
+
+        except backend.Error as e:
+            self.last_error = e
+            log.error("保存点嵌套改价时出错（深度 %s）: %s", depth, e)
+            if conn and not conn.closed:
                 conn.rollback()
-                print("事务已回滚。") # Transaction rolled back.
+                log.error("事务已回滚。")
             return False
         finally:
             if conn:
-                conn.close()
+                db_pool.putconn(conn)
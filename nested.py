@@ -0,0 +1,98 @@
+import argparse
+import json
+import time
+
+from backends import get_backend
+from metrics import WorkloadStats
+from multiple import MultiTableOperations
+from settings import (
+    NESTED_SAVEPOINT_DEPTHS,
+    NESTED_ROLLBACK_RATIO,
+    NESTED_TRANSACTIONS_PER_DEPTH
+)
+
+# 保存点嵌套开销基准：对每个深度串行执行 NESTED_TRANSACTIONS_PER_DEPTH 个
+# MultiTableOperations.nested_savepoint_price_update，记录延迟分布和每个事务生成的 WAL 字节数。
+# 串行执行时，前后两次 WAL 插入位置之差就是这一组事务生成的 WAL（另有少量后台进程写入）。
+# PostgreSQL 每个后端最多缓存 SUBXID_CACHE_SIZE 个子事务 ID，同时打开的已写入层数超过后进入子事务溢出状态。
+# 溢出拖慢的是其他并发会话的快照和可见性判断，这里只有一个串行会话，测不到这部分开销，只报告延迟和 WAL
+# 随深度的变化，以及每个深度中有多少事务溢出（只计实际写入的层，商品已被删除的层不分配子事务 ID）；
+# 溢出对其他会话的影响需要把 nested_savepoint_multi_table 混入并发负载（TRANSACTION_RATIOS）观察。
+
+SUBXID_CACHE_SIZE = 64
+
+
+def run_nested_benchmark(depths=NESTED_SAVEPOINT_DEPTHS, transactions=NESTED_TRANSACTIONS_PER_DEPTH,
+                         rollback_ratio=NESTED_ROLLBACK_RATIO):
+    backend = get_backend()
+    multi_ops = MultiTableOperations()
+    results = []
+    conn = backend.connect(autocommit=True)
+    try:
+        cur = conn.cursor()
+        for depth in depths:
+            stats = WorkloadStats()
+            rollbacks = 0
+            overflowed = 0
+            wal_start = backend.wal_lsn(cur)
+            stats.start()
+            for _ in range(transactions):
+                start = time.monotonic_ns()
+                ok = multi_ops.nested_savepoint_price_update(depth=depth, rollback_ratio=rollback_ratio)
+                stats.record('nested', time.monotonic_ns() - start, ok=ok)
+                rollbacks += multi_ops.last_nested_rollbacks
+                if multi_ops.last_nested_written > SUBXID_CACHE_SIZE:
+                    overflowed += 1
+            stats.stop()
+            wal_end = backend.wal_lsn(cur)
+
+            row = stats.summary().get('nested', {})
+            result = {
+                'depth': depth,
+                'transactions': row.get('count', 0),
+                'failed': row.get('errors', 0),
+                'rolled_back_levels': rollbacks,
+                'tps': row.get('tps', 0.0),
+                'mean_ms': row.get('mean_ms', 0.0),
+                'p50_ms': row.get('p50_ms', 0.0),
+                'p99_ms': row.get('p99_ms', 0.0),
+                'wal_bytes_per_trx': None,
+                'subxid_overflow_transactions': overflowed,
+            }
+            if wal_start is not None and wal_end is not None and transactions:
+                result['wal_bytes_per_trx'] = (wal_end - wal_start) / transactions
+            results.append(result)
+            print(f"深度 {depth}: 完成 {result['transactions']} 个事务，p50 {result['p50_ms']:.2f} 毫秒。")
+    finally:
+        conn.close()
+    return results
+
+
+def print_nested_report(results):
+    print("\n--- 保存点嵌套开销 ---")
+    print(f"{'深度':>6}{'次数':>8}{'失败':>6}{'回滚层数':>10}{'TPS':>10}{'mean(ms)':>10}{'p50(ms)':>10}"
+          f"{'p99(ms)':>10}{'WAL/事务(B)':>14}{'子事务溢出事务':>14}")
+    for r in results:
+        wal = f"{r['wal_bytes_per_trx']:.0f}" if r['wal_bytes_per_trx'] is not None else '-'
+        print(f"{r['depth']:>6}{r['transactions']:>8}{r['failed']:>6}{r['rolled_back_levels']:>10}{r['tps']:>10.1f}"
+              f"{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{wal:>14}"
+              f"{r['subxid_overflow_transactions']:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量不同保存点嵌套深度下的事务延迟和 WAL 量。")
+    parser.add_argument('--depths', type=int, nargs='+', default=NESTED_SAVEPOINT_DEPTHS)
+    parser.add_argument('--transactions', type=int, default=NESTED_TRANSACTIONS_PER_DEPTH, help="每个深度执行的事务数")
+    parser.add_argument('--rollback-ratio', type=float, default=NESTED_ROLLBACK_RATIO)
+    parser.add_argument('--output', help="把结果以 JSON 写入该文件")
+    args = parser.parse_args()
+
+    results = run_nested_benchmark(args.depths, args.transactions, args.rollback_ratio)
+    print_nested_report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import bisect
+import ctypes
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+
+# 所有工作进程共享的订单号分配器和存活订单号登记表。
+#
+# 分配：运行期新订单号 = code_base + k * num_workers + worker_id（k 为该工作器第 k 次分配），
+# code_base 大于运行开始时表中已有的最大订单号，因此不同工作器之间、与已有数据之间都不会冲突。
+#
+# 登记：每个订单号对应共享内存中的一个槽位，live[slot] 表示该订单是否存在。
+# 初始订单号排序后存放在前 seed_count 个槽位（按二分查找定位），运行期订单号的槽位由编号直接算出。
+# 随机选取时在已使用的槽位范围内随机抽样并跳过已删除的槽位，期望 O(1)。
+# 每个工作器只写自己的计数器，删除时按槽位分段加锁，保证同一订单只会被一个工作器删除。
+# 每个工作器的运行期订单号最多 capacity_per_worker 个，超出容量的订单仍会插入数据库，但不再登记，
+# 之后的查询/更新/删除选不到它们；第一次超出时打印警告。
+
+MAX_CHOICE_ATTEMPTS = 64
+
+
+class SharedOrderRegistry:
+    def __init__(self, seed_codes, code_base, num_workers, capacity_per_worker, lock_stripes=64):
+        seed = sorted(set(seed_codes))
+        if seed and code_base <= seed[-1]:
+            raise ValueError("code_base 必须大于所有已有订单号。")
+        self.seed_count = len(seed)
+        self.code_base = code_base
+        self.num_workers = num_workers
+        self.capacity_per_worker = capacity_per_worker
+        self.slot_count = self.seed_count + num_workers * capacity_per_worker
+
+        self._seed_codes = RawArray('q', seed)
+        self._live = RawArray('b', self.slot_count)
+        ctypes.memset(ctypes.addressof(self._live), 1, self.seed_count)
+        self._allocated = RawArray('q', num_workers)
+        self._inserted = RawArray('q', num_workers)
+        self._deleted = RawArray('q', num_workers)
+        self._overflowed = RawArray('b', num_workers)
+        self._locks = [Lock() for _ in range(lock_stripes)]
+
+    def allocate(self, worker_id):
+        k = self._allocated[worker_id]
+        self._allocated[worker_id] = k + 1
+        return self.code_base + k * self.num_workers + worker_id
+
+    def _slot(self, code):
+        if code >= self.code_base:
+            seq = code - self.code_base
+            slot = self.seed_count + seq
+            return slot if slot < self.slot_count else None
+        i = bisect.bisect_left(self._seed_codes, code, 0, self.seed_count)
+        if i < self.seed_count and self._seed_codes[i] == code:
+            return i
+        return None
+
+    def _code(self, slot):
+        if slot < self.seed_count:
+            return self._seed_codes[slot]
+        return self.code_base + (slot - self.seed_count)
+
+    def add(self, code, worker_id):
+        slot = self._slot(code)
+        if slot is None:
+            if code >= self.code_base and not self._overflowed[worker_id]:
+                self._overflowed[worker_id] = 1
+                print(f"工作器 {worker_id}: 新订单数超过订单号登记容量 {self.capacity_per_worker}，"
+                      f"之后插入的订单不再参与查询/更新/删除。")
+            return False
+        self._live[slot] = 1
+        self._inserted[worker_id] += 1
+        return True
+
+    def discard(self, code, worker_id):
+        slot = self._slot(code)
+        if slot is None:
+            return False
+        with self._locks[slot % len(self._locks)]:
+            if not self._live[slot]:
+                return False
+            self._live[slot] = 0
+        self._deleted[worker_id] += 1
+        return True
+
+    def choice(self, rng):
+        upper = min(self.seed_count + max(self._allocated) * self.num_workers, self.slot_count)
+        if upper == 0:
+            return None
+        live = self._live
+        for _ in range(MAX_CHOICE_ATTEMPTS):
+            slot = rng.randrange(upper)
+            if live[slot]:
+                return self._code(slot)
+        return None
+
+    def __contains__(self, code):
+        slot = self._slot(code)
+        return slot is not None and bool(self._live[slot])
+
+    def __len__(self):
+        return self.seed_count + sum(self._inserted) - sum(self._deleted)
+
+    def view(self, worker_id):
+        return WorkerOrderCodes(self, worker_id)
+
+
+class WorkerOrderCodes:
+    # 绑定到某个工作器的登记表视图，接口与 IndexedSet 一致，可直接替换 existing_order_codes
+    def __init__(self, registry, worker_id):
+        self.registry = registry
+        self.worker_id = worker_id
+
+    def allocate(self):
+        return self.registry.allocate(self.worker_id)
+
+    def add(self, code):
+        return self.registry.add(code, self.worker_id)
+
+    def discard(self, code):
+        return self.registry.discard(code, self.worker_id)
+
+    def choice(self, rng):
+        return self.registry.choice(rng)
+
+    def __contains__(self, code):
+        return code in self.registry
+
+    def __len__(self):
+        return len(self.registry)
@@ -0,0 +1,69 @@
+import re
+
+import psycopg2
+import psycopg2.errors
+
+from backends import get_backend
+from settings import USE_PREPARED_STATEMENTS
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+def to_numbered_placeholders(sql):
+    # 把 psycopg2 的 %s 占位符依次改写为服务端 PREPARE 使用的 $1, $2, ...
+    counter = iter(range(1, 1000))
+    return _PLACEHOLDER.sub(lambda _: f"${next(counter)}", sql)
+
+
+class StatementRegistry:
+    # 热点语句在每个连接上只 PREPARE 一次，之后用 EXECUTE 执行，省去每次的解析和规划。
+    # 已准备的语句按 (连接, 后端进程号) 记录：故障恢复或连接池重连后后端进程号变化，会自动重新 PREPARE。
+    def __init__(self, enabled=USE_PREPARED_STATEMENTS):
+        # 只有 PostgreSQL 后端支持 PREPARE/EXECUTE，其他后端直接执行原语句
+        self.enabled = enabled and get_backend().supports_prepared
+        self._prepare_sql = {}
+        self._execute_sql = {}
+        self._prepared = {}  # id(conn) -> (backend_pid, {已准备的语句名})
+
+    def _register(self, name, sql):
+        body = sql.strip().rstrip(';')
+        param_count = len(_PLACEHOLDER.findall(body))
+        self._prepare_sql[name] = f"PREPARE {name} AS {to_numbered_placeholders(body)};"
+        if param_count:
+            self._execute_sql[name] = f"EXECUTE {name} ({', '.join(['%s'] * param_count)});"
+        else:
+            self._execute_sql[name] = f"EXECUTE {name};"
+
+    def _prepared_names(self, conn):
+        backend_pid = conn.get_backend_pid()
+        entry = self._prepared.get(id(conn))
+        if entry is None or entry[0] != backend_pid:
+            entry = self._prepared[id(conn)] = (backend_pid, set())
+        return entry[1]
+
+    def execute(self, cur, name, sql, args=None):
+        if not self.enabled:
+            cur.execute(sql, args)
+            return
+        if name not in self._execute_sql:
+            self._register(name, sql)
+        prepared = self._prepared_names(cur.connection)
+        # 预编译语句属于会话，不随事务回滚；服务端状态与记录不一致时（例如会话执行过 DEALLOCATE / DISCARD ALL，
+        # 或记录丢失而会话中仍有同名语句），修正记录后抛出，下次使用时即可恢复
+        try:
+            if name not in prepared:
+                cur.execute(self._prepare_sql[name])
+                prepared.add(name)
+            cur.execute(self._execute_sql[name], args)
+        except psycopg2.errors.InvalidSqlStatementName:
+            prepared.discard(name)
+            raise
+        except psycopg2.errors.DuplicatePreparedStatement:
+            prepared.add(name)
+            raise
+
+    def forget(self, conn):
+        self._prepared.pop(id(conn), None)
+
+
+statement_registry = StatementRegistry()
@@ -0,0 +1,245 @@
+import queue
+import time
+
+from backends import get_backend
+from metrics import throughput_recovery
+from wal_stats import MB, sample_wal, wal_since_checkpoint
+from settings import (
+    HEARTBEAT_INTERVAL,
+    RECOVERY_POLL_INTERVAL,
+    RECOVERY_TIMEOUT,
+    TPS_RECOVERY_PERCENT,
+    TPS_BASELINE_WINDOW,
+    WAL_STATS_ENABLED
+)
+
+# 故障恢复时间线。每次注入记录：kill、发出启动命令、pg_ctl 返回、postmaster 启动（服务端
+# pg_postmaster_start_time()）、首次连接成功、首次读成功、首次写提交，全部为 time.time() 秒，
+# 报告中换算为相对 kill 的毫秒数。
+# 心跳写入进程每 HEARTBEAT_INTERVAL 秒在 "Heartbeat" 表提交一行；故障前最后一次提交到恢复后
+# 第一次提交之间的间隔就是客户端感知到的不可用时间，精度为心跳间隔。
+# 开启 WAL_STATS_ENABLED 时，kill 前的 WAL 采样（由协调器或调用方取得，见 fault_injector）随 kill 时间一起放入队列，
+# 报告中给出 kill 时距上次检查点的 WAL 量，即崩溃恢复需要重放的量。
+
+TIMELINE_EVENTS = [
+    ('kill', "kill"),
+    ('start_issued', "发出启动命令"),
+    ('start_returned', "pg_ctl 返回"),
+    ('postmaster_start', "postmaster 启动"),
+    ('first_connection', "首次连接成功"),
+    ('first_read', "首次读成功"),
+    ('first_write', "首次写提交"),
+    ('heartbeat_last_before', "心跳最后一次提交（故障前）"),
+    ('heartbeat_first_after', "心跳首次提交（恢复后）"),
+]
+
+HEARTBEAT_WAIT = 5.0  # 恢复后等待心跳进程报告中断区间的最长时间（秒）
+
+
+def _connect(db_config):
+    return get_backend().connect(db_config, autocommit=True, connect_timeout=2)
+
+
+def ensure_heartbeat_table(db_config):
+    conn = _connect(db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(get_backend().heartbeat_table_sql())
+            cur.execute(get_backend().truncate_sql("Heartbeat"))
+    finally:
+        conn.close()
+
+
+def heartbeat_writer(db_config, stop_event, outage_queue, interval=HEARTBEAT_INTERVAL):
+    # 每次中断恢复后向 outage_queue 放入 (故障前最后一次提交时间, 故障前最后确认的 seq, 恢复后首次提交时间)
+    try:
+        ensure_heartbeat_table(db_config)
+    except get_backend().Error as e:
+        print(f"心跳表初始化失败，心跳写入停止: {e}")
+        return
+    conn = None
+    seq = 0
+    last_ok = None
+    last_ok_seq = None
+    outage_start = None
+    while not stop_event.is_set():
+        try:
+            if conn is None:
+                conn = _connect(db_config)
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO \"Heartbeat\" (source, seq, writer_time) VALUES ('heartbeat', %s, CURRENT_TIMESTAMP);",
+                            (seq + 1,))
+            now = time.time()
+            seq += 1
+            if outage_start is not None:
+                outage_queue.put((outage_start[0], outage_start[1], now))
+                outage_start = None
+            last_ok, last_ok_seq = now, seq
+        except get_backend().Error:
+            if conn is not None:
+                conn.close()
+            conn = None
+            if outage_start is None and last_ok is not None:
+                outage_start = (last_ok, last_ok_seq)
+        stop_event.wait(interval)
+    if conn is not None:
+        conn.close()
+
+
+class RecoveryTimeline:
+    def __init__(self, label):
+        self.label = label
+        self.events = {}
+        self.recovered = False
+        self.lost_heartbeats = None
+        self.baseline_tps = None
+        self.tps_recovery_percent = None
+        self.tps_recovery_time = None
+        self.wal_at_kill = None
+        self.wal_after_recovery = None
+        self.violations = None  # 恢复后一致性检查的违反列表，未检查时为 None
+
+    def mark(self, event, at=None):
+        if event not in self.events:
+            self.events[event] = time.time() if at is None else at
+
+    def elapsed(self, start_event, end_event):
+        if start_event not in self.events or end_event not in self.events:
+            return None
+        return self.events[end_event] - self.events[start_event]
+
+    @property
+    def started(self):
+        return 'start_returned' in self.events
+
+    @property
+    def recovery_time(self):
+        # 与旧版本含义一致：从发出启动命令到首次连接成功
+        return self.elapsed('start_issued', 'first_connection')
+
+    @property
+    def unavailable_time(self):
+        return self.elapsed('heartbeat_last_before', 'heartbeat_first_after')
+
+    def measure_throughput_recovery(self, stats, percent=TPS_RECOVERY_PERCENT, baseline_window=TPS_BASELINE_WINDOW):
+        # 工作器统计按 time.monotonic() 分桶，kill 时间是 time.time()，在同一台机器上换算
+        if 'kill' not in self.events:
+            return
+        fault_time = self.events['kill'] - (time.time() - time.monotonic())
+        self.baseline_tps, self.tps_recovery_time = throughput_recovery(stats, fault_time, percent, baseline_window)
+        self.tps_recovery_percent = percent
+
+    def print_report(self):
+        origin = 'kill' if 'kill' in self.events else 'start_issued'
+        print(f"\n恢复时间线 [{self.label}]（相对 {origin}，毫秒）:")
+        for event, title in TIMELINE_EVENTS:
+            offset = self.elapsed(origin, event)
+            if offset is not None:
+                print(f"  {offset * 1000:>10.1f}  {title}")
+        if self.unavailable_time is not None:
+            print(f"  客户端不可用时间（心跳）: {self.unavailable_time * 1000:.1f} 毫秒")
+        if self.lost_heartbeats is not None:
+            print(f"  已确认但恢复后丢失的心跳提交: {self.lost_heartbeats}")
+        if self.baseline_tps:
+            if self.tps_recovery_time is not None:
+                print(f"  基线 TPS {self.baseline_tps:.1f}，kill 后 {self.tps_recovery_time:.2f} 秒回到基线的 "
+                      f"{self.tps_recovery_percent:g}%")
+            else:
+                print(f"  基线 TPS {self.baseline_tps:.1f}，运行结束前未回到基线的 {self.tps_recovery_percent:g}%")
+        wal = wal_since_checkpoint(self.wal_at_kill)
+        if wal is not None:
+            age = self.wal_at_kill['time'] - self.wal_at_kill['checkpoint_time']
+            line = f"  kill 时距上次检查点 {age:.1f} 秒、WAL {wal / MB:.1f} MB"
+            if self.recovery_time:
+                line += f"，按恢复时间折算 {wal / MB / self.recovery_time:.1f} MB/秒"
+            print(line)
+        if not self.recovered:
+            print("  数据库未在超时时间内完成恢复。")
+
+
+def wait_for_recovery(timeline, db_config, timeout=RECOVERY_TIMEOUT, poll_interval=RECOVERY_POLL_INTERVAL):
+    deadline = time.monotonic() + timeout
+    conn = None
+    while time.monotonic() < deadline:
+        try:
+            if conn is None:
+                conn = _connect(db_config)
+                timeline.mark('first_connection')
+            with conn.cursor() as cur:
+                if 'first_read' not in timeline.events:
+                    postmaster_start = get_backend().probe_read(cur)
+                    timeline.mark('first_read')
+                    if postmaster_start is not None:
+                        timeline.mark('postmaster_start', postmaster_start)
+                # 心跳关闭、心跳进程建表之前就被 kill、或实验数据库由模板重建时都可能还没有心跳表
+                cur.execute(get_backend().heartbeat_table_sql())
+                cur.execute("INSERT INTO \"Heartbeat\" (source, seq, writer_time) VALUES ('probe', 0, CURRENT_TIMESTAMP);")
+                timeline.mark('first_write')
+            conn.close()
+            timeline.recovered = True
+            return True
+        except get_backend().Error:
+            if conn is not None:
+                conn.close()
+            conn = None
+            time.sleep(poll_interval)
+    return False
+
+
+def _latest_fault(fault_queue):
+    # 队列中的每一项为 (kill 时间, kill 前的 WAL 采样或 None)
+    fault = (None, None)
+    while True:
+        try:
+            fault = fault_queue.get_nowait()
+        except queue.Empty:
+            return fault
+
+
+def _attach_heartbeat_outage(timeline, db_config, outage_queue):
+    kill_time = timeline.events.get('kill')
+    deadline = time.monotonic() + HEARTBEAT_WAIT
+    while time.monotonic() < deadline:
+        try:
+            last_ok, last_ok_seq, first_ok = outage_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            return
+        # 只采用覆盖本次 kill 的中断区间，忽略心跳进程遇到的其他短暂错误
+        if kill_time is not None and not last_ok <= kill_time <= first_ok:
+            continue
+        timeline.mark('heartbeat_last_before', last_ok)
+        timeline.mark('heartbeat_first_after', first_ok)
+        try:
+            conn = _connect(db_config)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT COUNT(DISTINCT seq) FROM \"Heartbeat\" WHERE source = 'heartbeat' AND seq <= %s;",
+                                (last_ok_seq,))
+                    timeline.lost_heartbeats = last_ok_seq - cur.fetchone()[0]
+            finally:
+                conn.close()
+        except get_backend().Error as e:
+            print(f"检查心跳提交失败: {e}")
+        return
+
+
+def measure_recovery(label, db_config, pg_data_dir, start_database, fault_queue=None, outage_queue=None,
+                     timeout=RECOVERY_TIMEOUT, fault=None):
+    # 启动数据库并以毫秒精度记录恢复各阶段，返回 RecoveryTimeline，由调用方在运行报告中打印。
+    # fault 为已经从 fault_queue 取出的 (kill 时间, WAL 采样)，不给出时从 fault_queue 取最近一次
+    timeline = RecoveryTimeline(label)
+    if fault is None and fault_queue is not None:
+        fault = _latest_fault(fault_queue)
+    if fault is not None:
+        kill_time, timeline.wal_at_kill = fault
+        if kill_time is not None:
+            timeline.mark('kill', kill_time)
+    timeline.mark('start_issued')
+    if start_database(pg_data_dir):
+        timeline.mark('start_returned')
+        if wait_for_recovery(timeline, db_config, timeout):
+            if outage_queue is not None:
+                _attach_heartbeat_outage(timeline, db_config, outage_queue)
+            if WAL_STATS_ENABLED:
+                timeline.wal_after_recovery = sample_wal(db_config)
+    return timeline
@@ -2,10 +2,32 @@
 K_WORKERS = 5  # 并发工作器数目
 NUM_TRANSACTIONS_PER_WORKER = 2000  # 每个工作器执行的事务数
 
+# 负载生成方式
+# 'closed': 闭环，每个工作器完成一个事务后等待 THINK_TIME 秒再发起下一个（旧行为）
+# 'open': 开环，按目标 TPS 预先排定每个事务的开始时间，延迟从预定开始时间算起
+LOAD_MODE = 'closed'
+THINK_TIME = 0.01  # 闭环模式下两个事务之间的等待时间（秒）
+TARGET_TPS = 500  # 开环模式下所有工作器合计的目标 TPS
+ARRIVAL_PROCESS = 'poisson'  # 开环到达过程: 'constant' 固定间隔, 'poisson' 泊松到达, 'step' 按 ARRIVAL_STEPS 分阶段
+ARRIVAL_STEPS = [(10, 200), (10, 500), (10, 1000)]  # step 模式的阶段列表: (持续秒数, 合计 TPS)
+
+# 执行引擎
+# 'process_pool': 每个客户端一个进程（psycopg2）; 'asyncio': 每个进程一个事件循环，K_WORKERS 个客户端以协程运行（asyncpg）
+EXECUTOR = 'process_pool'
+ASYNC_PROCESSES = 4  # asyncio 引擎的事件循环进程数，一般设为 CPU 核数
+ASYNC_POOL_MAX_SIZE = 200  # asyncio 引擎每个进程最多使用的数据库连接数
+
 # 长事务相关参数
 LONG_TRANSACTION_ITERATIONS = 1000 # 长事务循环次数
 FAULT_INJECTION_ITERATION = 998 # 故障注入发生的迭代次数
 
+# 订单号分配：True 时所有工作器共享一个无冲突的订单号分配器和存活订单号登记表（共享内存），
+# False 时每个工作器各自维护订单号集合并随机生成订单号（旧行为）
+SHARED_ORDER_REGISTRY = True
+# 每个工作器可登记的新订单数按实际运行的事务数 ×（SERIALIZATION_RETRIES + 1）计算（每次尝试分配一个订单号）；
+# 运行到故障计划结束（FAULT_SCHEDULE_UNTIL_DONE）时事务数没有上限，使用下面的固定容量，超出后新订单不再登记并打印警告
+ORDER_CODE_CAPACITY_UNBOUNDED = 1000000
+
 # 故障注入相关参数
 FIRST_INJECTION_TRANSACTIONS = 5000  # 第一个故障注入的事务数
 SECOND_INJECTION_TRANSACTIONS = 2000 # 第二个故障注入的事务数（用于两阶段注入）
@@ -19,6 +41,10 @@ SECOND_INJECTION_TIME = FIRST_INJECTION_TIME / 2   # 第二个故障注入的时
 # ‘long_fault','none'
 FAULT_MODE = 'multi_table_price_fault_injection'
 
+# 多表事务和长事务中受影响订单 payment 的重算方式
+# 'per_order': 每个订单一条 SELECT SUM + 一条 UPDATE; 'set_based': 一条 UPDATE ... FROM (... GROUP BY) 重算全部
+PAYMENT_RECOMPUTE_MODE = 'per_order'
+
 # 不同事务类型的比例，百分比，总和应为100
 TRANSACTION_RATIOS = {
     'insert': 40,
@@ -26,10 +52,141 @@ TRANSACTION_RATIOS = {
     'update': 10,
     'delete': 10,
     'delete_product_multi_table': 10,
-    'modify_product_price_multi_table': 10
+    'modify_product_price_multi_table': 10,
+    'nested_savepoint_multi_table': 0  # 保存点嵌套的改价事务，见 NESTED_*
 }
 
 # 基础数据量设置  
 BASE_NUM_USERS = 10  # 用户数目
 BASE_NUM_PRODUCTS = BASE_NUM_USERS * 20  # 商品数目
-BASE_NUM_ORDERS = BASE_NUM_USERS * 40  # 订单数目
\ No newline at end of file
+BASE_NUM_ORDERS = BASE_NUM_USERS * 40  # 订单数目
+
+# 批量加载设置
+DATA_LOAD_MODE = 'copy'  # 'copy': 内存中生成数据并通过 COPY FROM STDIN 分块加载; 'row': 逐行 INSERT（旧方式）
+SCALE_FACTOR = 1  # 数据规模因子，copy 模式下加载 BASE_NUM_* × SCALE_FACTOR 条用户/商品/订单
+BULK_LOAD_CHUNK_ORDERS = 50000  # copy 模式每个分块生成的订单数（订单项随之生成）
+
+# 连接池设置（每个进程一个连接池，DBConn、MultiTableOperations、long.py 共用）
+POOL_ENABLED = True  # False 时每次取连接都新建物理连接，用于对比有无连接池的吞吐量
+POOL_MIN_CONNECTIONS = 1  # 连接池创建时预先建立的连接数
+POOL_MAX_CONNECTIONS = 4  # 每个进程最多同时使用的连接数
+POOL_HEALTH_CHECK_IDLE = 5.0  # 连接空闲超过该秒数后，取出时先执行 SELECT 1 检查
+
+# 服务端预编译语句：CRUD 事务和订单金额重算语句在每个连接上 PREPARE 一次，之后通过 EXECUTE 执行
+USE_PREPARED_STATEMENTS = False
+
+# 日志设置
+LOG_LEVEL = 'INFO'  # 日志级别: 'DEBUG', 'INFO', 'WARNING', 'ERROR'
+LOG_OUTPUT = 'file'  # 'file': 写入每个进程的内存环形缓冲区，由后台线程批量写入文件; 'stdout': 直接打印（旧行为）
+LOG_BENCHMARK_MODE = False  # 基准测试模式：只记录 ERROR，热路径上不做任何字符串格式化
+LOG_DIR = 'logs'  # 日志文件目录，每个进程一个文件
+LOG_BUFFER_SIZE = 100000  # 每个进程环形缓冲区的容量（条），写满后丢弃最旧的记录
+LOG_FLUSH_INTERVAL = 0.5  # 后台线程批量刷盘的间隔（秒）
+
+# 吞吐量时间线（替代原来每 2 秒一次的 COUNT(*) 计数日志）
+THROUGHPUT_SAMPLE_INTERVAL = 0.2  # 采样间隔（秒）
+THROUGHPUT_PRINT_INTERVAL = 2.0  # 控制台打印间隔（秒）
+THROUGHPUT_TIMELINE_DIR = 'logs'  # 时间线 CSV 目录
+
+# 恢复时间线
+HEARTBEAT_ENABLED = True  # 运行期间由独立进程持续向 "Heartbeat" 表提交心跳，测量客户端感知的不可用时间
+HEARTBEAT_INTERVAL = 0.005  # 心跳提交间隔（秒）
+RECOVERY_POLL_INTERVAL = 0.005  # 重启后探测连接、读、写的轮询间隔（秒）
+RECOVERY_TIMEOUT = 60  # 等待数据库恢复的最长时间（秒）
+
+# 故障期间工作器的重连和重试
+RECONNECT_BASE_DELAY = 0.01  # 重连退避的初始上限（秒），每次失败翻倍，实际等待在 0 到上限之间随机
+RECONNECT_MAX_DELAY = 0.5  # 单次重连等待的上限（秒）
+RECONNECT_GIVE_UP_AFTER = 120  # 累计等待超过该时间（秒）仍未连上则工作器停止
+SERIALIZATION_RETRIES = 3  # 序列化失败/死锁时同一事务的重试次数
+TPS_RECOVERY_PERCENT = 90  # 报告故障后吞吐回到基线 TPS 该百分比所用的时间
+TPS_BASELINE_WINDOW = 10  # 基线 TPS 取故障前多少秒的平均值
+
+# 恢复后的一致性检查（verifier.py）
+VERIFY_PROCESSES = 4  # 并行执行检查的进程数
+VERIFY_RANGES_PER_PROCESS = 4  # 每项检查按键范围切分为 VERIFY_PROCESSES * VERIFY_RANGES_PER_PROCESS 个任务
+VERIFY_MAX_VIOLATIONS = 1000  # 每项检查最多返回的违反条数
+
+# 客户端提交账本（ledger.py）
+LEDGER_ENABLED = True  # 工作器把写事务的结果追加到各自的账本文件，运行结束后与数据库对账
+LEDGER_DIR = 'logs/ledger'  # 账本文件目录，每个工作器一个文件
+LEDGER_INITIAL_RECORDS = 65536  # 账本文件初始容量（条），写满后翻倍
+LEDGER_FLUSH_EVERY = 1024  # 每写入多少条记录 msync 一次
+
+# 数据库后端（backends.py）
+# 'postgresql': psycopg2 连接，pg_ctl 启动，pkill 注入故障（旧行为）
+# 'sqlite': 本机单文件数据库，用于没有 PostgreSQL 服务器时在本地运行同样的负载和故障模式
+# 'postgresql_local': 在临时目录 initdb 一个本机集群并在空闲端口启动，kill 只作用于该集群（ephemeral_pg.py）
+DB_BACKEND = 'postgresql'
+SQLITE_PATH = 'data/bench.sqlite3'  # sqlite 后端的数据库文件
+SQLITE_BUSY_TIMEOUT = 5000  # sqlite 后端等待写锁的最长时间（毫秒），超时按序列化失败重试
+
+# 保存点（嵌套事务）负载：nested_savepoint_multi_table 事务和 nested.py 基准
+# 每一层 SAVEPOINT 内执行一次多表改价（Product、OrderItem、受影响订单的 payment），由内向外逐层结束
+NESTED_SAVEPOINT_DEPTHS = [1, 2, 4, 8, 16, 32, 64, 65, 128]  # 负载中每个事务随机取一个深度；nested.py 依次测量每个深度
+NESTED_ROLLBACK_RATIO = 0.1  # 每层结束时 ROLLBACK TO 该保存点的概率（同时撤销更内层的修改）
+NESTED_TRANSACTIONS_PER_DEPTH = 200  # nested.py 每个深度执行的事务数
+
+# 长事务形状（long.py），用于测量恢复/回滚时间与未提交工作量的关系
+LONG_COMMIT_EVERY = 0  # 每 N 次循环提交一次，0 表示所有循环在同一个事务中、最后才提交（旧行为）
+LONG_RECOMPUTE_MODE = PAYMENT_RECOMPUTE_MODE  # 长事务每次循环中订单金额的重算方式，取值同 PAYMENT_RECOMPUTE_MODE
+LONG_WAL_BUDGET_MB = None  # 长事务开始以来生成的 WAL 达到该值（MB）时停止循环，None 表示不限，只支持 PostgreSQL
+LONG_DURATION_BUDGET = None  # 长事务运行达到该秒数时停止循环，None 表示不限
+LONG_FAULT_ON_BUDGET = False  # True 时达到预算后注入故障而不是提交，此时未提交的工作量就是预算
+LONG_CONCURRENT_TRANSACTIONS = 1  # long_fault 模式下同时运行的长事务数，各自更新不同的商品，只有工作器 0 注入故障；不能超过 K_WORKERS
+
+# WAL 统计（wal_stats.py）：故障模式在运行开始/结束、每次 kill 前和恢复后采样 WAL 位置、检查点 redo 位置和 pg_stat_wal
+WAL_STATS_ENABLED = True
+WAL_RECOVERY_LOG = 'logs/wal_recovery.csv'  # 每次故障 kill 时距检查点的 WAL 量和恢复时间，跨运行累积，用于拟合恢复时间
+WAL_PROFILE_TRANSACTIONS = 200  # wal_profile.py 串行测量每种事务类型时执行的事务数
+WAL_STATS_FLUSH_WAIT = 1.5  # 读取 pg_stat_wal 前等待后端上报累计统计的秒数
+
+# 检查点感知的故障触发，取代 single_injection 的事务数触发和 two_phase_injection 的时间触发
+# 'default': 原有触发方式; 'wal_since_checkpoint': 距上次检查点的 WAL 达到 CHECKPOINT_TRIGGER_WAL_MB 时 kill;
+# 'after_checkpoint': 检查点完成后立即 kill（需要重放的 WAL 最少）; 'before_checkpoint': 检查点进行中、完成之前 kill（需要重放的 WAL 最多），
+# 服务端没有 pg_stat_progress_checkpoint 时只能按检查点进程的等待事件估计，需要确定触发时设置 CHECKPOINT_FORCE
+# 只支持 PostgreSQL
+FAULT_TRIGGER = 'default'
+CHECKPOINT_TRIGGER_WAL_MB = 64
+CHECKPOINT_FORCE = False  # True 时先执行一次 CHECKPOINT 作为已知起点；after/before_checkpoint 由这次 CHECKPOINT 触发，不等待后台检查点
+CHECKPOINT_FORCE_DELAY = 5  # 故障监控启动后等待多少秒再执行 CHECKPOINT
+CHECKPOINT_POLL_INTERVAL = 0.05  # 检查 WAL 位置和检查点状态的间隔（秒）
+CHECKPOINT_TRIGGER_TIMEOUT = 600  # 超过该秒数仍未满足触发条件时直接注入故障
+
+# 故障计划（fault_schedule.py）：一次运行由触发条件和动作组成的步骤列表描述，由一个协调器在持续运行的负载上执行。
+# None 时按 FAULT_MODE 生成与原来各模式相同的计划；格式和示例见 fault_schedule.py
+FAULT_SCHEDULE = None
+FAULT_SCHEDULE_REPEAT = 1  # 整个计划重复执行的次数，用于反复崩溃的浸泡测试
+FAULT_SCHEDULE_UNTIL_DONE = False  # True 时工作器一直运行到计划执行完毕，不受 NUM_TRANSACTIONS_PER_WORKER 限制
+FAULT_SCHEDULE_POLL_INTERVAL = 0.05  # 协调器检查事务数和时间触发条件的间隔（秒）
+FAULT_STEP_TIMEOUT = 60  # 等待注入方报告 kill 的最长秒数（事务步骤触发时等待工作器执行到注入点）
+
+# 参数扫描（sweep.py）：SWEEP_MATRIX 为 settings 常量名 -> 取值列表，按笛卡尔积逐格运行，每格重复 SWEEP_REPETITIONS 次
+SWEEP_MATRIX = {
+    'K_WORKERS': [5, 10],
+}
+SWEEP_REPETITIONS = 3
+SWEEP_RESULTS = 'results/sweep.csv'  # 结果表；同名 .jsonl 保存每次运行的原始行，中断后可续跑
+SWEEP_RUN_TIMEOUT = 3600  # 单次运行的最长秒数，超时的运行记为 timeout
+
+# 本机临时 PostgreSQL 集群（DB_BACKEND = 'postgresql_local'）
+EPHEMERAL_PG_BIN = ''  # initdb / pg_ctl 所在目录，空字符串时从 PATH 查找
+EPHEMERAL_PG_ROOT = None  # 集群目录的父目录，None 时使用系统临时目录
+EPHEMERAL_PG_KEEP = False  # True 时实验结束后保留集群目录（数据和 server.log）
+EPHEMERAL_PG_START_ATTEMPTS = 3  # 端口被占用等原因启动失败时换端口重试的次数
+EPHEMERAL_PG_CONF = {  # 追加到 postgresql.conf 的设置，值按原样写入
+    'max_connections': 200,
+    'shared_buffers': "'256MB'",
+    'max_wal_size': "'2GB'",
+    'checkpoint_timeout': "'15min'",
+    'fsync': 'on',
+    'synchronous_commit': 'on',
+    'full_page_writes': 'on',
+}
+
+# 数据集重置（dataset.py）
+# 'recreate': 每次运行前删表重建并重新生成测试数据（旧行为）
+# 'template': 每种数据规模只生成一次数据集并保存为模板（PostgreSQL 为 CREATE DATABASE ... TEMPLATE，sqlite 为文件副本），
+#             之后每次运行从模板复制出实验数据库 DATASET_DATABASE
+DATASET_RESET = 'recreate'
+DATASET_DATABASE = 'bench'  # 'template' 模式下实验使用的数据库，必须与 connection.py 中配置的数据库不同
@@ -0,0 +1,280 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import settings
+
+# 参数扫描。矩阵是 settings 常量名 -> 取值列表（取值可以是数字、字符串或 TRANSACTION_RATIOS 这样的字典），
+# 按笛卡尔积得到若干格，每格重复若干次。每次运行是一个独立的子进程：子进程先改写 settings 中的常量，
+# 再导入 main_redo 执行一次完整的 Redo 测试（重建表、加载数据、运行负载和故障计划），结果展平成一行。
+# 各模块在导入时从 settings 取常量，所以覆盖只能在子进程导入它们之前完成。
+#
+# 每次运行的行追加到结果文件同名的 .jsonl，随后重写 CSV（列为所有运行的并集）；.jsonl 中已有的
+# (格, 重复) 在重新启动时跳过，中断后用同样的参数再次运行即可续跑。每次运行的标准输出写入
+# 结果目录下的 sweep_logs/。
+#
+# DB_BACKEND = 'postgresql_local' 时临时集群由扫描进程创建一次，各次运行通过环境变量连接同一个集群，
+# 数据集模板也只生成一次；扫描结束时停止集群。集群在扫描开始前创建，矩阵中的 EPHEMERAL_PG_* 不生效。
+#
+# 注意：BASE_NUM_PRODUCTS / BASE_NUM_ORDERS 在 settings 中由 BASE_NUM_USERS 计算，只覆盖
+# BASE_NUM_USERS 时它们不会跟着变化，需要一起列入矩阵。
+
+RUN_COLUMNS = ['cell', 'repetition', 'status', 'started_at', 'duration_s']
+TIMELINE_COLUMNS = ['start_issued', 'start_returned', 'postmaster_start', 'first_connection', 'first_read',
+                    'first_write']
+
+
+def load_matrix(path=None):
+    if path is None:
+        return dict(settings.SWEEP_MATRIX)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def expand_matrix(matrix):
+    unknown = [name for name in matrix if not hasattr(settings, name)]
+    if unknown:
+        raise ValueError(f"settings 中没有这些常量: {', '.join(unknown)}")
+    names = sorted(matrix)
+    return [dict(zip(names, values)) for values in itertools.product(*(matrix[name] for name in names))]
+
+
+def cell_id(overrides):
+    return json.dumps(overrides, sort_keys=True, ensure_ascii=False)
+
+
+def _param_value(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+
+
+def _round(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+
+def summarize_run(result):
+    # 把 run_fault_mode 的返回值展平成一行；连接池的 connection_* 指标不计入总体
+    from metrics import LatencyHistogram
+    from wal_stats import MB, wal_since_checkpoint
+
+    stats = result['stats']
+    summary = stats.summary()
+    elapsed = stats.elapsed()
+    row = {'total_time_s': round(result['total_time'], 3), 'elapsed_s': round(elapsed, 3)}
+
+    overall = LatencyHistogram()
+    transactions = errors = in_doubt = 0
+    for trx_type, hist in stats.histograms.items():
+        if trx_type.startswith('connection_'):
+            continue
+        overall.merge(hist)
+        transactions += summary[trx_type]['count']
+        errors += summary[trx_type]['errors']
+        in_doubt += summary[trx_type]['in_doubt']
+    row.update({
+        'transactions': transactions,
+        'errors': errors,
+        'in_doubt': in_doubt,
+        'tps': round(transactions / elapsed, 1) if elapsed > 0 else 0.0,
+    })
+    for pct in (50.0, 90.0, 99.0, 99.9):
+        row[f'p{pct:g}_ms'] = overall.percentile(pct) / 1000.0
+    row['max_ms'] = overall.max_us / 1000.0
+
+    for trx_type, values in summary.items():
+        for key, value in values.items():
+            row[f'{trx_type}.{key}'] = round(value, 3) if isinstance(value, float) else value
+    for kind, count in sorted(stats.error_kinds.items()):
+        row[f'error_kind.{kind}'] = count
+
+    timelines = result['timelines']
+    row['faults'] = len(timelines)
+    checked = [t.violations for t in timelines if t.violations is not None]
+    row['violations'] = sum(len(v) for v in checked) if checked else None
+    for i, timeline in enumerate(timelines, 1):
+        prefix = f'fault{i}.'
+        origin = 'kill' if 'kill' in timeline.events else 'start_issued'
+        row[prefix + 'label'] = timeline.label
+        row[prefix + 'recovered'] = timeline.recovered
+        for event in TIMELINE_COLUMNS:
+            offset = timeline.elapsed(origin, event)
+            row[prefix + event + '_ms'] = _round(offset * 1000, 1) if offset is not None else None
+        row[prefix + 'recovery_time_s'] = _round(timeline.recovery_time)
+        row[prefix + 'unavailable_s'] = _round(timeline.unavailable_time)
+        row[prefix + 'lost_heartbeats'] = timeline.lost_heartbeats
+        row[prefix + 'tps_recovery_s'] = _round(timeline.tps_recovery_time)
+        row[prefix + 'violations'] = len(timeline.violations) if timeline.violations is not None else None
+        wal = wal_since_checkpoint(timeline.wal_at_kill)
+        row[prefix + 'wal_since_checkpoint_mb'] = round(wal / MB, 3) if wal is not None else None
+    return row
+
+
+def _ensure_database(pg_data_dir):
+    # 上一次运行超时或失败时数据库可能仍处于关闭状态
+    from backends import get_backend
+    from connection import ADMIN_DB_CONFIG
+    from fault_mode import start_database
+
+    backend = get_backend()
+    try:
+        # 模板模式下实验数据库可能还不存在，连接管理库判断实例是否运行
+        backend.connect(ADMIN_DB_CONFIG, connect_timeout=2).close()
+    except backend.Error:
+        print("数据库不可连接，尝试启动...")
+        start_database(pg_data_dir)
+
+
+def _uses_local_cluster(overrides):
+    return overrides.get('DB_BACKEND', settings.DB_BACKEND) == 'postgresql_local'
+
+
+def _ensure_local_cluster():
+    # 创建集群并写入环境变量，子进程导入 connection 时直接连接；集群由本进程退出时停止并删除
+    import ephemeral_pg
+    from connection import ADMIN_DB_CONFIG
+
+    ephemeral_pg.ensure_cluster(ADMIN_DB_CONFIG)
+
+
+def _kill_local_cluster():
+    # 超时运行的子进程组被 kill 后，由 pg_ctl 启动的 postmaster 不在该进程组中，可能仍在运行
+    # （或被 pause 动作暂停）；直接 kill，下一次运行开始时由 _ensure_database 重新启动
+    import ephemeral_pg
+
+    try:
+        ephemeral_pg.kill_cluster()
+    except subprocess.CalledProcessError:
+        pass
+
+
+def run_cell(overrides, result_path):
+    # 子进程入口：覆盖 settings 后运行一次 Redo 测试
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    import main_redo
+
+    _ensure_database(main_redo.PG_DATA_DIR)
+    result = main_redo.run_redo_test()
+    if result is None:
+        raise RuntimeError("run_redo_test 没有返回运行结果")
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(summarize_run(result), f, ensure_ascii=False)
+
+
+def _run_subprocess(overrides, result_path, log_path, timeout):
+    cell_path = result_path + '.cell.json'
+    with open(cell_path, 'w', encoding='utf-8') as f:
+        json.dump(overrides, f, ensure_ascii=False)
+    with open(log_path, 'w', encoding='utf-8') as log:
+        # 负载进程池是子进程的子进程，超时时整个进程组一起终止
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run-cell', cell_path,
+                                    '--result', result_path],
+                                   stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            return 'timeout'
+        finally:
+            os.remove(cell_path)
+    return 'ok' if process.returncode == 0 and os.path.exists(result_path) else 'failed'
+
+
+def load_rows(jsonl_path):
+    if not os.path.exists(jsonl_path):
+        return []
+    with open(jsonl_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_csv(rows, path):
+    columns = list(RUN_COLUMNS)
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def run_sweep(matrix, repetitions=settings.SWEEP_REPETITIONS, output=settings.SWEEP_RESULTS,
+              timeout=settings.SWEEP_RUN_TIMEOUT):
+    cells = expand_matrix(matrix)
+    if any(_uses_local_cluster(overrides) for overrides in cells):
+        _ensure_local_cluster()
+    output_dir = os.path.dirname(output) or '.'
+    log_dir = os.path.join(output_dir, 'sweep_logs')
+    os.makedirs(log_dir, exist_ok=True)
+    jsonl_path = os.path.splitext(output)[0] + '.jsonl'
+    rows = load_rows(jsonl_path)
+    # 失败和超时的运行保留在结果中，续跑时重新执行
+    done = {(row['cell'], row['repetition']) for row in rows if row['status'] == 'ok'}
+    total = len(cells) * repetitions
+    print(f"参数扫描: {len(cells)} 格 × {repetitions} 次 = {total} 次运行，已完成 {len(done)} 次。")
+
+    run_index = 0
+    for repetition in range(1, repetitions + 1):
+        # 按重复次数在外层循环，每一轮把所有格都跑一遍，漂移（表膨胀、缓存、磁盘）均匀分摊到各格
+        for overrides in cells:
+            run_index += 1
+            cid = cell_id(overrides)
+            if (cid, repetition) in done:
+                continue
+            print(f"[{run_index}/{total}] 第 {repetition} 次: {cid}")
+            stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+            result_path = os.path.join(log_dir, f'run_{stamp}_{run_index}.json')
+            log_path = os.path.join(log_dir, f'run_{stamp}_{run_index}.log')
+            started_at = datetime.datetime.now().isoformat(timespec='seconds')
+            start = time.monotonic()
+            status = _run_subprocess(overrides, result_path, log_path, timeout)
+            if status == 'timeout' and _uses_local_cluster(overrides):
+                _kill_local_cluster()
+            row = {'cell': cid, 'repetition': repetition, 'status': status, 'started_at': started_at,
+                   'duration_s': round(time.monotonic() - start, 1)}
+            row.update({name: _param_value(value) for name, value in overrides.items()})
+            if status == 'ok':
+                with open(result_path, encoding='utf-8') as f:
+                    row.update(json.load(f))
+                os.remove(result_path)
+                print(f"  完成: {row['tps']} TPS, p99 {row['p99_ms']:.2f} ms, {row['faults']} 次故障，"
+                      f"用时 {row['duration_s']} 秒。")
+            else:
+                print(f"  运行{'超时' if status == 'timeout' else '失败'}，输出见 {log_path}")
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            rows.append(row)
+            write_csv(rows, output)
+    print(f"参数扫描结束，结果写入 {output}。")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按参数矩阵逐格运行 Redo 测试，把吞吐量、延迟、恢复时间线和一致性检查结果写入一个 CSV。")
+    parser.add_argument('--matrix', help="JSON 文件：settings 常量名 -> 取值列表，默认使用 SWEEP_MATRIX")
+    parser.add_argument('--repetitions', type=int, default=settings.SWEEP_REPETITIONS, help="每格重复运行的次数")
+    parser.add_argument('--output', default=settings.SWEEP_RESULTS, help="结果 CSV 路径")
+    parser.add_argument('--timeout', type=float, default=settings.SWEEP_RUN_TIMEOUT, help="单次运行的最长秒数")
+    parser.add_argument('--run-cell', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_cell:
+        with open(args.run_cell, encoding='utf-8') as f:
+            run_cell(json.load(f), args.result)
+        return
+    run_sweep(load_matrix(args.matrix), args.repetitions, args.output, args.timeout)
+
+
+if __name__ == '__main__':
+    main()
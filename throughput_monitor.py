@@ -0,0 +1,120 @@
+import csv
+import datetime
+import os
+import time
+
+from backends import get_backend
+from settings import (
+    THROUGHPUT_SAMPLE_INTERVAL,
+    THROUGHPUT_PRINT_INTERVAL,
+    THROUGHPUT_TIMELINE_DIR
+)
+
+# 低开销吞吐量时间线：每次采样只读一行 pg_stat_database 和 pg_stat_user_tables 的汇总，
+# 不扫描业务表。客户端事务计数器（工作器共享的 TransactionCounter，每个执行完的事务计一次）精确到采样间隔；服务端统计由各后端
+# 定期上报（约每秒一次），粒度较粗，两者一起记录便于对照。
+# 数据库宕机期间服务端列留空、db_up 为 0，客户端 TPS 照常记录，时间线上能看到吞吐降为零和恢复过程。
+# 崩溃恢复会清零服务端统计，计数器变小时把当前值当作增量。
+# 没有 pg_stat 统计的后端只执行 SELECT 1 判断 db_up，服务端列留空。
+
+TIMELINE_COLUMNS = [
+    'timestamp', 'elapsed_s', 'db_up',
+    'client_transactions', 'client_tps',
+    'xact_commit', 'xact_rollback', 'commit_rate', 'rollback_rate',
+    'n_tup_ins', 'n_tup_upd', 'n_tup_del', 'ins_rate', 'upd_rate', 'del_rate'
+]
+
+SERVER_COUNTERS = ['xact_commit', 'xact_rollback', 'n_tup_ins', 'n_tup_upd', 'n_tup_del']
+
+STATS_SQL = """
+    SELECT d.xact_commit, d.xact_rollback,
+           COALESCE(t.n_tup_ins, 0), COALESCE(t.n_tup_upd, 0), COALESCE(t.n_tup_del, 0)
+    FROM pg_stat_database AS d,
+         (SELECT SUM(n_tup_ins) AS n_tup_ins, SUM(n_tup_upd) AS n_tup_upd, SUM(n_tup_del) AS n_tup_del
+          FROM pg_stat_user_tables) AS t
+    WHERE d.datname = current_database();
+"""
+
+
+def timeline_path(timeline_dir=THROUGHPUT_TIMELINE_DIR):
+    os.makedirs(timeline_dir, exist_ok=True)
+    return os.path.join(timeline_dir, f"throughput_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+
+
+def _connect(db_config):
+    # 自动提交：每次采样都是新事务，pg_stat_* 不会停留在事务内的快照
+    return get_backend().connect(db_config, autocommit=True, connect_timeout=2)
+
+
+def _rate(current, previous, dt):
+    if current is None or previous is None or dt <= 0:
+        return None
+    delta = current - previous if current >= previous else current
+    return round(delta / dt, 1)
+
+
+def monitor_throughput(db_config, stop_event, transaction_counter, output_path=None,
+                       interval=THROUGHPUT_SAMPLE_INTERVAL, print_interval=THROUGHPUT_PRINT_INTERVAL):
+    output_path = output_path or timeline_path()
+    backend = get_backend()
+    conn = None
+    previous = None
+    last_print = 0.0
+    start = time.monotonic()
+    print(f"吞吐量时间线写入 {output_path}，采样间隔 {interval} 秒。")
+
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TIMELINE_COLUMNS)
+        next_sample = start
+        while not stop_event.is_set():
+            now = time.monotonic()
+            client_transactions = transaction_counter.value
+
+            server = dict.fromkeys(SERVER_COUNTERS)
+            db_up = False
+            try:
+                if conn is None or conn.closed:
+                    conn = _connect(db_config)
+                with conn.cursor() as cur:
+                    cur.execute(STATS_SQL if backend.supports_server_stats else "SELECT 1;")
+                    row = cur.fetchone()
+                if row is not None and backend.supports_server_stats:
+                    server = dict(zip(SERVER_COUNTERS, (int(v) for v in row)))
+                db_up = row is not None
+            except backend.Error:
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+            sample = dict(server, client_transactions=client_transactions, time=now)
+            dt = now - previous['time'] if previous else 0.0
+            rates = {}
+            for column, rate_column in (('client_transactions', 'client_tps'),
+                                        ('xact_commit', 'commit_rate'), ('xact_rollback', 'rollback_rate'),
+                                        ('n_tup_ins', 'ins_rate'), ('n_tup_upd', 'upd_rate'),
+                                        ('n_tup_del', 'del_rate')):
+                rates[rate_column] = _rate(sample[column], previous[column] if previous else None, dt)
+
+            writer.writerow([
+                datetime.datetime.now().isoformat(timespec='milliseconds'), round(now - start, 3), int(db_up),
+                client_transactions, rates['client_tps'],
+                server['xact_commit'], server['xact_rollback'], rates['commit_rate'], rates['rollback_rate'],
+                server['n_tup_ins'], server['n_tup_upd'], server['n_tup_del'],
+                rates['ins_rate'], rates['upd_rate'], rates['del_rate']
+            ])
+            f.flush()
+
+            if now - last_print >= print_interval:
+                state = f"提交/秒: {rates['commit_rate']}" if db_up else "数据库不可用"
+                print(f"[{time.strftime('%H:%M:%S')}] 客户端事务: {client_transactions}, "
+                      f"客户端 TPS: {rates['client_tps']}, {state}")
+                last_print = now
+
+            previous = sample
+            next_sample += interval
+            stop_event.wait(max(0.0, next_sample - time.monotonic()))
+
+    if conn is not None:
+        conn.close()
+    print("吞吐量时间线记录停止。")
@@ -0,0 +1,207 @@
+import argparse
+import json
+from multiprocessing import Pool
+
+import psycopg2
+
+from connection import DSN
+from settings import (
+    VERIFY_PROCESSES,
+    VERIFY_RANGES_PER_PROCESS,
+    VERIFY_MAX_VIOLATIONS
+)
+
+# 恢复后的一致性检查。每项检查是一条集合式 SQL，按键范围切分成多个任务，由进程池并行执行；
+# 所有任务通过 pg_export_snapshot() 共享协调连接的快照，检查结果对应同一时刻的数据库状态，
+# 即使工作负载仍在运行也不会因为并发修改报出假的违反。
+#
+# 注意：CRUD 的 update 事务会把 Order.payment 改成随机值，insert 事务插入的订单没有订单项，
+# 所以 order_payment 只检查有订单项的订单，并且只有在 update 比例为 0 时才是严格的不变量。
+
+# 检查名 -> (切分范围的表, 切分列, SQL)。SQL 以 %(lo)s/%(hi)s 限定范围（None 表示不限），
+# 返回 (键, 期望值, 实际值)。
+CHECKS = {
+    # Order.payment = SUM(OrderItem.total_price)
+    'order_payment': ('Order', 'order_code', """
+        SELECT o.order_code, SUM(oi.total_price), o.payment
+        FROM "Order" AS o
+        JOIN "OrderItem" AS oi ON oi.order_code = o.order_code
+        WHERE (%(lo)s::bigint IS NULL OR o.order_code >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR o.order_code < %(hi)s)
+          AND (%(lo)s::bigint IS NULL OR oi.order_code >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR oi.order_code < %(hi)s)
+        GROUP BY o.order_code, o.payment
+        HAVING o.payment IS DISTINCT FROM SUM(oi.total_price)
+        LIMIT %(limit)s;
+    """),
+    # OrderItem.total_price = current_unit_price * quantity
+    'order_item_total': ('OrderItem', 'id', """
+        SELECT id, current_unit_price * quantity, total_price
+        FROM "OrderItem"
+        WHERE (%(lo)s::bigint IS NULL OR id >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR id < %(hi)s)
+          AND total_price IS DISTINCT FROM current_unit_price * quantity
+        LIMIT %(limit)s;
+    """),
+    # OrderItem.current_unit_price = Product.price；给出 product_ids 时只检查这些（被修改过价格的）商品
+    'order_item_unit_price': ('OrderItem', 'id', """
+        SELECT oi.id, p.price, oi.current_unit_price
+        FROM "OrderItem" AS oi
+        JOIN "Product" AS p ON p.id = oi.product_id
+        WHERE (%(lo)s::bigint IS NULL OR oi.id >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR oi.id < %(hi)s)
+          AND (%(product_ids)s::int[] IS NULL OR oi.product_id = ANY(%(product_ids)s::int[]))
+          AND oi.current_unit_price IS DISTINCT FROM p.price
+        LIMIT %(limit)s;
+    """),
+    # 订单项引用的订单必须存在（外键为 ON DELETE SET NULL，非空引用不应悬空）
+    'orphan_order_item_order': ('OrderItem', 'id', """
+        SELECT oi.id, oi.order_code, NULL
+        FROM "OrderItem" AS oi
+        WHERE (%(lo)s::bigint IS NULL OR oi.id >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR oi.id < %(hi)s)
+          AND oi.order_code IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM "Order" AS o WHERE o.order_code = oi.order_code)
+        LIMIT %(limit)s;
+    """),
+    'orphan_order_item_product': ('OrderItem', 'id', """
+        SELECT oi.id, oi.product_id, NULL
+        FROM "OrderItem" AS oi
+        WHERE (%(lo)s::bigint IS NULL OR oi.id >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR oi.id < %(hi)s)
+          AND oi.product_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM "Product" AS p WHERE p.id = oi.product_id)
+        LIMIT %(limit)s;
+    """),
+    'orphan_order_user': ('Order', 'id', """
+        SELECT o.id, o.user_id, NULL
+        FROM "Order" AS o
+        WHERE (%(lo)s::bigint IS NULL OR o.id >= %(lo)s)
+          AND (%(hi)s::bigint IS NULL OR o.id < %(hi)s)
+          AND o.user_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM "User" AS u WHERE u.id = o.user_id)
+        LIMIT %(limit)s;
+    """),
+}
+
+# 违反记录中键的含义
+CHECK_KEYS = {
+    'order_payment': 'order_code',
+    'order_item_total': 'order_item_id',
+    'order_item_unit_price': 'order_item_id',
+    'orphan_order_item_order': 'order_item_id',
+    'orphan_order_item_product': 'order_item_id',
+    'orphan_order_user': 'order_id',
+}
+
+SAMPLE_ROWS = 20000  # 估算范围边界时抽样的行数
+
+
+def _split_ranges(cur, table, column, parts):
+    # 按抽样分位数切分，订单号分布不均匀时各范围的行数也大致相同；首尾范围不设界
+    if parts <= 1:
+        return [(None, None)]
+    cur.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass;", (f'"{table}"',))
+    row = cur.fetchone()
+    estimated_rows = max(row[0] if row else 0, 0)
+    if estimated_rows < parts * 1000:
+        return [(None, None)]
+    percent = min(100.0, SAMPLE_ROWS * 100.0 / estimated_rows)
+    cur.execute(f'SELECT {column} FROM "{table}" TABLESAMPLE SYSTEM (%s) ORDER BY 1;', (percent,))
+    sample = [r[0] for r in cur.fetchall()]
+    if len(sample) < parts:
+        return [(None, None)]
+    bounds = sorted(set(sample[len(sample) * i // parts] for i in range(1, parts)))
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def _run_check(task):
+    check, lo, hi, snapshot, product_ids, limit = task
+    sql = CHECKS[check][2]
+    conn = psycopg2.connect(dsn=DSN)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("BEGIN TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            if snapshot is not None:
+                cur.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+            cur.execute(sql, {'lo': lo, 'hi': hi, 'product_ids': product_ids, 'limit': limit})
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        conn.close()
+    return [{'check': check, CHECK_KEYS[check]: key,
+             'expected': None if expected is None else str(expected),
+             'actual': None if actual is None else str(actual)}
+            for key, expected, actual in rows]
+
+
+def verify_consistency(checks=None, product_ids=None, processes=VERIFY_PROCESSES,
+                       ranges_per_process=VERIFY_RANGES_PER_PROCESS, max_violations=VERIFY_MAX_VIOLATIONS):
+    # 返回违反列表，每条为 {'check', 键名, 'expected', 'actual'}，数值以字符串表示，可直接 json.dumps
+    checks = list(checks or CHECKS)
+    for check in checks:
+        if check not in CHECKS:
+            raise ValueError(f"未知的一致性检查: {check}")
+    product_ids = list(product_ids) if product_ids else None
+
+    coordinator = psycopg2.connect(dsn=DSN)
+    try:
+        with coordinator.cursor() as cur:
+            cur.execute("BEGIN TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+            cur.execute("SELECT pg_export_snapshot();")
+            snapshot = cur.fetchone()[0]
+            ranges = {}
+            for check in checks:
+                table, column, _ = CHECKS[check]
+                if (table, column) not in ranges:
+                    ranges[(table, column)] = _split_ranges(cur, table, column, processes * ranges_per_process)
+        tasks = [(check, lo, hi, snapshot, product_ids, max_violations)
+                 for check in checks
+                 for lo, hi in ranges[(CHECKS[check][0], CHECKS[check][1])]]
+        # 导出的快照只在协调事务打开期间有效，所有任务完成后才结束协调事务
+        with Pool(processes) as pool:
+            results = pool.map(_run_check, tasks, chunksize=1)
+    finally:
+        coordinator.rollback()
+        coordinator.close()
+
+    violations = []
+    per_check = {}
+    for rows in results:
+        for violation in rows:
+            check = violation['check']
+            if per_check.get(check, 0) < max_violations:
+                per_check[check] = per_check.get(check, 0) + 1
+                violations.append(violation)
+    return violations
+
+
+def print_violations(violations, title="一致性检查", limit=10):
+    if not violations:
+        print(f"{title}: 未发现违反。")
+        return
+    counts = {}
+    for violation in violations:
+        counts[violation['check']] = counts.get(violation['check'], 0) + 1
+    print(f"{title}: 发现 {len(violations)} 处违反 " + ", ".join(f"{c}={n}" for c, n in sorted(counts.items())))
+    for violation in violations[:limit]:
+        print(f"  {json.dumps(violation, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行检查订单数据的一致性不变量。")
+    parser.add_argument('--checks', nargs='+', choices=sorted(CHECKS), help="要执行的检查，默认全部")
+    parser.add_argument('--product-ids', type=int, nargs='+', help="order_item_unit_price 只检查这些商品")
+    parser.add_argument('--processes', type=int, default=VERIFY_PROCESSES)
+    parser.add_argument('--output', help="把违反列表以 JSON 写入该文件")
+    args = parser.parse_args()
+
+    violations = verify_consistency(args.checks, args.product_ids, args.processes)
+    print_violations(violations)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(violations, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+
+from CRUD import DBConn, OrderTransactionalWorker
+from multiple import MultiTableOperations
+from fault_mode import MULTI_TABLE_TRANSACTIONS, run_transaction
+from wal_stats import sample_wal, counter_delta
+from settings import (
+    TRANSACTION_RATIOS,
+    WAL_PROFILE_TRANSACTIONS,
+    WAL_STATS_FLUSH_WAIT
+)
+
+# 每种事务类型生成的 WAL：逐类型串行执行 WAL_PROFILE_TRANSACTIONS 个事务，前后各采样一次 WAL 位置和
+# pg_stat_wal。并发负载下 LSN 之差混有其他会话的 WAL，无法归属到单个事务，因此单独串行测量。
+# 后端至多每秒上报一次 pg_stat_wal，结束采样前等待 WAL_STATS_FLUSH_WAIT 秒；等待期间后台进程
+# 写入的少量 WAL 也会计入。FPI 数量取决于距上次检查点的远近，检查点之后第一次修改的页面才写整页。
+
+
+def profile_transactions(trx_types=None, transactions=WAL_PROFILE_TRANSACTIONS, flush_wait=WAL_STATS_FLUSH_WAIT):
+    trx_types = list(trx_types or TRANSACTION_RATIOS)
+    multi_ops = MultiTableOperations()
+    results = []
+    with DBConn() as conn:
+        worker = OrderTransactionalWorker(0, conn, transaction_ratios=TRANSACTION_RATIOS)
+        time.sleep(flush_wait)
+        before = sample_wal()
+        if before is None:
+            print("当前后端不支持 WAL 采样。")
+            return results
+        for trx_type in trx_types:
+            source = multi_ops if trx_type in MULTI_TABLE_TRANSACTIONS else worker
+            failed = 0
+            for _ in range(transactions):
+                source.last_error = None
+                result = run_transaction(worker, multi_ops, trx_type)
+                if result is False or source.last_error is not None:
+                    failed += 1
+            time.sleep(flush_wait)
+            after = sample_wal()
+            if after is None:
+                break
+            records = counter_delta(after, before, 'wal_records')
+            fpi = counter_delta(after, before, 'wal_fpi')
+            results.append({
+                'trx_type': trx_type,
+                'transactions': transactions,
+                'failed': failed,
+                'wal_bytes_per_trx': (after['lsn'] - before['lsn']) / transactions,
+                'records_per_trx': records / transactions if records is not None else None,
+                'fpi_per_trx': fpi / transactions if fpi is not None else None,
+            })
+            print(f"{trx_type}: 完成 {transactions} 个事务。")
+            before = after
+    return results
+
+
+def print_wal_profile(results):
+    print("\n--- 每种事务类型的 WAL 生成量 ---")
+    print(f"{'事务类型':<36}{'次数':>8}{'失败':>6}{'WAL/事务(B)':>14}{'记录/事务':>12}{'FPI/事务':>10}")
+    for r in results:
+        records = f"{r['records_per_trx']:.1f}" if r['records_per_trx'] is not None else '-'
+        fpi = f"{r['fpi_per_trx']:.2f}" if r['fpi_per_trx'] is not None else '-'
+        print(f"{r['trx_type']:<36}{r['transactions']:>8}{r['failed']:>6}{r['wal_bytes_per_trx']:>14.0f}"
+              f"{records:>12}{fpi:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="串行测量每种事务类型生成的 WAL 字节数、记录数和整页写入数。")
+    parser.add_argument('--types', nargs='+', choices=sorted(TRANSACTION_RATIOS), help="要测量的事务类型，默认全部")
+    parser.add_argument('--transactions', type=int, default=WAL_PROFILE_TRANSACTIONS, help="每种类型执行的事务数")
+    parser.add_argument('--output', help="把结果以 JSON 写入该文件")
+    args = parser.parse_args()
+
+    results = profile_transactions(args.types, args.transactions)
+    print_wal_profile(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
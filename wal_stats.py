@@ -0,0 +1,181 @@
+import csv
+import datetime
+import os
+import time
+
+from backends import get_backend
+from settings import WAL_RECOVERY_LOG
+
+# WAL 量统计。采样值是 backend.wal_status() 的结果加上采样时间 time（time.time() 秒）：
+#   lsn / redo_lsn   WAL 插入位置和最近一次检查点的 redo 位置（字节），lsn - redo_lsn 即崩溃时需要重放的 WAL 量
+#   wal_records / wal_fpi / wal_bytes   pg_stat_wal 累计值，PostgreSQL 14 以下为 None
+# pg_stat_wal 在崩溃恢复后清零，跨越故障的阶段计数器变小时把当前值当作增量（与吞吐量时间线相同）。
+#
+# 每次故障 kill 前的采样和测得的恢复时间追加到 WAL_RECOVERY_LOG，跨运行累积后用最小二乘拟合
+# 恢复时间 ≈ a + b × 距检查点的 WAL(MB)，据此从负载的 WAL 生成速率和检查点间隔估算 RTO。
+
+MB = 1024 * 1024
+
+RECOVERY_LOG_COLUMNS = ['timestamp', 'label', 'backend', 'wal_since_checkpoint_mb', 'checkpoint_age_s',
+                        'recovery_time_s', 'replay_mb_per_s']
+
+
+def sample_wal(db_config=None):
+    # 单独建立一个自动提交连接采样，失败或后端不支持时返回 None
+    backend = get_backend()
+    try:
+        conn = backend.connect(db_config, autocommit=True, connect_timeout=2)
+        try:
+            status = backend.wal_status(conn.cursor())
+        finally:
+            conn.close()
+    except backend.Error as e:
+        print(f"WAL 采样失败: {e}")
+        return None
+    if status is not None:
+        status['time'] = time.time()
+    return status
+
+
+class WalSampler:
+    # 在预先建立的连接上反复采样，kill 前采样只有一次查询往返，不再临时建立连接；
+    # 连接失效（例如数据库重启后）时重连一次再采样
+    def __init__(self, db_config=None):
+        self.db_config = db_config
+        self.conn = None
+
+    def sample(self):
+        backend = get_backend()
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = backend.connect(self.db_config, autocommit=True, connect_timeout=2)
+                status = backend.wal_status(self.conn.cursor())
+                break
+            except backend.Error as e:
+                self.close()
+                if attempt:
+                    print(f"WAL 采样失败: {e}")
+                    return None
+        if status is not None:
+            status['time'] = time.time()
+        return status
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except get_backend().Error:
+                pass
+            self.conn = None
+
+
+def wal_since_checkpoint(sample):
+    if sample is None:
+        return None
+    return sample['lsn'] - sample['redo_lsn']
+
+
+def counter_delta(after, before, key):
+    if after is None or before is None or after[key] is None or before[key] is None:
+        return None
+    delta = after[key] - before[key]
+    return delta if delta >= 0 else after[key]
+
+
+class WalPhaseLog:
+    # 阶段边界的 WAL 采样，相邻两次采样之间为一个阶段
+    def __init__(self):
+        self.samples = []
+
+    def add(self, label, sample):
+        if sample is not None:
+            self.samples.append((label, sample))
+
+    def mark(self, label, db_config=None):
+        self.add(label, sample_wal(db_config))
+
+    def phases(self):
+        rows = []
+        for (start_label, start), (end_label, end) in zip(self.samples, self.samples[1:]):
+            seconds = end['time'] - start['time']
+            wal = end['lsn'] - start['lsn']
+            rows.append({
+                'phase': f"{start_label} -> {end_label}",
+                'seconds': seconds,
+                'wal_mb': wal / MB,
+                'mb_per_s': wal / MB / seconds if seconds > 0 else 0.0,
+                'records': counter_delta(end, start, 'wal_records'),
+                'fpi': counter_delta(end, start, 'wal_fpi'),
+            })
+        return rows
+
+    def print_report(self):
+        rows = self.phases()
+        if not rows:
+            return
+        print("\n--- 各阶段 WAL 生成量 ---")
+        print(f"{'阶段':<40}{'秒':>8}{'WAL(MB)':>10}{'MB/秒':>8}{'记录数':>12}{'FPI':>10}")
+        for row in rows:
+            records = row['records'] if row['records'] is not None else '-'
+            fpi = row['fpi'] if row['fpi'] is not None else '-'
+            print(f"{row['phase']:<40}{row['seconds']:>8.1f}{row['wal_mb']:>10.1f}{row['mb_per_s']:>8.1f}"
+                  f"{records:>12}{fpi:>10}")
+
+
+def record_recovery(timeline, path=WAL_RECOVERY_LOG):
+    # 把一次故障的 kill 前 WAL 采样和恢复时间追加到 CSV，返回写入的行（缺少任一项时不写）
+    sample = timeline.wal_at_kill
+    if sample is None or timeline.recovery_time is None:
+        return None
+    wal_mb = wal_since_checkpoint(sample) / MB
+    row = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'label': timeline.label,
+        'backend': get_backend().name,
+        'wal_since_checkpoint_mb': round(wal_mb, 3),
+        'checkpoint_age_s': round(sample['time'] - sample['checkpoint_time'], 3),
+        'recovery_time_s': round(timeline.recovery_time, 3),
+        'replay_mb_per_s': round(wal_mb / timeline.recovery_time, 1) if timeline.recovery_time > 0 else None,
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RECOVERY_LOG_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+    return row
+
+
+def fit_recovery_model(path=WAL_RECOVERY_LOG):
+    # 返回 (a, b, r2, 样本数)：恢复时间(秒) ≈ a + b × 距检查点的 WAL(MB)；样本不足时返回 None
+    if not os.path.exists(path):
+        return None
+    points = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['backend'] == get_backend().name:
+                points.append((float(row['wal_since_checkpoint_mb']), float(row['recovery_time_s'])))
+    n = len(points)
+    if n < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    if sxx == 0:
+        return None
+    b = sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+    a = mean_y - b * mean_x
+    syy = sum((y - mean_y) ** 2 for _, y in points)
+    r2 = 1 - sum((y - a - b * x) ** 2 for x, y in points) / syy if syy > 0 else 1.0
+    return a, b, r2, n
+
+
+def print_recovery_model(path=WAL_RECOVERY_LOG):
+    model = fit_recovery_model(path)
+    if model is None:
+        print(f"\n{path} 中的样本不足，暂不拟合恢复时间与 WAL 量的关系。")
+        return
+    a, b, r2, n = model
+    print(f"\n恢复时间拟合（{n} 次故障）: 恢复时间 ≈ {a:.3f} 秒 + {b * 1000:.2f} 毫秒/MB × 距检查点的 WAL，R² = {r2:.3f}")